@@ -1,49 +1,104 @@
 import os
+import math
+import asyncio
 import datetime as t
 import time  as tm
 import minizinc
+from common.bus import shared_bounds
+from common.metrics import new_metrics, record
+from common.telemetry import set_context
+from common.trajectory import add_event
 
+# Solvers raced against each other by the portfolio mode
+PORTFOLIO_SOLVERS = ('gecode', 'chuffed')
+# Seconds between two checks of the monitor of a run, if it has one
+MONITOR_POLL = 0.5
+
+
+def warm_journeys(initial, m, n):
+    """
+    Return the journeys of a solution (routes of 1-based items) as the warm start of the model,
+    courier by courier and padded with the depot, empty when there is none or a route is longer
+    than the model allows.
+    """
+    limit = math.ceil(1.5 * n / m) + 2
+    if not initial or any(len(route) > limit - 2 for route in initial):
+        return []
+    return [stop for route in initial for stop in [n + 1] + list(route) + [n + 1] * (limit - 1 - len(route))]
+
+
+def add_instance_data(model, instance_name, data=None, warm=()):
+    """
+    Add the data of the instance to the model: CSP/instances/{instance_name}.dzn, or the given
+    (m, n, l, s, D) for instances without a .dzn file (e.g. the generated benchmark instances),
+    and the warm start of the search (see warm_journeys).
+    """
+    model["warm_journeys"] = list(warm)
+    if data is None:
+        model.add_file(os.path.abspath(f"CSP/instances/{instance_name}.dzn"))
+        return
+    m, n, l, s, D = data
+    model["m"] = m
+    model["n"] = n
+    model["l"] = list(l)
+    model["s"] = list(s)
+    model["D"] = [list(row) for row in D]
+
+
+def solve_instance_csp(instance_name, solver="gecode", timeout=300, queue=None, processes=None, bounds=None, data=None,
+                       monitor=None, warm=()):
+    # Labels of the telemetry events of the run
+    set_context(approach='CSP', solver=solver, instance=instance_name)
+    if solver == 'portfolio':
+        return solve_instance_csp_portfolio(instance_name, timeout=timeout, processes=processes, bounds=bounds, data=data,
+                                            warm=warm)
 
-def solve_instance_csp(instance_name, solver="gecode", timeout=300, queue=None):
     model_path = os.path.abspath(f"CSP/model.mzn")
-    instance_path = os.path.abspath(f"CSP/instances/{instance_name}.dzn")
 
     # Load the MiniZinc model
     model = minizinc.Model()
     model.add_file(model_path)
-    model.add_file(instance_path)
+    add_instance_data(model, instance_name, data, warm)
 
     # Create a MiniZinc instance
     instance = minizinc.Instance(minizinc.Solver.lookup(solver), model)
 
     # Set the time limit (in milliseconds)
     instance["time_limit"] = timeout * 1000
+    set_objective_bounds(instance, bounds)
 
     try:
-        # Solve the instance
+        # Solve the instance, following its intermediate solutions for the trajectory
         start_time = tm.time()
-        result = instance.solve(timeout=t.timedelta(seconds=timeout))
+        trajectory = []
+        result, last_solution, stopped = asyncio.run(_solve_streaming(instance, timeout, processes, bounds,
+                                                                      trajectory, start_time, monitor))
         end_time = tm.time()
         total_time = end_time - start_time 
+        if result is None:
+            # Stopped by the monitor before the solver reported anything
+            return {'time': timeout, 'optimal': False, 'obj': "N/A", 'sol': []}
         # print(result.status)
         if result.status is minizinc.Status.UNSATISFIABLE:
                                 return {
                                     'time': int(result.statistics['solveTime'].total_seconds()), 
                                     'optimal': False, 
                                     'obj': "N/A", 
-                                    'sol': []
+                                    'sol': [],
+                                    'metrics': csp_metrics(result.statistics)
                                     }
                                
-        elif result.status is minizinc.Status.UNKNOWN:
+        elif result.status is minizinc.Status.UNKNOWN or last_solution is None:
             return {
                 'time': timeout, 
                 'optimal': False, 
                 'obj': "N/A", 
-                'sol': []
+                'sol': [],
+                'metrics': csp_metrics(result.statistics)
                 }
         
         else:
-            if total_time < timeout:
+            if total_time < timeout and not stopped:
                 optimal = True
                 time = result.statistics['solveTime'].total_seconds() 
             else:
@@ -51,17 +106,22 @@ def solve_instance_csp(instance_name, solver="gecode", timeout=300, queue=None):
                 time =timeout
             
            
-            objective = result['z']
-            solution = result['journeys']
+            objective = last_solution['z']
+            solution = last_solution['journeys']
             for i in range(len(solution)):
                 solution[i] = [num for num in solution[i] if num != max(solution[i])] 
+            if result.status is minizinc.Status.OPTIMAL_SOLUTION:
+                # Optimal on the routes of the model (see warm_journeys), not shared with the other engines
+                add_event(trajectory, end_time - start_time, objective, objective, shared=False)
             
 
             return {
                 'time': int(time), 
                 'optimal': optimal, 
                 'obj': objective, 
-                'sol': solution
+                'sol': solution,
+                'metrics': csp_metrics(result.statistics),
+                'trajectory': trajectory
                 }
             
     
@@ -74,6 +134,163 @@ def solve_instance_csp(instance_name, solver="gecode", timeout=300, queue=None):
             'sol': []
         }
 
+def set_objective_bounds(instance, bounds):
+    # Bounds on the objective computed by common/bounds.py, upper bound omitted if unknown
+    if bounds is None:
+        return
+    # In a portfolio, narrowed by the bounds found meanwhile by the other engines (common/bus.py)
+    lower, upper = shared_bounds(*bounds)
+    instance["z_lb"] = lower
+    if upper is not None:
+        instance["z_ub"] = upper
+
+
+async def _solve_streaming(instance, timeout, processes, bounds, trajectory, start_time, monitor=None):
+    # Returns the final result (status and statistics), the last one holding a solution and
+    # whether the monitor (see common/workers.py) stopped the search before its end
+    lower = bounds[0] if bounds is not None else None
+    state = {'result': None, 'last_solution': None}
+
+    async def follow():
+        async for result in instance.solutions(timeout=t.timedelta(seconds=timeout),
+                                               intermediate_solutions=True,
+                                               processes=processes):
+            state['result'] = result
+            if result.solution is not None:
+                state['last_solution'] = result
+                add_event(trajectory, tm.time() - start_time, result['z'], lower)
+                if monitor is not None:
+                    monitor.incumbent({'obj': result['z']})
+
+    search = asyncio.ensure_future(follow())
+    stopped = False
+    while monitor is not None and not search.done():
+        await asyncio.wait({search}, timeout=MONITOR_POLL)
+        if not search.done() and monitor.should_stop():
+            # Cancelling the search kills the solver process
+            search.cancel()
+            stopped = True
+    await asyncio.gather(search, return_exceptions=stopped)
+    return state['result'], state['last_solution'], stopped
+
+
+def _seconds(value):
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+
+def csp_metrics(statistics):
+    # MiniZinc reports the flattening (model build) and search times itself,
+    # the memory is the peak of the solver processes run so far
+    metrics = new_metrics()
+    metrics['build_time'] = _seconds(statistics.get('flatTime', 0))
+    metrics['solve_time'] = _seconds(statistics.get('solveTime', 0))
+    if 'flatIntVars' in statistics or 'flatBoolVars' in statistics:
+        metrics['variables'] = statistics.get('flatIntVars', 0) + statistics.get('flatBoolVars', 0)
+    if 'flatIntConstraints' in statistics or 'flatBoolConstraints' in statistics:
+        metrics['constraints'] = statistics.get('flatIntConstraints', 0) + statistics.get('flatBoolConstraints', 0)
+    return record(metrics, statistics, children=True)
+
+
+async def _race_solver(model, solver, timeout, processes, bounds, res, start_time):
+    # Runs a single solver of the portfolio, keeping its incumbent in res
+    instance = minizinc.Instance(minizinc.Solver.lookup(solver), model)
+    set_objective_bounds(instance, bounds)
+    lower = bounds[0] if bounds is not None else None
+    res['trajectory'] = []
+
+    async for result in instance.solutions(timeout=t.timedelta(seconds=timeout),
+                                           intermediate_solutions=True,
+                                           processes=processes):
+        if result.solution is not None:
+            solution = result['journeys']
+            for i in range(len(solution)):
+                solution[i] = [num for num in solution[i] if num != max(solution[i])]
+            res['obj'] = result['z']
+            res['sol'] = solution
+            add_event(res['trajectory'], tm.time() - start_time, res['obj'], lower)
+
+        res['metrics'] = csp_metrics(result.statistics)
+
+        if result.status is minizinc.Status.OPTIMAL_SOLUTION:
+            res['optimal'] = True
+            res['time'] = int(tm.time() - start_time)
+            add_event(res['trajectory'], tm.time() - start_time, res['obj'], res['obj'], shared=False)
+        elif result.status is minizinc.Status.UNSATISFIABLE:
+            res['time'] = int(tm.time() - start_time)
+
+
+async def _race(model, solvers, timeout, processes, bounds):
+    start_time = tm.time()
+    results = {solver: {'time': timeout, 'optimal': False, 'obj': "N/A", 'sol': []} for solver in solvers}
+    tasks = {
+        asyncio.ensure_future(_race_solver(model, solver, timeout,
+                                           processes if solver == 'gecode' else None,
+                                           bounds, results[solver], start_time)): solver
+        for solver in solvers
+    }
+
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                print(f'{tasks[task]}: {task.exception()}')
+
+        # As soon as one solver proves optimality the others are stopped
+        if any(results[tasks[task]]['optimal'] for task in done):
+            for task in pending:
+                task.cancel()
+                results[tasks[task]]['stopped'] = True
+            await asyncio.gather(*pending, return_exceptions=True)
+            pending = set()
+
+    return results
+
+
+def solve_instance_csp_portfolio(instance_name, solvers=PORTFOLIO_SOLVERS, timeout=300, processes=None, bounds=None, data=None,
+                                 warm=()):
+    """
+    Race several MiniZinc solvers on the same instance and keep the best answer.
+    Gecode runs multi-threaded with `processes` threads (all the cores but the one left to the
+    other solvers by default), and once a solver proves optimality the others are stopped.
+    :return: the result of the winning solver, with the result of every solver under 'portfolio'
+    """
+    model_path = os.path.abspath(f"CSP/model.mzn")
+
+    model = minizinc.Model()
+    model.add_file(model_path)
+    add_instance_data(model, instance_name, data, warm)
+
+    if processes is None:
+        processes = max(1, (os.cpu_count() or 1) - (len(solvers) - 1))
+
+    try:
+        results = asyncio.run(_race(model, solvers, timeout, processes, bounds))
+    except Exception as e:
+        print(e)
+        return {
+            'time': 0,
+            'optimal': False,
+            'obj': 'N/A',
+            'sol': []
+        }
+
+    # The winner is the optimal solver if any, otherwise the one with the best objective
+    solved = [solver for solver in solvers if results[solver]['sol']]
+    if not solved:
+        res = {'time': timeout, 'optimal': False, 'obj': 'N/A', 'sol': []}
+        winner = None
+    else:
+        winner = min(solved, key=lambda solver: (not results[solver]['optimal'], results[solver]['obj']))
+        res = dict(results[winner])
+        if not res['optimal']:
+            res['time'] = timeout
+
+    res['winner'] = winner
+    res['portfolio'] = results
+    return res
+
+
 def main():
     instances_folder = 'instances'
     for filename in os.listdir(instances_folder):
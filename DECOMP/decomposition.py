@@ -0,0 +1,236 @@
+"""
+Decomposition engine (DECOMP): cluster first, route second.
+
+The items are first assigned to the couriers by the construction and local search of
+HEUR/heuristic.py, which balance the estimated route lengths and respect the capacities. The route of every courier is
+then an independent single-courier problem (a TSP over its items), solved exactly by the Held-Karp
+dynamic program of common/polish.py up to MAX_DP_ITEMS items, in milliseconds, with the routes of
+all the couriers solved in parallel on min(cores, m) threads.
+
+The assignment is then improved by moving items off the longest route: the relocations and swaps
+with the best estimated objective are tried, two routes per move solved again in parallel, and
+the best one improving the objective is kept, until none does, the objective meets the lower
+bound of common/bounds.py or the time is over.
+
+Routes of more than MAX_DP_ITEMS items are out of reach of the dynamic program: they keep the
+order of the heuristic, improved by 2-opt and Or-opt. Every route is solved once, the routes
+being cached by their set of items.
+"""
+import os
+import threading
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from common.bounds import lower_bound
+from common.instance import read_dat_file
+from common.metrics import new_metrics, record
+from common.polish import MAX_DP_ITEMS, polish_route, route_path, path_length
+from common.profiling import Profile
+from common.telemetry import set_context
+from common.trajectory import add_event
+from HEUR.heuristic import construct, insertion_costs, local_search, objective
+
+
+class RouteSolver:
+    """
+    Solves the routes of single couriers, `cores` routes at the same time.
+    """
+
+    def __init__(self, n, D, cores=1):
+        self.n = n
+        self.D = D
+        self.executor = ThreadPoolExecutor(max_workers=cores)
+        # Best order and length of each set of items, and whether the order is proven optimal
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.solves = 0
+        self.proven = 0
+
+    def route(self, items):
+        """
+        Return (order, length, proven) of the shortest route found through the items.
+        """
+        key = frozenset(items)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            self.solves += 1
+        # Held-Karp up to MAX_DP_ITEMS items, 2-opt and Or-opt beyond
+        order, length = polish_route(list(items), self.D, self.n)
+        proven = len(items) <= MAX_DP_ITEMS
+        with self.lock:
+            self.cache[key] = (order, length, proven)
+            self.proven += proven
+        return order, length, proven
+
+    def routes(self, routes):
+        # The routes are solved in parallel, each on a thread of its own
+        return list(self.executor.map(self.route, routes))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def moves_off_longest(routes, lengths, l, s, D, n):
+    """
+    Return the moves of an item off the longest route to another courier with room for it, alone
+    (relocation) or in exchange for an item of that courier (swap), as
+    (estimated longest of the two routes, item, courier, item taken back or None), the most
+    promising first. Estimates remove each item from its route and insert it where it costs the least.
+    """
+    a = int(lengths.argmax())
+    if not routes[a]:
+        return []
+    items, gain = _removal_gains(routes[a], D, n)
+    load = s[items].sum()
+    moves = []
+    for b in range(len(routes)):
+        if b == a:
+            continue
+        cost, _ = insertion_costs(routes[b], items, D, n)
+        load_b = s[routes[b]].sum()
+        estimate = np.maximum(lengths[a] - gain, lengths[b] + cost)
+        fits = load_b + s[items] <= l[b]
+        for index in np.flatnonzero(fits & (estimate < lengths[a])):
+            moves.append((int(estimate[index]), int(items[index]), b, None))
+        if not routes[b]:
+            continue
+        # Swaps of every item of the longest route (rows) with every item of the route b (columns)
+        others, gain_b = _removal_gains(routes[b], D, n)
+        cost_a, _ = insertion_costs(routes[a], others, D, n)
+        estimate = np.maximum(lengths[a] - gain[:, None] + cost_a[None, :],
+                              lengths[b] - gain_b[None, :] + cost[:, None])
+        fits = ((load - s[items][:, None] + s[others][None, :] <= l[a])
+                & (load_b - s[others][None, :] + s[items][:, None] <= l[b]))
+        for row, column in zip(*np.nonzero(fits & (estimate < lengths[a]))):
+            moves.append((int(estimate[row, column]), int(items[row]), b, int(others[column])))
+    return sorted(moves, key=lambda move: move[0])
+
+
+def _removal_gains(route, D, n):
+    # Items of the route and the distance saved by removing each of them
+    path = route_path(route, n)
+    items = path[1:-1]
+    return items, D[path[:-2], items] + D[items, path[2:]] - D[path[:-2], path[2:]]
+
+
+def solve_instance_decomp(m, n, l, s, D, timeout=300, name=None, cores=None, initial=None):
+    """
+    Solve an instance by decomposition.
+    :param initial: a solution (routes of 1-based items) whose assignment is used when it beats the heuristic one
+    :return: the result dict ('time', 'optimal', 'obj', 'sol'), 'obj' being 'N/A' when no
+             capacity-feasible assignment was found
+    """
+    start = time()
+    deadline = start + timeout
+    # A thread per route solved at the same time, never more than the couriers
+    cores = min(cores or os.cpu_count(), m)
+    metrics = new_metrics()
+    trajectory = []
+    profile = Profile('DECOMP', name)
+    # Labels of the telemetry events of the run
+    set_context(approach='DECOMP', instance=name)
+    profile.phase('setup')
+    D = np.asarray(D, dtype=np.int64)
+    l = np.asarray(l, dtype=np.int64)
+    s = np.asarray(s, dtype=np.int64)
+    bound = lower_bound(m, n, l, s, D)
+    add_event(trajectory, time() - start, None, bound)
+
+    profile.phase('assignment')
+    assignment = construct(m, n, l, s, D)
+    if initial is not None:
+        previous = [[item - 1 for item in route] for route in initial]
+        if assignment is None or objective(previous, D, n) < objective(assignment, D, n):
+            assignment = previous
+    if assignment is not None:
+        # Balanced by the lengths of the heuristic routes, the exact ones being solved next
+        assignment = local_search(assignment, l, s, D, n, deadline)
+    result = {'time': 0, 'optimal': False, 'obj': 'N/A', 'sol': []}
+    stats = {}
+    moves = 0
+    if assignment is not None:
+        solver = RouteSolver(n, D, cores=cores)
+        metrics['build_time'] = time() - start
+        profile.phase('routes')
+        heuristic = [path_length(route_path(route, n), D) for route in assignment]
+        if max(heuristic) <= bound:
+            # The heuristic routes already meet the lower bound, there is nothing left to solve
+            solved = [(route, length, False) for route, length in zip(assignment, heuristic)]
+        else:
+            solved = solver.routes(assignment)
+        routes = [order for order, _, _ in solved]
+        lengths = np.array([length for _, length, _ in solved], dtype=np.int64)
+        add_event(trajectory, time() - start, int(lengths.max()), bound)
+
+        profile.phase('moves')
+        tried = set()
+        while lengths.max() > bound and time() < deadline:
+            a = int(lengths.argmax())
+            # One move per core, each move solving two routes again
+            candidates = []
+            new_routes = []
+            for _, item, b, other in moves_off_longest(routes, lengths, l, s, D, n):
+                new_a = [stop for stop in routes[a] if stop != item] + ([other] if other is not None else [])
+                new_b = [stop for stop in routes[b] if stop != other] + [item]
+                key = (frozenset(new_a), frozenset(new_b))
+                if key in tried:
+                    continue
+                tried.add(key)
+                candidates.append(b)
+                new_routes += [new_a, new_b]
+                if len(candidates) == max(1, cores // 2):
+                    break
+            if not candidates:
+                break
+            solved = solver.routes(new_routes)
+
+            best = (int(lengths.max()), int(lengths.sum()), None)
+            for index, b in enumerate(candidates):
+                new_lengths = lengths.copy()
+                new_lengths[a] = solved[2 * index][1]
+                new_lengths[b] = solved[2 * index + 1][1]
+                key = (int(new_lengths.max()), int(new_lengths.sum()))
+                if key < best[:2]:
+                    best = key + (index,)
+            if best[2] is None:
+                continue
+            b = candidates[best[2]]
+            routes[a], lengths[a] = solved[2 * best[2]][:2]
+            routes[b], lengths[b] = solved[2 * best[2] + 1][:2]
+            moves += 1
+            add_event(trajectory, time() - start, int(lengths.max()), bound)
+
+        profile.phase('solution')
+        obj = int(lengths.max())
+        # A single courier has a single route, proven or not by Held-Karp
+        proven = m == 1 and solver.route(routes[0])[2]
+        result['optimal'] = bool(obj <= bound or proven)
+        result['obj'] = obj
+        result['sol'] = [[item + 1 for item in route] for route in routes]
+        if result['optimal']:
+            add_event(trajectory, time() - start, obj, obj)
+        metrics['solve_time'] = time() - start - metrics['build_time']
+        stats = {'route_solves': solver.solves,
+                 'routes_proven': solver.proven, 'moves': moves}
+        solver.close()
+
+    # As for the other engines, a result not proven optimal counts as a timeout
+    result['time'] = int(time() - start) if result['optimal'] else timeout
+    profile.attach(metrics)
+    result['metrics'] = record(metrics, stats)
+    result['trajectory'] = list(trajectory)
+    return result
+
+
+def solve_DECOMP_with_timeout(m, n, l, s, D, timeout: int = 300, name=None, cores=None, initial=None):
+    # The whole decomposition runs in the calling process, the routes on threads
+    return solve_instance_decomp(m, n, l, s, D, timeout=timeout, name=name, cores=cores, initial=initial)
+
+
+if __name__ == '__main__':
+    m, n, l, s, D = read_dat_file('instances/inst13.dat')
+    result = solve_DECOMP_with_timeout(m, n, l, s, D, timeout=60)
+    print("Time:", result['time'])
+    print("Objective:", result['obj'])
+    print("Optimal:", result['optimal'])
@@ -0,0 +1,323 @@
+"""
+Heuristic engine (HEUR), for the instances too large for the exact approaches.
+
+A first solution is built by regret insertion and improved by a local search on the min-max
+objective, whose moves are evaluated in bulk over the distance matrix with NumPy:
+
+    2-opt           reverse a segment of a route (the distances may be asymmetric)
+    relocate        move a segment of up to CROSS_LENGTH items to another route
+    swap            exchange an item of a route with an item of another route
+    cross-exchange  exchange segments of up to CROSS_LENGTH items between two routes
+
+The local search is then iterated: a few items are removed from the current solution and inserted
+back by regret insertion (ruin and recreate) before searching again, until the objective meets
+the lower bound of common/bounds.py (which proves it optimal), the time is over or
+MAX_STAGNATION rounds go by without improvement. The heuristic is not bound to the maximum
+number of items per courier of the CSP, SAT and SMT encodings.
+"""
+from time import time
+import numpy as np
+from common.bounds import greedy_routes, lower_bound
+from common.instance import read_dat_file
+from common.metrics import new_metrics, record
+from common.polish import path_length, route_path, two_opt
+from common.profiling import Profile
+from common.telemetry import set_context
+from common.trajectory import add_event
+
+# Longest segment moved by relocate and cross-exchange
+CROSS_LENGTH = 3
+# Rounds of ruin and recreate without improvement before giving up
+MAX_STAGNATION = 1000
+# Share of the items removed by a round of ruin and recreate
+RUIN_SHARE = 0.2
+
+
+def insertion_costs(route, items, D, n):
+    """
+    Return the cheapest extra distance of inserting each of the items in the route,
+    and the position of the route where it is reached.
+    """
+    path = route_path(route, n)
+    # Extra distance of every item (columns) between every pair of consecutive stops (rows)
+    delta = D[path[:-1]][:, items] + D[items][:, path[1:]].T - D[path[:-1], path[1:]][:, None]
+    position = delta.argmin(axis=0)
+    return delta[position, np.arange(len(items))], position
+
+
+def regret_insertion(routes, items, l, s, D, n):
+    """
+    Insert the items in the routes, each time the item whose best route is the most preferable to
+    its second best (the largest regret; items fitting in a single route come first), in the route
+    left shortest by the insertion.
+    :return: the routes, or None if some item fits in no route
+    """
+    m = len(routes)
+    items = np.asarray(items, dtype=np.int64)
+    lengths = np.array([path_length(route_path(route, n), D) for route in routes], dtype=np.float64)
+    loads = np.array([s[route].sum() for route in routes], dtype=np.int64)
+    cost = np.empty((m, len(items)))
+    position = np.empty((m, len(items)), dtype=np.int64)
+    for courier in range(m):
+        cost[courier], position[courier] = insertion_costs(routes[courier], items, D, n)
+
+    while items.size:
+        # Length of each route after inserting each item, infinite where the item does not fit
+        new_lengths = lengths[:, None] + cost
+        new_lengths[loads[:, None] + s[items][None, :] > l[:, None]] = np.inf
+        if m > 1:
+            best, second = np.partition(new_lengths, 1, axis=0)[:2]
+        else:
+            best, second = new_lengths[0], np.full(len(items), np.inf)
+        if np.isinf(best).any():
+            return None
+        regret = second - best
+        # Largest regret first, then the largest item
+        pick = np.lexsort((-s[items], -regret))[0]
+        courier = int(new_lengths[:, pick].argmin())
+        item = int(items[pick])
+        routes[courier].insert(int(position[courier, pick]), item)
+        lengths[courier] = new_lengths[courier, pick]
+        loads[courier] += s[item]
+
+        items = np.delete(items, pick)
+        cost = np.delete(cost, pick, axis=1)
+        position = np.delete(position, pick, axis=1)
+        if items.size:
+            cost[courier], position[courier] = insertion_costs(routes[courier], items, D, n)
+    return routes
+
+
+def segments(route, length, s, D, n):
+    """
+    Return the segments of `length` consecutive items of the route (length 0: the points where
+    items can be inserted), as arrays over the position i of their first item in the path.
+    """
+    path = route_path(route, n)
+    forward = np.concatenate(([0], np.cumsum(D[path[:-1], path[1:]])))
+    loads = np.concatenate(([0], np.cumsum(np.concatenate(([0], s[route], [0])))))
+    start = np.arange(1, len(path) - length)
+    segment = {
+        'start': start,
+        'prev': path[start - 1],
+        'next': path[start + length],
+        # Arcs from the stop before the segment to the stop after it
+        'removed': forward[start + length] - forward[start - 1],
+        'load': loads[start + length] - loads[start],
+    }
+    if length:
+        segment['first'] = path[start]
+        segment['last'] = path[start + length - 1]
+        segment['inner'] = forward[start + length - 1] - forward[start]
+    return segment
+
+
+def _exchanged_lengths(length, own, other, D):
+    # Length of the route of `own` (rows) after replacing each of its segments with each segment
+    # of `other` (columns)
+    if 'first' in other:
+        added = (D[own['prev'][:, None], other['first'][None, :]] + other['inner'][None, :]
+                 + D[other['last'][None, :], own['next'][:, None]])
+    else:
+        added = np.repeat(D[own['prev'], own['next']][:, None], len(other['start']), axis=1)
+    return length - own['removed'][:, None] + added
+
+
+def best_exchange(a, b, routes, lengths, loads, l, s, D, n):
+    """
+    Return the best exchange of segments (relocate, swap, cross-exchange) between the routes a and b,
+    as (longest, total length, move), or None if no exchange improves the longer of the two routes
+    (or keeps it and shortens the other).
+    """
+    best = (max(lengths[a], lengths[b]), lengths[a] + lengths[b], None)
+    segments_a = [segments(routes[a], p, s, D, n) for p in range(CROSS_LENGTH + 1)]
+    segments_b = [segments(routes[b], q, s, D, n) for q in range(CROSS_LENGTH + 1)]
+    for p, segment_a in enumerate(segments_a):
+        for q, segment_b in enumerate(segments_b):
+            if p == q == 0 or not len(segment_a['start']) or not len(segment_b['start']):
+                continue
+            new_a = _exchanged_lengths(lengths[a], segment_a, segment_b, D)
+            new_b = _exchanged_lengths(lengths[b], segment_b, segment_a, D).T
+            fits = ((loads[a] - segment_a['load'][:, None] + segment_b['load'][None, :] <= l[a])
+                    & (loads[b] - segment_b['load'][None, :] + segment_a['load'][:, None] <= l[b]))
+            if not fits.any():
+                continue
+            longest = np.where(fits, np.maximum(new_a, new_b), np.iinfo(np.int64).max)
+            total = np.where(longest == longest.min(), new_a + new_b, np.iinfo(np.int64).max)
+            i, j = np.unravel_index(total.argmin(), total.shape)
+            key = (int(longest[i, j]), int(total[i, j]))
+            if key < best[:2]:
+                best = key + ((p, int(segment_a['start'][i]), q, int(segment_b['start'][j])),)
+    return best if best[2] is not None else None
+
+
+def apply_exchange(route_a, route_b, move):
+    # Path positions are 1-based in the routes, the depot being at position 0
+    p, i, q, j = move
+    new_a = route_a[:i - 1] + route_b[j - 1:j - 1 + q] + route_a[i - 1 + p:]
+    new_b = route_b[:j - 1] + route_a[i - 1:i - 1 + p] + route_b[j - 1 + q:]
+    return new_a, new_b
+
+
+def local_search(routes, l, s, D, n, deadline):
+    """
+    Improve the routes in place until no move shortens the longest route
+    (or keeps it and shortens the total), or the deadline is reached.
+    """
+    m = len(routes)
+    for courier in range(m):
+        routes[courier] = two_opt(routes[courier], D, n)
+    lengths = np.array([path_length(route_path(route, n), D) for route in routes], dtype=np.int64)
+    loads = np.array([s[route].sum() for route in routes], dtype=np.int64)
+
+    while time() < deadline:
+        improved = False
+        # Only the longest routes can lower the objective
+        for a in np.flatnonzero(lengths == lengths.max()):
+            best = None
+            for b in range(m):
+                if b == a:
+                    continue
+                move = best_exchange(a, b, routes, lengths, loads, l, s, D, n)
+                if move is not None and (best is None or move[:2] < best[0][:2]):
+                    best = (move, b)
+            if best is None:
+                continue
+            (_, _, move), b = best
+            routes[a], routes[b] = apply_exchange(routes[a], routes[b], move)
+            for courier in (a, b):
+                routes[courier] = two_opt(routes[courier], D, n)
+                lengths[courier] = path_length(route_path(routes[courier], n), D)
+                loads[courier] = s[routes[courier]].sum()
+            improved = True
+            break
+        if not improved:
+            break
+    return routes
+
+
+def objective(routes, D, n):
+    # Longest route, then total length: the order in which solutions are compared
+    lengths = [path_length(route_path(route, n), D) for route in routes]
+    return max(lengths), sum(lengths)
+
+
+def ruin(routes, count, D, rng):
+    """
+    Remove `count` items from the routes: the items closest to a random item of the longest route
+    or, every other round, random items.
+    :return: the remaining routes and the removed items
+    """
+    items = [item for route in routes for item in route]
+    count = min(count, len(items))
+    if rng.random() < 0.5:
+        longest = max(routes, key=len)
+        seed = longest[rng.integers(len(longest))]
+        # Closeness in both directions, since the distances may be asymmetric
+        closeness = D[seed, items] + D[items, seed]
+        removed = {items[index] for index in np.argsort(closeness, kind='stable')[:count]}
+    else:
+        removed = set(rng.choice(items, size=count, replace=False).tolist())
+    return [[item for item in route if item not in removed] for route in routes], sorted(removed)
+
+
+def construct(m, n, l, s, D):
+    """
+    Return the best first solution among regret insertion and the greedy heuristics of
+    common/bounds.py, None if none of them fits all the items.
+    """
+    candidates = [regret_insertion([[] for _ in range(m)], range(n), l, s, D, n),
+                  greedy_routes(m, n, l, s, D),
+                  greedy_routes(m, n, l, s, D, packing=True)]
+    candidates = [routes for routes in candidates if routes is not None]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda routes: objective(routes, D, n))
+
+
+def solve_instance_heur(m, n, l, s, D, timeout=300, name=None, seed=0, monitor=None, initial=None):
+    """
+    Solve an instance with the heuristic.
+    :param monitor: stops the search before its end when monitor.should_stop() is True (see common/workers.py)
+    :param initial: a solution (routes of 1-based items) to start from when it beats the construction
+    :return: the result dict ('time', 'optimal', 'obj', 'sol'), 'obj' being 'N/A' when no
+             capacity-feasible solution was found
+    """
+    start = time()
+    deadline = start + timeout
+    metrics = new_metrics()
+    trajectory = []
+    profile = Profile('HEUR', name)
+    # Labels of the telemetry events of the run
+    set_context(approach='HEUR', instance=name)
+    profile.phase('setup')
+    D = np.asarray(D, dtype=np.int64)
+    l = np.asarray(l, dtype=np.int64)
+    s = np.asarray(s, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    bound = lower_bound(m, n, l, s, D)
+    add_event(trajectory, time() - start, None, bound)
+
+    profile.phase('construction')
+    routes = construct(m, n, l, s, D)
+    if initial is not None:
+        previous = [[item - 1 for item in route] for route in initial]
+        if routes is None or objective(previous, D, n) < objective(routes, D, n):
+            routes = previous
+    result = {'time': 0, 'optimal': False, 'obj': 'N/A', 'sol': []}
+    if routes is not None:
+        profile.phase('local_search')
+        best = local_search(routes, l, s, D, n, deadline)
+        best_key = current_key = objective(best, D, n)
+        current = best
+        add_event(trajectory, time() - start, best_key[0], bound)
+        metrics['build_time'] = time() - start
+
+        stagnation = 0
+        count = max(2, round(RUIN_SHARE * n))
+        while (best_key[0] > bound and stagnation < MAX_STAGNATION and time() < deadline
+               and not (monitor is not None and monitor.should_stop())):
+            profile.phase('perturbation')
+            candidate, removed = ruin(current, count, D, rng)
+            candidate = regret_insertion(candidate, removed, l, s, D, n)
+            stagnation += 1
+            if candidate is None:
+                continue
+            profile.phase('local_search')
+            candidate = local_search(candidate, l, s, D, n, deadline)
+            key = objective(candidate, D, n)
+            # Solutions as good as the current one are accepted too, to drift across plateaus
+            if key <= current_key:
+                current, current_key = candidate, key
+            if key < best_key:
+                best, best_key = candidate, key
+                stagnation = 0
+                add_event(trajectory, time() - start, best_key[0], bound)
+
+        profile.phase('solution')
+        result['optimal'] = best_key[0] <= bound
+        result['obj'] = best_key[0]
+        result['sol'] = [[item + 1 for item in route] for route in best]
+        if result['optimal']:
+            add_event(trajectory, time() - start, best_key[0], best_key[0])
+        metrics['solve_time'] = time() - start - metrics['build_time']
+
+    # As for the other engines, a result not proven optimal counts as a timeout
+    result['time'] = int(time() - start) if result['optimal'] else timeout
+    profile.attach(metrics)
+    result['metrics'] = record(metrics)
+    result['trajectory'] = list(trajectory)
+    return result
+
+
+def solve_HEUR_with_timeout(m, n, l, s, D, timeout: int = 300, name=None, seed=0, monitor=None, initial=None):
+    # The heuristic checks its own deadline, so it runs in the calling process
+    return solve_instance_heur(m, n, l, s, D, timeout=timeout, name=name, seed=seed, monitor=monitor, initial=initial)
+
+
+if __name__ == '__main__':
+    m, n, l, s, D = read_dat_file('instances/inst13.dat')
+    result = solve_HEUR_with_timeout(m, n, l, s, D, timeout=60)
+    print("Time:", result['time'])
+    print("Objective:", result['obj'])
+    print("Optimal:", result['optimal'])
@@ -6,31 +6,21 @@ from time import time
 import multiprocessing
 import json
 from gurobipy import setParam, Env
+from common.bounds import compute_bounds
+from common.bus import shared_bounds
+from common.instance import read_dat_file
+from common.metrics import new_metrics, record, mip_statistics
+from common.preprocess import NEIGHBOURS, reduce_instance, sparse_neighbours, sparse_report, widen
+from common.profiling import Profile
+from common.telemetry import set_context
+from common.trajectory import add_event
+from common.workers import set_interrupt
 
 def save_result(filename, result):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         with open(filename, 'w') as file:
             file.write(str(result))
 
-def read_dat_file(file_path):
-    with open(file_path, 'r') as file:
-        # Read the first two integers
-        m = int(file.readline().strip())
-        n = int(file.readline().strip())
-
-        # Read the next line as a list of integers
-        l = list(map(int, file.readline().strip().split()))
-
-        # Read the next line as a list of integers
-        s = list(map(int, file.readline().strip().split()))
-
-        # Read the remaining lines into the distance matrix D
-        D = []
-        for line in file:
-            D.append(list(map(int, line.strip().split())))
-
-    return m, n, l, s, D
-
 def extract_solution_from_path_increment(lst):
     buff = dict()
     for i, val in enumerate(lst):
@@ -39,12 +29,73 @@ def extract_solution_from_path_increment(lst):
     return list(dict(sorted(buff.items())).values())
 
 
-def mip_model(num_couriers, num_locations, max_weights, package_weights, distance_matrix, solver=None, timeout=300, queue=None):
+def terminate_model(model):
+    # Stops a running optimization, only Gurobi can be stopped from another thread
+    # (python-mip does not declare GRBterminate, so it is declared here on its cffi interface)
+    if model.solver_name.upper() not in ('GRB', 'GUROBI'):
+        return
+    from mip import gurobi
+    if not hasattr(terminate_model, 'declared'):
+        gurobi.ffi.cdef("void GRBterminate(GRBmodel *model);")
+        terminate_model.declared = True
+    gurobi.grblib.GRBterminate(model.solver._model)
+
+
+def mip_trajectory(model, build_time, solve_time, with_bound=True):
+    # Progress log of the solver as [elapsed, objective, bound] events, counted from the start of the build.
+    # Distances are integers, so are the objective and the bound (up to the solver tolerance);
+    # the solvers report a missing objective or bound as a huge value (1e100 for Gurobi).
+    # The bound of a restricted model (sparse encoding) is no bound of the instance and is left out
+    def event(elapsed, bound, obj):
+        add_event(trajectory, build_time + elapsed,
+                  int(round(obj)) if obj is not None and abs(obj) < 1e20 else None,
+                  math.ceil(bound - 1e-6) if with_bound and bound is not None and abs(bound) < 1e20 else None)
+
+    trajectory = []
+    if model.store_search_progress_log:
+        for elapsed, (bound, obj) in model.search_progress_log.log:
+            event(elapsed, bound, obj)
+    event(solve_time, model.objective_bound, model.objective_value)
+    return trajectory
+
+
+def mip_model(num_couriers, num_locations, max_weights, package_weights, distance_matrix, solver=None, timeout=300, queue=None, bounds=None, threads=-1, name=None,
+              encoding='full', neighbours=None, initial=None):
     # Validate inputs
     assert num_locations >= num_couriers
     assert len(distance_matrix) == num_locations + 1, "Distance matrix should include the depot"
     assert len(package_weights) == num_locations, "There should be one weight for each location (excluding depot)"
     assert len(max_weights) == num_couriers, "There should be one max weight for each courier"
+    metrics = new_metrics()
+    build_start = time()
+    # Time (and optionally cProfile and memory) of each construction phase, when profiling is on
+    profile = Profile('MIP', name)
+    # Labels of the telemetry events of the run
+    set_context(approach='MIP', instance=name)
+    profile.phase('setup')
+
+    # Lower and upper bound on the objective, shared with the other engines
+    if bounds is None:
+        bounds = compute_bounds(num_couriers, num_locations, max_weights, package_weights, distance_matrix)
+    lower_bound, upper_bound = bounds
+    # The sparse encoding only keeps the arcs to the nearest successors of each package: a
+    # restriction of the problem, whose optimum proves nothing on the instance
+    if encoding == 'sparse' and neighbours is None:
+        neighbours = sparse_neighbours() or NEIGHBOURS
+    restricted = encoding == 'sparse' and neighbours < num_locations - 1
+    # Assignments and arcs no optimal solution uses get no variable (common/preprocess.py):
+    # an arc without a variable is never travelled
+    reduction = reduce_instance(num_couriers, num_locations, max_weights, package_weights, distance_matrix,
+                                upper=shared_bounds(lower_bound, upper_bound)[1],
+                                neighbours=neighbours if restricted else None)
+    allowed, arcs = reduction.allowed.tolist(), reduction.arcs.tolist()
+    # Predecessors and successors of every location for each courier, so that the constraints
+    # on the arcs grow with the arcs kept and not with the square of the locations
+    predecessors = [[[l1 for l1 in range(num_locations + 1) if arcs[c][l1][l2]] for l2 in range(num_locations + 1)]
+                    for c in range(num_couriers)]
+    successors = [[[l2 for l2 in range(num_locations + 1) if arcs[c][l1][l2]] for l1 in range(num_locations + 1)]
+                  for c in range(num_couriers)]
+    start_time = time()
 
     package_weights += [0]
 
@@ -53,41 +104,49 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
     # Create the model
     # print("Creating model")
     model = Model(solver_name='GRB')
+    # Lets a warm worker stop the optimization when the time is over
+    set_interrupt(lambda: terminate_model(model))
     # model = Model(solver_name=CBC)
     # print(f"Solver: {model.solver_name}")
     """ VARIABLES """
+    profile.phase('variables')
     # print("Creating variables")
     # journeys[c][i][j] = 1 means that courier c go from i to j, with i the row and j the column
     # Basically a NxN matrix for each courrier
     # limit + 1 because of the depot
-    journeys = [[[model.add_var(name=f"c:{c}_from:{l1}_to:{l2}", var_type=BINARY) for l2 in range(limit + 1)] for l1 in
+    journeys = [[[model.add_var(name=f"c:{c}_from:{l1}_to:{l2}", var_type=BINARY) if arcs[c][l1][l2] else 0
+                  for l2 in range(limit + 1)] for l1 in
           range(limit+1)] for c in
          range(num_couriers)]
 
     # Weight carried by each courier
     weights = [
-        xsum(package_weights[l1] * journeys[c][l1][l2] for l1 in range(limit + 1) for l2 in range(limit + 1))
+        xsum(package_weights[l1] * journeys[c][l1][l2] for l1 in range(limit + 1) for l2 in range(limit + 1)
+             if arcs[c][l1][l2])
         for c in range(num_couriers)]
 
     # Distance travelled by each courrier
     distances = [xsum(
-        distance_matrix[l1][l2] * journeys[courier][l1][l2] for l1 in range(limit + 1) for l2 in range(limit + 1))
+        distance_matrix[l1][l2] * journeys[courier][l1][l2] for l1 in range(limit + 1) for l2 in range(limit + 1)
+        if arcs[courier][l1][l2])
         for courier in range(num_couriers)]
 
     path_increment = [[model.add_var(name=f"path_increment_{courier}_{l}", var_type=INTEGER, lb=0, ub=num_locations)
+                       if allowed[courier][l] else 0
                        for l in range(limit + 1)]
                       for courier in range(num_couriers)]
     
     ''' CONSTRAINTS '''
     # print("Adding constraints")
     """ VALID TRANSITIONS """
+    profile.phase('transitions')
     for courier in range(num_couriers):
         # If y[courier][l1][l2] == 1 then y[courier][l3][l1] == 1
         for l1 in range(limit + 1):
-            for l2 in range(limit + 1):
+            for l2 in successors[courier][l1]:
                 condition = journeys[courier][l1][l2]
                 l3_gen_base = (
-                    l3 for l3 in range(limit + 1) if
+                    l3 for l3 in predecessors[courier][l1] if
                     (l3 == limit)  # Edge case 1: start from depot
                     or (l1 == limit)  # Edge case 2: end in depot
                     or (l3 != l1 and l3 != l2)
@@ -99,6 +158,7 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
                 model += results >= condition
 
 
+    profile.phase('subtours')
     # We fix depot as starting point of the path
     for courier in range(num_couriers):
         path_increment[courier][limit] = 0
@@ -106,7 +166,9 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
     for courier in range(num_couriers):
         for l1 in range(limit + 1):
             # We don't consider depot since it is always the last of the path and we don't need to know it's orederr in the path
-            for l2 in range(limit):
+            for l2 in successors[courier][l1]:
+                if l2 == limit:
+                    continue
                 # This means that we want path_increment[courier][l2] == path_increment[courier][l1]+1, if journeys[courier][l1][l2] is 1
                 # if journeys[courier][l1][l2] is 1, then path_increment[courier][l2] is at most path_increment[courier][l1] + 1
                 model += path_increment[courier][l2] >= path_increment[courier][l1] + 1 - limit * (
@@ -118,43 +180,56 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
     # Impose all the path_increment number not touched to be 0
     for courier in range(num_couriers):
         for p in range(limit + 1):
-            model += path_increment[courier][p] <= xsum([journeys[courier][p][p2] for p2 in range(limit + 1)]) * (limit + 1)
+            if not allowed[courier][p]:
+                continue
+            model += path_increment[courier][p] <= xsum([journeys[courier][p][p2] for p2 in successors[courier][p]]) * (limit + 1)
 
+    profile.phase('capacity')
     # Add constraints for weight capacity of each courier
     for courier in range(num_couriers):
-        model.add_constr(weights[courier] <= max_weights[courier])
+        # Dominated when the courier can carry all the packages it is allowed at once
+        if reduction.capacity[courier]:
+            model.add_constr(weights[courier] <= max_weights[courier])
 
-    # No travel from place to same place
-    for courier in range(num_couriers):
-        for l1 in range(limit + 1):
-            model += journeys[courier][l1][l1] <= 0
-            model += journeys[courier][l1][l1] >= 0
+    # No travel from place to same place: there is no variable for such arcs
 
+    profile.phase('depot')
     # Every carried package must be delivered to destination and every courier must start from destination
     for courier in range(num_couriers):
         # Leave depot
-        model += xsum(journeys[courier][limit][package] for package in range(limit + 1)) <= 1
-        model += xsum(journeys[courier][limit][package] for package in range(limit + 1)) >= 1
+        model += xsum(journeys[courier][limit][package] for package in range(limit + 1) if arcs[courier][limit][package]) <= 1
+        model += xsum(journeys[courier][limit][package] for package in range(limit + 1) if arcs[courier][limit][package]) >= 1
         # Back to depot
-        model += xsum(journeys[courier][package][limit] for package in range(limit + 1)) <= 1
-        model += xsum(journeys[courier][package][limit] for package in range(limit + 1)) >= 1
+        model += xsum(journeys[courier][package][limit] for package in range(limit + 1) if arcs[courier][package][limit]) <= 1
+        model += xsum(journeys[courier][package][limit] for package in range(limit + 1) if arcs[courier][package][limit]) >= 1
 
+    profile.phase('assignment')
     # Each package is carried only once
     for package in range(limit):
-        model += xsum(journeys[courier][package][l2] for courier in range(num_couriers) for l2 in range(limit + 1)) <= 1
-        model += xsum(journeys[courier][package][l2] for courier in range(num_couriers) for l2 in range(limit + 1)) >= 1
+        model += xsum(journeys[courier][package][l2] for courier in range(num_couriers) for l2 in range(limit + 1)
+                      if arcs[courier][package][l2]) <= 1
+        model += xsum(journeys[courier][package][l2] for courier in range(num_couriers) for l2 in range(limit + 1)
+                      if arcs[courier][package][l2]) >= 1
 
+    profile.phase('flow')
     # We impose that if we arrive in l2 than we also have to leave l2
     for courier in range(num_couriers):
         for l1 in range(limit + 1):
-            for l2 in range(limit):
+            for l2 in successors[courier][l1]:
+                if l2 == limit:
+                    continue
                 condition = journeys[courier][l1][l2]
-                results = xsum(journeys[courier][l2][l3] for l3 in range(limit + 1))
+                results = xsum(journeys[courier][l2][l3] for l3 in successors[courier][l2])
 
                 model += results >= condition
 
+    profile.phase('objective')
+    # In a portfolio, the objective of the best solution and the best bound found meanwhile by
+    # the other engines (common/bus.py) cut off the objective
+    lower_bound, upper_bound = shared_bounds(lower_bound, upper_bound)
     # Add objective: minimize the maximum distance traveled by any courier
-    max_distance = model.add_var(name="max_distance", var_type=INTEGER)
+    max_distance = model.add_var(name="max_distance", var_type=INTEGER, lb=lower_bound,
+                                 ub=upper_bound if upper_bound is not None else INF)
     for courier in range(num_couriers):
         model.add_constr(max_distance >= distances[courier])
     # print("Adding objective")
@@ -162,13 +237,32 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
 
     # Optimize the model
     model.verbose = 0
-    model.threads = -1
+    model.threads = threads
     model.max_seconds = timeout
+    # Gurobi logs its (time, (bound, objective)) progress, turned into the trajectory of the run
+    # (the progress callback of CBC crashes some builds, so with CBC only the final event is kept)
+    model.store_search_progress_log = model.solver_name.upper() in ('GRB', 'GUROBI')
+    if initial:
+        # MIP start (common/reoptimize.py): the arcs and positions of a previous solution, as far as
+        # the model has variables for them
+        mip_start = []
+        for courier, route in enumerate(initial):
+            path = [limit] + [item - 1 for item in route] + [limit]
+            mip_start += [(journeys[courier][l1][l2], 1.0) for l1, l2 in zip(path[:-1], path[1:]) if arcs[courier][l1][l2]]
+            mip_start += [(path_increment[courier][item], float(position))
+                          for position, item in enumerate(path[1:-1], 1) if allowed[courier][item]]
+        model.start = mip_start
+    metrics['build_time'] = time() - build_start
+    metrics['variables'] = model.num_cols
+    metrics['constraints'] = model.num_rows
     try:
         # print("Optimizing")
         start = time()
+        profile.phase('solve')
         model.optimize(max_seconds=timeout, max_seconds_same_incumbent=timeout)
         time_needed = int(time() - start)
+        metrics['solve_time'] = time() - start
+        profile.phase('solution')
         # print("Optimization done")
         # print(f"Time needed for optimization: {time_needed}")
     except Exception as e:
@@ -200,18 +294,36 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
         solution.append(extract_solution_from_path_increment(tmp_list))
         #print()
 
+    trajectory = mip_trajectory(model, metrics['build_time'], metrics['solve_time'], with_bound=not restricted)
+    profile.attach(metrics)
+
+    remaining = timeout - (time() - start_time)
+    if restricted and model.status == OptimizationStatus.INFEASIBLE and remaining >= 1:
+        # The sparse graph has no solution within the upper bound: it is widened
+        return mip_model(num_couriers, num_locations, max_weights, package_weights[:num_locations], distance_matrix,
+                         solver, int(remaining), queue, bounds, threads, name=name, encoding=encoding,
+                         neighbours=widen(neighbours, num_locations), initial=initial)
+
     if model.objective_value:
         res = {"time": time_needed,
-               "optimal": model.status == OptimizationStatus.OPTIMAL,
+               # Optimal on the sparse graph, and on the instance only if the lower bound meets it
+               "optimal": model.status == OptimizationStatus.OPTIMAL and
+                          (not restricted or int(model.objective_value) <= lower_bound),
                "obj": int(model.objective_value),
-               "sol": solution}
+               "sol": solution,
+               "metrics": record(metrics, mip_statistics(model)),
+               "trajectory": trajectory}
+        if restricted:
+            res['sparse'] = sparse_report(neighbours, reduction, res['obj'], lower_bound)
     else:
         print("No solution found")
         res = {
             'time': 0,
             'optimal': False,
             'obj': 'N/A',
-            'sol': []
+            'sol': [],
+            'metrics': record(metrics, mip_statistics(model)),
+            'trajectory': trajectory
         }
     # print("Time needed for completing the process: ", time() - start)
     if queue:
@@ -219,21 +331,30 @@ def mip_model(num_couriers, num_locations, max_weights, package_weights, distanc
     return res
 
 
-def solve_MIP_with_timeout(m, n, l, s, D, solver_type=None, timeout: int = 300):
-    queue = multiprocessing.Queue()
-    process = multiprocessing.Process(target=mip_model, args=(m, n, l, s, D, solver_type, timeout, queue))
+def solve_MIP_with_timeout(m, n, l, s, D, solver_type=None, timeout: int = 300, bounds=None, threads=-1, pool=None, name=None, monitor=None,
+                           encoding='full', initial=None):
+    if pool is not None:
+        # Solve on a warm worker, which terminates Gurobi itself when the time is over
+        res = pool.solve((m, n, l, s, D, solver_type, timeout),
+                         {'bounds': bounds, 'threads': threads, 'name': name, 'encoding': encoding, 'initial': initial},
+                         timeout=timeout, monitor=monitor)
+    else:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=mip_model, args=(m, n, l, s, D, solver_type, timeout, queue, bounds, threads),
+                                          kwargs={'name': name, 'encoding': encoding, 'initial': initial})
+
+        process.start()
+        process.join(timeout)
 
-    process.start()
-    process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()  # Ensure the process is terminated
 
-    if process.is_alive():
-        process.terminate()
-        process.join()  # Ensure the process is terminated
+        res = queue.get() if not queue.empty() else None
 
-    if not queue.empty():
-        res = queue.get()
+    if res:
         if not res['optimal']:
-            res['time'] = 300
+            res['time'] = timeout
         return res
     else:
         print("Timeout")
@@ -0,0 +1,159 @@
+"""
+Portfolio engine (PORTFOLIO): the approaches race on the same instance.
+
+The engines of PORTFOLIO_ENGINES are started together on a core each, from threads of their own
+(MIP, SAT and SMT on their warm workers). They share an incumbent bus (common/bus.py): every
+engine publishes its objective and its proven bound as it finds them and reads those of the
+others, MIP as the bounds of its objective when its model is built, SAT and SMT as the interval
+of every step of their bisection and CSP as the bounds of z when it starts. The heuristic, the
+first to find solutions, gives the exact engines their cut-off; the lower bound of
+common/bounds.py is on the bus before any engine starts.
+
+As soon as the best objective on the bus meets the best bound, every engine is stopped. The result
+is the best solution of the engines, optimal when the bound meets it, with the engine that found
+it ('winner'), the one that proved the bound ('bound_by') and the objective, bound and outcome of
+every engine ('portfolio'). Engines whose solver library is missing are left out.
+"""
+import threading
+from time import time
+from common.bounds import lower_bound
+from common.bus import IncumbentBus, join_bus, leave_bus, shared_bounds
+from common.engines import get_engine
+from common.instance import read_dat_file
+from common.metrics import new_metrics, record
+from common.telemetry import set_context
+from common.trajectory import add_event
+
+# Engines raced by the portfolio
+PORTFOLIO_ENGINES = ('HEUR', 'CSP', 'MIP', 'SAT', 'SMT')
+# Seconds between two reads of the bus
+POLL = 0.5
+# Slot of the bus holding the lower bound of common/bounds.py, the engines following it
+BOUNDS_SLOT = 0
+
+
+class MemberMonitor:
+    """
+    Monitor of an engine of the portfolio (see common/workers.py). The engine publishes its
+    incumbents to the bus itself; it is stopped once the portfolio is.
+    """
+
+    def __init__(self, stop):
+        self.stop = stop
+
+    def incumbent(self, res):
+        pass
+
+    def should_stop(self):
+        return self.stop.is_set()
+
+
+def _run_member(engine, solve, slot, bus, stop, instance, timeout, warm, results, initial=None):
+    # Runs in a thread of its own, publishing to the slot of the engine
+    instance_id, m, n, l, s, D = instance
+    join_bus(bus, slot)
+    try:
+        results[engine] = solve(instance_id, m, n, l, s, D, timeout=timeout, cores=1, warm=warm,
+                                monitor=MemberMonitor(stop), initial=initial)
+    except Exception as e:
+        results[engine] = {'time': timeout, 'optimal': False, 'obj': 'N/A', 'sol': [], 'error': repr(e)}
+    finally:
+        leave_bus()
+
+
+def solve_instance_portfolio(m, n, l, s, D, timeout=300, name=None, warm=True, monitor=None,
+                             engines=PORTFOLIO_ENGINES, initial=None):
+    """
+    Race the engines on an instance.
+    :param monitor: given the best objective of the portfolio, may stop it before its timeout
+                    (see common/workers.py)
+    :param initial: a solution (routes of 1-based items) every engine is warm-started from
+    :return: the result dict ('time', 'optimal', 'obj', 'sol') of the best engine, with 'winner',
+             'bound_by' and 'portfolio'
+    """
+    start = time()
+    metrics = new_metrics()
+    trajectory = []
+    # Labels of the telemetry events of the run
+    set_context(approach='PORTFOLIO', instance=name)
+    bus = IncumbentBus(len(engines) + 1)
+    # The bounds of the bus the caller joined, if any (e.g. the objective of a warm start), come first
+    lower, upper = shared_bounds(lower_bound(m, n, l, s, D), None)
+    bus.publish(BOUNDS_SLOT, obj=upper, bound=lower)
+
+    stop = threading.Event()
+    results = {}
+    threads = []
+    for slot, engine in enumerate(engines, start=1):
+        try:
+            solve = get_engine(engine)
+        except ImportError as e:
+            results[engine] = {'time': timeout, 'optimal': False, 'obj': 'N/A', 'sol': [],
+                               'error': f'unavailable ({e})'}
+            continue
+        thread = threading.Thread(target=_run_member, daemon=True,
+                                  args=(engine, solve, slot, bus, stop, (name, m, n, l, s, D), timeout, warm, results,
+                                        initial))
+        thread.start()
+        threads.append(thread)
+    metrics['build_time'] = time() - start
+
+    proven_at = None
+    while any(thread.is_alive() for thread in threads):
+        next(thread for thread in threads if thread.is_alive()).join(POLL)
+        upper, lower = bus.upper(), bus.lower()
+        add_event(trajectory, time() - start, upper, lower)
+        if monitor is not None and upper is not None:
+            monitor.incumbent({'obj': upper})
+        if proven_at is None and bus.proven():
+            proven_at = time() - start
+        if bus.proven() or (monitor is not None and monitor.should_stop()):
+            # The engines still running return their last incumbent
+            stop.set()
+
+    lower = bus.lower()
+    contributions = {}
+    bound_by, best_bound = 'bounds', bus.slot(BOUNDS_SLOT)[1]
+    for slot, engine in enumerate(engines, start=1):
+        res = results.get(engine, {})
+        obj, bound = bus.slot(slot)
+        contributions[engine] = {'obj': res.get('obj', 'N/A'), 'optimal': bool(res.get('optimal')),
+                                 'time': res.get('time', timeout), 'best_obj': obj, 'best_bound': bound}
+        if 'error' in res:
+            contributions[engine]['error'] = res['error']
+        if bound is not None and (best_bound is None or bound > best_bound):
+            bound_by, best_bound = engine, bound
+    bus.close()
+
+    result = {'time': timeout, 'optimal': False, 'obj': 'N/A', 'sol': []}
+    solved = [engine for engine, res in results.items() if isinstance(res.get('obj'), int) and res.get('sol')]
+    winner = min(solved, key=lambda engine: results[engine]['obj']) if solved else None
+    if winner is not None:
+        result['obj'] = results[winner]['obj']
+        result['sol'] = results[winner]['sol']
+        # Proven by the best bound of any engine, not only by the winner
+        result['optimal'] = lower is not None and result['obj'] <= lower
+        if result['optimal']:
+            result['time'] = int(proven_at if proven_at is not None else time() - start)
+    metrics['solve_time'] = time() - start - metrics['build_time']
+    result['metrics'] = record(metrics)
+    result['trajectory'] = list(trajectory)
+    result['winner'] = winner
+    result['bound_by'] = bound_by
+    result['portfolio'] = contributions
+    return result
+
+
+def solve_PORTFOLIO_with_timeout(m, n, l, s, D, timeout: int = 300, name=None, warm=True, monitor=None, initial=None):
+    # The engines run in threads of the calling process and on their warm workers
+    return solve_instance_portfolio(m, n, l, s, D, timeout=timeout, name=name, warm=warm, monitor=monitor,
+                                    initial=initial)
+
+
+if __name__ == '__main__':
+    m, n, l, s, D = read_dat_file('instances/inst07.dat')
+    result = solve_PORTFOLIO_with_timeout(m, n, l, s, D, timeout=60, name='inst07')
+    print("Time:", result['time'])
+    print("Objective:", result['obj'])
+    print("Optimal:", result['optimal'])
+    print("Winner:", result['winner'], "bound by:", result['bound_by'])
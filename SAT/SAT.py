@@ -1,8 +1,18 @@
 import math
-from z3 import Or, And, Not, Implies, PbLe, Bool, Solver, sat
+from z3 import Or, And, Not, Implies, PbLe, AtMost, Bool, BoolVal, Solver, Context, sat, unknown
 import itertools
 from time import time
 import multiprocessing
+from common.bisection import Bisection
+from common.bounds import compute_bounds, route_limit
+from common.bus import shared_bounds
+from common.instance import read_dat_file
+from common.metrics import new_metrics, record, z3_statistics
+from common.preprocess import NEIGHBOURS, reduce_instance, sparse_neighbours, sparse_report, widen
+from common.profiling import Profile
+from common.telemetry import set_context
+from common.trajectory import add_event
+from common.workers import set_interrupt
  
  
 # Define the constraint at least one
@@ -16,25 +26,27 @@ def at_least_one(variables):
     return Or(variables)
  
  
-def at_most_one(variables):
+def at_most_one(variables, compact=False):
     """
     Return constraint that at most one of the variables in variables is true
     :param variables: List of variables
-    :param context: Context of the variables
+    :param compact: a single cardinality constraint instead of one clause per pair
     :return:
     """
+    if compact:
+        return [AtMost(*variables, 1)]
     return [Not(And(pair[0], pair[1])) for pair in itertools.combinations(variables, 2)]
  
  
 # Define the constraint exactly one
-def exactly_one(variables):
+def exactly_one(variables, compact=False):
     """
     Return constraint that exactly one of the variable in variables is true
     :param bool_vars: List of variables
-    :param context: Context of the variables
+    :param compact: a single cardinality constraint instead of one clause per pair
     """
  
-    return at_most_one(variables) + [at_least_one(variables)]
+    return at_most_one(variables, compact) + [at_least_one(variables)]
  
  
 def at_most_k(variables, k):
@@ -48,6 +60,15 @@ def at_most_k(variables, k):
     return PbLe([(var, 1) for var in variables], k)
  
  
+def weighted_at_most_k(variables, weights, k):
+    """
+    Return constraint that the weights of the true variables sum to at most k,
+    the compact form of at_most_k over each variable repeated weight times
+    """
+ 
+    return PbLe([(var, weight) for var, weight in zip(variables, weights) if weight > 0], k)
+ 
+ 
 def less_than(a, b):
     """
     Return constraint that a < b
@@ -98,9 +119,11 @@ def lex_less(a, b) -> bool:
     if not b:
         return False
  
+    # a[0] == b[0] compares the lists in Python, so the context is taken from the variables
     return Or(lex_less_single(a[0], b[0]),
               And(a[0] == b[0],
-                  lex_less(a[1:], b[1:])))
+                  lex_less(a[1:], b[1:]),
+                  a[0][0].ctx))
  
  
 # Define the problem
@@ -112,14 +135,42 @@ def solve_instance_sat(
         s,
         D,
         solver_type=None,
-        timeout: int = 300, ):
+        timeout: int = 300,
+        bounds=None,
+        name=None,
+        encoding='full',
+        neighbours=None):
     model_result = {
         'time': 0,
         'optimal': False,
         'obj': 0,
         'sol': []
     }
- 
+    metrics = new_metrics()
+    trajectory = []
+    build_start = run_start = time()
+    # Time (and optionally cProfile and memory) of each construction phase, when profiling is on
+    profile = Profile('SAT', name)
+    # Labels of the telemetry events of the run
+    set_context(approach='SAT', instance=name)
+    # The compact encoding avoids the pairwise at-most-one clauses and the literals repeated
+    # once per unit of weight or distance, for instances whose full model does not fit in memory
+    compact = encoding in ('compact', 'sparse')
+    # The sparse encoding also keeps only the arcs to the nearest successors of each package
+    # (common/preprocess.py): a restriction of the problem, whose bisection proves no bound on it
+    if encoding == 'sparse' and neighbours is None:
+        neighbours = sparse_neighbours() or NEIGHBOURS
+    restricted = encoding == 'sparse' and neighbours < n - 1
+    profile.phase('setup')
+ 
+    # Lower and upper bound on the objective, shared with the other engines
+    if bounds is None:
+        bounds = compute_bounds(m, n, l, s, D, max_items=route_limit(n, m))
+    # Assignments and arcs no optimal solution uses get no variable (common/preprocess.py)
+    reduction = reduce_instance(m, n, l, s, D, upper=shared_bounds(*bounds)[1],
+                                neighbours=neighbours if restricted else None)
+    allowed, arcs, forbidden = reduction.allowed.tolist(), reduction.arcs.tolist(), reduction.forbidden.tolist()
+
     # So that the package representing the base doesn't count in the weight calculation
     s += [0]
  
@@ -132,64 +183,101 @@ def solve_instance_sat(
     ## CONSTANTS ##
     base_package = n
     last_time = time_range[-1]
-    variable_coordinates = list(itertools.product(package_range, time_range, courier_range))
+    variable_coordinates = [(pac, ti, cou) for pac, ti, cou in itertools.product(package_range, time_range, courier_range)
+                            if allowed[cou][pac]]
  
     ## SOLVER ##
-    solver = Solver()
+    # A context of its own, so that a warm worker starts every instance from a clean (not interrupted) z3
+    ctx = Context()
+    solver = Solver(ctx=ctx)
+    # Lets a warm worker stop the search when the time is over
+    set_interrupt(solver.ctx.interrupt)
  
  
     ### VARIABLES ###
+    profile.phase('variables')
+    # Packages the courier cannot carry and arcs it never uses are the constant False
+    false = BoolVal(False, ctx)
  
     # journeys[cou][ti][pac] = True if the courier carries the package at time ti
-    journeys = [[[Bool(f'journeys_{cou}_{ti}_{pac}')
+    journeys = [[[Bool(f'journeys_{cou}_{ti}_{pac}', ctx) if allowed[cou][pac] else false
            for pac in package_range]
           for ti in time_range]
          for cou in courier_range]
  
     # weights[cou][pac] = True if the courier carries the package
-    weights = [[Bool(f'weights_{cou}_{pac}')
+    weights = [[Bool(f'weights_{cou}_{pac}', ctx) if allowed[cou][pac] else false
                 for pac in package_range]
                for cou in courier_range]
  
     # distances[cou][start][end] = True if the courier goes from start to end at some time in the route
-    distances = [[[Bool(f'distances_{cou}_{start}_{end}')
+    distances = [[[Bool(f'distances_{cou}_{start}_{end}', ctx) if arcs[cou][start][end] else false
                    for end in package_range]
                   for start in package_range]
                  for cou in courier_range]
+    # Arcs each courier may use, the terms of its distance, and the arcs it must not use explicitly
+    courier_arcs = [[(pac1, pac2) for pac1 in package_range for pac2 in package_range if arcs[cou][pac1][pac2]]
+                    for cou in courier_range]
+    if not restricted:
+        courier_forbidden = [[(pac1, pac2) for pac1 in package_range for pac2 in package_range
+                              if forbidden[cou][pac1][pac2]] for cou in courier_range]
  
  
     ## CONSTRAINTS ##
+    profile.phase('channeling')
  
     # Constraint the weights variable to be true if the courier carries the package
     for cou in courier_range:
         for ti in time_range:
             for pac in package_range:
-                solver.add(Implies(journeys[cou][ti][pac], weights[cou][pac]))
+                if allowed[cou][pac]:
+                    solver.add(Implies(journeys[cou][ti][pac], weights[cou][pac]))
  
     # Constraint the distances variable
     for cou in courier_range:
         for ti in time_range_no_zero:
-            for pac1 in package_range:
-                for pac2 in package_range:
-                    if pac1 == pac2:
-                        continue
-                    condition = And(journeys[cou][ti - 1][pac1], journeys[cou][ti][pac2])
-                    solver.add(Implies(condition, distances[cou][pac1][pac2]))
- 
+            for pac1, pac2 in courier_arcs[cou]:
+                condition = And(journeys[cou][ti - 1][pac1], journeys[cou][ti][pac2])
+                solver.add(Implies(condition, distances[cou][pac1][pac2]))
+            if restricted:
+                # Sparse graph: the next stop is one of the successors kept, a clause per package
+                # instead of one per arc left out (the base follows the base once the route is over)
+                for pac1 in package_range:
+                    if allowed[cou][pac1]:
+                        successors = [journeys[cou][ti][pac2] for pac2 in package_range if arcs[cou][pac1][pac2]]
+                        if pac1 == base_package:
+                            successors.append(journeys[cou][ti][base_package])
+                        solver.add(Implies(journeys[cou][ti - 1][pac1], Or(successors)))
+                continue
+            for pac1, pac2 in courier_forbidden[cou]:
+                # Dropped by the upper bound, though both packages fit in the courier
+                solver.add(Not(And(journeys[cou][ti - 1][pac1], journeys[cou][ti][pac2])))
+ 
+    profile.phase('assignment')
     # At each time, the courier can only carry exactly one package or it is at base
     for cou in courier_range:
         for ti in time_range:
-            solver.add(exactly_one(journeys[cou][ti][:]))
+            solver.add(exactly_one([journeys[cou][ti][pac] for pac in package_range if allowed[cou][pac]], compact))
  
     # Each package is carried only once
     for pac in package_range:
         if pac != base_package:
-            solver.add(exactly_one([journeys[cou][ti][pac] for cou in courier_range for ti in time_range]))
+            solver.add(exactly_one([journeys[cou][ti][pac] for cou in courier_range if allowed[cou][pac]
+                                    for ti in time_range], compact))
  
+    profile.phase('capacity')
     # The total weight carried by each courier must be less or equal than its maximum capacity
     for cou in courier_range:
-        solver.add(at_most_k([weights[cou][pac] for pac in package_range for _ in range(s[pac])], l[cou]))
+        if not reduction.capacity[cou]:
+            # Dominated: the courier can carry all the packages it is allowed at once
+            continue
+        if compact:
+            solver.add(weighted_at_most_k(weights[cou], s, l[cou]))
+        else:
+            solver.add(at_most_k([weights[cou][pac] for pac in package_range if allowed[cou][pac]
+                                  for _ in range(s[pac])], l[cou]))
  
+    profile.phase('depot')
     # The courier must be at the base at start and end
     for cou in courier_range:
         solver.add(journeys[cou][0][base_package])
@@ -197,6 +285,7 @@ def solve_instance_sat(
  
  
     ## OPTIMIZATION CONSTRAINTS ##
+    profile.phase('routes')
         
     # Couriers cannot go back to the base before delivering all the other packages
     for cou in courier_range:
@@ -214,6 +303,7 @@ def solve_instance_sat(
                            And([journeys[cou][_t][base_package] for _t in range(ti, last_time + 1)])))
  
     ## SYMMETRY BREAKING CONSTRAINTS ##
+    profile.phase('symmetry')
  
     # If two couriers have the same capacity then they are symmetric,
     # to break the symmetry we impose an order (for the package they pick up) betweem them.
@@ -223,38 +313,69 @@ def solve_instance_sat(
                 solver.add(lex_less(journeys[cou1], journeys[cou2]))
  
  
+    metrics['build_time'] = time() - build_start
+    metrics['variables'] = (int(reduction.allowed.sum()) * (len(time_range) + 1)
+                            + sum(len(courier) for courier in courier_arcs))
+    metrics['constraints'] = len(solver.assertions())
+
     ## OBJECTIVE FUNCTION ##
  
     # Inizializzation
     start_time = time()
     last_best_model = None
  
-    min_distance = math.inf
-    max_distance = 0
- 
-    # Initialize min and max distances using a better heuristic
-    for i in range(len(D)):
-        for j in range(len(D[i])):
-            if D[i][j] != 0:
-                min_distance = min(min_distance, D[i][j])
- 
-    for i in range(len(D)):
-        max_distance += sum(D[i])
+    # The bisection starts from the bounds computed in common/bounds.py (common/bisection.py)
+    min_distance, max_distance = bounds
+    if max_distance is None:
+        max_distance = 0
+        for i in range(len(D)):
+            max_distance += sum(D[i])
+    bisection = Bisection(min_distance, max_distance)
+    # Best lower bound proven so far, for the trajectory: the bound of the bisection only holds on
+    # the sparse graph if the model is restricted, and in any case only for routes of at most
+    # len(time_range) - 2 items, so that it is not shared with the other engines (common/trajectory.py)
+    best_bound = bisection.bound
+    add_event(trajectory, time() - run_start, None, best_bound)
  
     while True:
-        k = int((min_distance + max_distance) / 2)
+        # In a portfolio, the bounds found meanwhile by the other engines narrow the interval
+        k = bisection.next_guess()
         
         solver.push()
         
+        build_start = time()
+        profile.phase('objective')
         for cou in courier_range:
-            courier_dist = [distances[cou][pac1][pac2] for pac1 in package_range for pac2 in package_range
+            if compact:
+                solver.add(weighted_at_most_k([distances[cou][pac1][pac2] for pac1, pac2 in courier_arcs[cou]],
+                                              [D[pac1][pac2] for pac1, pac2 in courier_arcs[cou]], k))
+                continue
+            courier_dist = [distances[cou][pac1][pac2] for pac1, pac2 in courier_arcs[cou]
                             for _ in range(D[pac1][pac2])]
             solver.add(at_most_k(courier_dist, k))
+        metrics['build_time'] += time() - build_start
         
+        solve_start = time()
+        profile.phase('solve')
         sol = solver.check()
+        metrics['solve_time'] += time() - solve_start
+        profile.phase('solution')
+ 
+        # The search has been interrupted: the last incumbent is sent again with the final metrics
+        if sol == unknown:
+            if last_best_model is None:
+                model_result['obj'] = 'N/A'
+            profile.attach(metrics)
+            model_result['metrics'] = record(metrics, z3_statistics(solver))
+            model_result['trajectory'] = list(trajectory)
+            result.append(model_result)
+            return model_result
  
         if sol != sat:
-            min_distance = k
+            bisection.unsat(k)
+            if not restricted:
+                best_bound = bisection.bound
+            add_event(trajectory, time() - run_start, bisection.best, best_bound, shared=False)
         else:
             last_best_model = solver.model()
  
@@ -265,14 +386,16 @@ def solve_instance_sat(
  
             distd = []
             for cou in courier_range:
-                s = 0
+                dist = 0
                 for ti in time_range_no_zero:
                     pac1 = last_solution_matrix[cou][ti - 1] - 1
                     pac2 = last_solution_matrix[cou][ti] - 1
-                    s += D[pac1][pac2]
-                distd += [s]
+                    dist += D[pac1][pac2]
+                distd += [dist]
  
             max_distance = max(distd)
+            bisection.sat(max_distance)
+            add_event(trajectory, time() - run_start, bisection.best, best_bound, shared=False)
  
             for i in range(len(last_solution_matrix)):
                 last_solution_matrix[i] = [num for num in last_solution_matrix[i] if num != base_package + 1]
@@ -281,44 +404,66 @@ def solve_instance_sat(
             model_result['optimal'] = False
             model_result['obj'] = max_distance
             model_result['sol'] = last_solution_matrix
+            if restricted:
+                model_result['sparse'] = sparse_report(neighbours, reduction, max_distance, best_bound)
+            profile.attach(metrics)
+            model_result['metrics'] = record(metrics, z3_statistics(solver))
+            model_result['trajectory'] = list(trajectory)
             result.append(model_result)
+        
+        solver.pop()
  
         if (time() - start_time) >= timeout:
             print('TIME OUT OF RANGE')
             return model_result
         
-        if abs(min_distance - max_distance) <= 1:
-            model_result['optimal'] = True
-            result.append(model_result)
+        if not bisection.closed():
+            continue
+        if bisection.best is None:
+            if restricted:
+                # The sparse graph has no solution within the upper bound: it is widened
+                return solve_instance_sat(result, m, n, l, s[:n], D, solver_type,
+                                          max(1, timeout - (time() - run_start)), bounds, name=name,
+                                          encoding=encoding, neighbours=widen(neighbours, n))
             return model_result
-        else:
-            # If we find a solution, we might adjust the search space more aggressively
-            if sol == sat:
-                # If a solution was found, we can try narrowing the search space more aggressively
-                max_distance = k - 1  # Try a smaller max_distance for the next
-            else:
-                # If no solution was found, we try a larger k
-                min_distance = k + 1
-        
-        solver.pop()    
+        if not bisection.proven():
+            # The interval was closed by the objective of another engine of a portfolio
+            return model_result
+        # Optimal on the sparse graph, and on the instance only if the lower bound meets it
+        model_result['optimal'] = bisection.best <= best_bound or not restricted
+        if model_result['optimal']:
+            # Optimality proven: the bound meets the objective, on the instance only if restricted
+            # (by the lower bound), otherwise on the routes of the model
+            add_event(trajectory, time() - run_start, bisection.best, bisection.best, shared=restricted)
+        profile.attach(metrics)
+        model_result['metrics'] = record(metrics, z3_statistics(solver))
+        model_result['trajectory'] = list(trajectory)
+        result.append(model_result)
+        return model_result
  
 def solve_SAT_with_timeout(m, n, l, s, D, solver_type=None,
-                           timeout: int = 300):
-    manager = multiprocessing.Manager()
-    result = manager.list()
-    process = multiprocessing.Process(target=solve_instance_sat, args=(result, m, n, l, s, D, solver_type))
+                           timeout: int = 300, bounds=None, pool=None, name=None, monitor=None, encoding='full'):
+    if pool is not None:
+        # Solve on a warm worker, which interrupts z3 itself when the time is over
+        res = pool.solve((m, n, l, s, D, solver_type, timeout, bounds), {'name': name, 'encoding': encoding}, timeout=timeout, monitor=monitor)
+    else:
+        manager = multiprocessing.Manager()
+        result = manager.list()
+        process = multiprocessing.Process(target=solve_instance_sat, args=(result, m, n, l, s, D, solver_type, timeout, bounds),
+                                          kwargs={'name': name, 'encoding': encoding})
  
-    process.start()
-    process.join(timeout)
+        process.start()
+        process.join(timeout)
  
-    if process.is_alive():
-        process.terminate()
-        process.join()  # Ensure the process is terminated
+        if process.is_alive():
+            process.terminate()
+            process.join()  # Ensure the process is terminated
  
-    if result:
-        res = result[-1]
+        res = result[-1] if result else None
+ 
+    if res:
         if not res['optimal']:
-            res['time'] = 300
+            res['time'] = timeout
         return res
     else:
         return {
@@ -329,25 +474,6 @@ def solve_SAT_with_timeout(m, n, l, s, D, solver_type=None,
         }
  
  
-def read_dat_file(file_path):
-    with open(file_path, 'r') as file:
-        # Read the first two integers
-        m = int(file.readline().strip())
-        n = int(file.readline().strip())
- 
-        # Read the next line as a list of integers
-        l = list(map(int, file.readline().strip().split()))
- 
-        # Read the next line as a list of integers
-        s = list(map(int, file.readline().strip().split()))
- 
-        # Read the remaining lines into the distance matrix D
-        D = []
-        for line in file:
-            D.append(list(map(int, line.strip().split())))
- 
-    return m, n, l, s, D
- 
 def main():
     solver = 'Default'
  
@@ -13,6 +13,16 @@ from z3 import *
 from time import time as timer
 import multiprocessing
 import math
+from common.bisection import Bisection
+from common.bounds import compute_bounds, route_limit
+from common.bus import shared_bounds
+from common.instance import read_dat_file
+from common.metrics import new_metrics, record, z3_statistics
+from common.preprocess import reduce_instance
+from common.profiling import Profile
+from common.telemetry import set_context
+from common.trajectory import add_event
+from common.workers import set_interrupt
 
 MAX_ITERATIONS = 50
 
@@ -36,16 +46,34 @@ def compare_matrices_lex(first_matrix, second_matrix) -> bool:
     if not second_matrix:
         return False
     return Or(lexicographically_less(first_matrix[0], second_matrix[0]),
-              And(first_matrix[0] == second_matrix[0], compare_matrices_lex(first_matrix[1:], second_matrix[1:])))
+              And(first_matrix[0] == second_matrix[0], compare_matrices_lex(first_matrix[1:], second_matrix[1:]),
+                  first_matrix[0][0].ctx))
 
 
-def optimize_courier_routes(output, num_couriers, num_packages, distances, weight_limits, package_weights):
+def optimize_courier_routes(output, num_couriers, num_packages, distances, weight_limits, package_weights, bounds=None, name=None):
     result_data = {
         'time': 0,
         'optimal': False,
         'obj': 0,
         'sol': []
         }
+    metrics = new_metrics()
+    trajectory = []
+    build_start = run_start = timer()
+    # Time (and optionally cProfile and memory) of each construction phase, when profiling is on
+    profile = Profile('SMT', name)
+    # Labels of the telemetry events of the run
+    set_context(approach='SMT', instance=name)
+    profile.phase('setup')
+
+    # Lower and upper bound on the objective, shared with the other engines
+    if bounds is None:
+        bounds = compute_bounds(num_couriers, num_packages, weight_limits, package_weights, distances,
+                                max_items=route_limit(num_packages, num_couriers))
+    # Assignments and arcs no optimal solution uses get no variable (common/preprocess.py)
+    reduction = reduce_instance(num_couriers, num_packages, weight_limits, package_weights, distances,
+                                upper=shared_bounds(*bounds)[1])
+    allowed, arcs, forbidden = reduction.allowed.tolist(), reduction.arcs.tolist(), reduction.forbidden.tolist()
 
     package_weights += [0]  # Add dummy package with zero weight
 
@@ -57,21 +85,33 @@ def optimize_courier_routes(output, num_couriers, num_packages, distances, weigh
     final_package = num_packages
     final_time_slot = time_slots[-1]
 
-    solver = Then('simplify', 'elim-term-ite', 'solve-eqs', 'smt').solver()
+    # A context of its own, so that a warm worker starts every instance from a clean (not interrupted) z3
+    ctx = Context()
+    solver = Then('simplify', 'elim-term-ite', 'solve-eqs', 'smt', ctx=ctx).solver()
+    # Lets a warm worker stop the search when the time is over
+    set_interrupt(solver.ctx.interrupt)
 
-    # Create variables for the solution matrix
-    journeys = [[[Int(f"assign_{pkg}_{t}_{courier}") for courier in courier_indices] for t in time_slots] for pkg in package_indices]
+    profile.phase('variables')
+    # Create variables for the solution matrix, the constant 0 where the courier cannot carry the package
+    zero = IntVal(0, ctx)
+    journeys = [[[Int(f"assign_{pkg}_{t}_{courier}", ctx) if allowed[courier][pkg] else zero
+                  for courier in courier_indices] for t in time_slots] for pkg in package_indices]
 
     # Add constraints to ensure valid assignments
     for pkg in package_indices:
         for courier in courier_indices:
+            if not allowed[courier][pkg]:
+                continue
             for t in time_slots:
                 solver.add(journeys[pkg][t][courier] <= 1)
                 solver.add(journeys[pkg][t][courier] >= 0)
 
+    profile.phase('capacity')
     # Calculate total weight carried by each courier
-    courier_weights = [Sum([package_weights[pkg] * journeys[pkg][t][courier] for t in time_slots for pkg in package_indices]) for courier in courier_indices]
+    courier_weights = [Sum([package_weights[pkg] * journeys[pkg][t][courier] for t in time_slots for pkg in package_indices
+                            if allowed[courier][pkg]]) for courier in courier_indices]
 
+    profile.phase('transitions')
     # Calculate distances traveled by each courier
     travel_distances = []
     for courier in courier_indices:
@@ -79,36 +119,48 @@ def optimize_courier_routes(output, num_couriers, num_packages, distances, weigh
         for t in non_zero_time_slots:
             for p1 in package_indices:
                 for p2 in package_indices:
-                    pickup = journeys[p1][t - 1][courier] == 1
-                    dropoff = journeys[p2][t][courier] == 1
-                    courier_dists.append(distances[p1][p2] * And(pickup, dropoff))
+                    if arcs[courier][p1][p2]:
+                        pickup = journeys[p1][t - 1][courier] == 1
+                        dropoff = journeys[p2][t][courier] == 1
+                        courier_dists.append(distances[p1][p2] * And(pickup, dropoff))
+                    elif forbidden[courier][p1][p2]:
+                        # Dropped by the upper bound, though both packages fit in the courier
+                        solver.add(Not(And(journeys[p1][t - 1][courier] == 1, journeys[p2][t][courier] == 1)))
         travel_distances.append(Sum(courier_dists))
 
+    profile.phase('assignment')
     # Ensure each package (except the final package) is picked up exactly once
     for pkg in package_indices:
         if pkg == final_package:
             continue
-        solver.add(Sum([journeys[pkg][t][courier] for t in time_slots for courier in courier_indices]) == 1)
+        solver.add(Sum([journeys[pkg][t][courier] for t in time_slots for courier in courier_indices
+                        if allowed[courier][pkg]]) == 1)
 
     # Ensure valid time slots and couriers are assigned to packages
     for courier in courier_indices:
         for t in time_slots:
-            solver.add(Sum([journeys[pkg][t][courier] for pkg in package_indices]) == 1)
-        solver.add(Sum([journeys[pkg][t][courier] for pkg in package_indices if pkg != final_package for t in time_slots]) >= 1)
+            solver.add(Sum([journeys[pkg][t][courier] for pkg in package_indices if allowed[courier][pkg]]) == 1)
+        solver.add(Sum([journeys[pkg][t][courier] for pkg in package_indices if pkg != final_package and allowed[courier][pkg]
+                        for t in time_slots]) >= 1)
 
+    profile.phase('depot')
     # Ensure the final package is the first and last in the route for each courier
     for courier in courier_indices:
         solver.add(journeys[final_package][0][courier] == 1)
         solver.add(journeys[final_package][final_time_slot][courier] == 1)
 
+    profile.phase('capacity')
     # Enforce weight constraints
     for courier in courier_indices:
-        solver.add(courier_weights[courier] <= weight_limits[courier])
+        # Dominated when the courier can carry all the packages it is allowed at once
+        if reduction.capacity[courier]:
+            solver.add(courier_weights[courier] <= weight_limits[courier])
 
     # Additional constraints for base package handling
     # for courier in courier_indices:
     #     solver.add(journeys[final_package][1][courier] != 1)
 
+    profile.phase('routes')
     # Each courier can return to the base only after delivering all the packages they are carrying
     for courier in courier_indices:
         for t in non_zero_time_slots:
@@ -117,34 +169,61 @@ def optimize_courier_routes(output, num_couriers, num_packages, distances, weigh
                 future_pickup = journeys[final_package][t2][courier]
                 solver.add(Implies(current_pickup == 1, future_pickup == 1))
 
+    profile.phase('symmetry')
     # Symmetry breaking by lexicographical comparison
     for c1 in courier_indices:
         for c2 in courier_indices:
             if c1 < c2 and weight_limits[c1] == weight_limits[c2]:
                 solver.add(compare_matrices_lex(journeys[c1], journeys[c2]))
 
+    profile.phase('objective')
     # Objective: minimize the maximum distance any courier has to travel
     max_travel_distance = get_max_value(travel_distances)
-    min_possible_distance = min(distances[i][j] for i in range(len(distances)) for j in range(len(distances[i])) if distances[i][j] != 0)
-    max_possible_distance = sum(max(distances[i]) for i in range(len(distances)))
-    max_possible_distance = math.ceil(max_possible_distance)
-    min_possible_distance = max(min_possible_distance, math.floor(min_possible_distance))
+    # The bisection starts from the bounds computed in common/bounds.py (common/bisection.py)
+    min_possible_distance, max_possible_distance = bounds
+    if max_possible_distance is None:
+        max_possible_distance = sum(max(distances[i]) for i in range(len(distances)))
+    bisection = Bisection(min_possible_distance, max_possible_distance)
+
+    metrics['build_time'] = timer() - build_start
+    metrics['variables'] = int(reduction.allowed.sum()) * len(time_slots)
+    metrics['constraints'] = len(solver.assertions())
+    add_event(trajectory, timer() - run_start, None, bisection.bound)
 
     start_time = timer()
     iteration_count = 1
     last_best_solution = None
 
     while True:
-        current_guess = int((min_possible_distance + max_possible_distance) / 2)
+        # In a portfolio, the bounds found meanwhile by the other engines narrow the interval
+        current_guess = bisection.next_guess()
         solver.push()
+        profile.phase('objective')
         solver.add(max_travel_distance <= current_guess)
+        solve_start = timer()
+        profile.phase('solve')
         solution_found = solver.check()
+        metrics['solve_time'] += timer() - solve_start
+        profile.phase('solution')
+
+        # The search has been interrupted: the last incumbent is sent again with the final metrics
+        if solution_found == unknown:
+            if last_best_solution is None:
+                result_data['obj'] = 'N/A'
+            profile.attach(metrics)
+            result_data['metrics'] = record(metrics, z3_statistics(solver))
+            result_data['trajectory'] = list(trajectory)
+            output.append(result_data)
+            return
 
         if solution_found != sat:
-            min_possible_distance = current_guess
+            bisection.unsat(current_guess)
+            # Proven on the routes of the model only, not shared with the other engines
+            add_event(trajectory, timer() - run_start, bisection.best, bisection.bound, shared=False)
         else:
             last_best_solution = solver.model()
-            max_possible_distance = last_best_solution.eval(max_travel_distance).as_long()
+            bisection.sat(last_best_solution.eval(max_travel_distance).as_long())
+            add_event(trajectory, timer() - run_start, bisection.best, bisection.bound, shared=False)
 
             solution_matrix = [[0 for _ in range(final_time_slot + 1)] for _ in range(len(courier_indices))]
             for courier in courier_indices:
@@ -154,19 +233,32 @@ def optimize_courier_routes(output, num_couriers, num_packages, distances, weigh
 
             result_data["sol"] = solution_matrix
             result_data["time"] = int(timer() - start_time)
-            result_data["obj"] = max_possible_distance
+            result_data["obj"] = bisection.best
             result_data["optimal"] = False
             for i in range(len(result_data['sol'])):
                 result_data['sol'][i] = [num for num in result_data['sol'][i] if num != num_packages + 1]
+            profile.attach(metrics)
+            result_data['metrics'] = record(metrics, z3_statistics(solver))
+            result_data['trajectory'] = list(trajectory)
             output.append(result_data)
+        solver.pop()
 
-        if abs(min_possible_distance - max_possible_distance) <= 1 or iteration_count >= MAX_ITERATIONS:
-            result_data["optimal"] = True
-            output.append(result_data)
-            return
-        else:
+        if not bisection.closed() and iteration_count < MAX_ITERATIONS:
             iteration_count += 1
-            solver.pop()
+            continue
+        if not bisection.proven():
+            # No solution within the upper bound, the interval closed by the objective of another
+            # engine of a portfolio, or too many iterations: the last incumbent stands
+            return
+        result_data["optimal"] = True
+        # Optimality proven: the bound meets the objective, on routes of the model (at least one
+        # item per courier, and a limited number of them)
+        add_event(trajectory, timer() - run_start, result_data['obj'], result_data['obj'], shared=False)
+        profile.attach(metrics)
+        result_data['metrics'] = record(metrics, z3_statistics(solver))
+        result_data['trajectory'] = list(trajectory)
+        output.append(result_data)
+        return
 
 # Function to solve a courier optimization problem using Z3 SMT solver
 def solve_courier_problem(m, n, limits, sizes, dist_matrix, solver=None, timeout=300):
@@ -178,22 +270,28 @@ def solve_courier_problem(m, n, limits, sizes, dist_matrix, solver=None, timeout
     return solution_data
 
 # Solve the problem with a timeout
-def solve_SMT_with_timeout(m, n, limits, sizes, dist_matrix, solver_type=None, timeout: int = 300):
-    manager = multiprocessing.Manager()
-    results = manager.list()
-    process = multiprocessing.Process(target=optimize_courier_routes, args=(results, m, n, dist_matrix, limits, sizes))
+def solve_SMT_with_timeout(m, n, limits, sizes, dist_matrix, solver_type=None, timeout: int = 300, bounds=None, pool=None, name=None, monitor=None):
+    if pool is not None:
+        # Solve on a warm worker, which interrupts z3 itself when the time is over
+        res = pool.solve((m, n, dist_matrix, limits, sizes, bounds), {'name': name}, timeout=timeout, monitor=monitor)
+    else:
+        manager = multiprocessing.Manager()
+        results = manager.list()
+        process = multiprocessing.Process(target=optimize_courier_routes, args=(results, m, n, dist_matrix, limits, sizes, bounds),
+                                          kwargs={'name': name})
+
+        process.start()
+        process.join(timeout)
 
-    process.start()
-    process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()  # Ensure process termination
 
-    if process.is_alive():
-        process.terminate()
-        process.join()  # Ensure process termination
+        res = results[-1] if results else None
 
-    if results:
-        res = results[-1]
+    if res:
         if not res['optimal']:
-            res['time'] = 300
+            res['time'] = timeout
         return res
     else:
         return {
@@ -205,26 +303,8 @@ def solve_SMT_with_timeout(m, n, limits, sizes, dist_matrix, solver_type=None, t
 
 
 
-def read_instance_from_file(filename):
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    # Leggi m e n
-    m = int(lines[0].strip())
-    n = int(lines[1].strip())
-
-    # Leggi le capacità dei corrieri
-    l = list(map(int, lines[2].strip().split()))
-
-    # Leggi i pesi dei pacchetti
-    s = list(map(int, lines[3].strip().split()))
-
-    # Leggi la matrice delle distanze
-    D = []
-    for i in range(4, 4 + (n + 1)):
-        D.append(list(map(int, lines[i].strip().split())))
-
-    return m, n, l, s, D
+# Instances are loaded by common/instance.py, shared with the other engines
+read_instance_from_file = read_dat_file
 
 if __name__ == '__main__':
       filename = f'inst07.dat'
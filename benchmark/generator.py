@@ -0,0 +1,145 @@
+"""
+Seeded generator of synthetic .dat instances, to benchmark the approaches between and beyond
+the sizes of the fixed instances.
+
+An instance is defined by its spec: the number of couriers m, of items n, the capacity
+tightness (total size of the items / total capacity of the couriers, the closer to 1 the
+harder to pack) and the distance metric:
+
+    euclidean    points uniform in a square, rounded Euclidean distances (symmetric)
+    clustered    points drawn around a few centres, the depot anywhere (symmetric)
+    asymmetric   Euclidean distances plus the climb to the height of the destination,
+                 so going uphill costs more than going downhill (triangle inequality kept)
+
+The same spec and seed always give the same instance, whatever the sweep it belongs to.
+
+    python -m benchmark.generator --suite scaling --out benchmark/instances
+"""
+import os
+import argparse
+import itertools
+import numpy as np
+
+METRICS = ('euclidean', 'clustered', 'asymmetric')
+
+# Side of the square the points are drawn in, and the largest size of an item
+AREA = 100
+MAX_SIZE = 25
+
+# Sweeps of (m, n, tightness, metric) specs
+SUITES = {
+    'smoke': {'m': [2, 3], 'n': [6, 10], 'tightness': [0.5], 'metric': ['euclidean']},
+    'scaling': {'m': [3, 6, 10], 'n': [10, 20, 30, 45, 60, 80, 100, 120, 140],
+                'tightness': [0.5], 'metric': ['euclidean']},
+    'tightness': {'m': [6], 'n': [20, 40], 'tightness': [0.3, 0.5, 0.7, 0.9], 'metric': ['euclidean']},
+    'metrics': {'m': [6], 'n': [20, 40, 80], 'tightness': [0.5], 'metric': list(METRICS)},
+}
+
+
+def instance_name(spec, seed):
+    return f"gen_m{spec['m']}_n{spec['n']}_t{round(spec['tightness'] * 100):02d}_{spec['metric']}_s{seed}"
+
+
+def _points(rng, n, metric):
+    # Coordinates of the n items followed by the depot
+    if metric == 'clustered':
+        centres = rng.uniform(0, AREA, size=(max(1, n // 10), 2))
+        items = centres[rng.integers(len(centres), size=n)] + rng.normal(0, AREA / 20, size=(n, 2))
+        depot = rng.uniform(0, AREA, size=(1, 2))
+        return np.clip(np.vstack([items, depot]), 0, AREA)
+    return rng.uniform(0, AREA, size=(n + 1, 2))
+
+
+def distances(rng, n, metric):
+    """
+    Return the (n + 1) x (n + 1) integer distance matrix of the metric, the depot being the last node.
+    """
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric {metric}, expected one of {METRICS}')
+    points = _points(rng, n, metric)
+    D = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+    if metric == 'asymmetric':
+        # Climbing from i to j costs the difference of heights: the direct climb never exceeds the
+        # sum of the climbs along a path, so the triangle inequality still holds
+        heights = rng.uniform(0, AREA / 2, size=n + 1)
+        D = D + np.maximum(0, heights[None, :] - heights[:, None])
+    D = np.ceil(D).astype(np.int32)
+    np.fill_diagonal(D, 0)
+    return D
+
+
+def capacities(rng, m, s, tightness):
+    """
+    Return m capacities summing to about sum(s) / tightness, spread by up to +-25% around the mean,
+    each large enough for the largest item.
+    """
+    if not 0 < tightness <= 1:
+        raise ValueError('The tightness must be in (0, 1]')
+    mean = sum(s) / tightness / m
+    l = np.ceil(mean * rng.uniform(0.75, 1.25, size=m)).astype(np.int32)
+    return np.maximum(l, max(s))
+
+
+def generate_instance(m, n, tightness=0.5, metric='euclidean', seed=0):
+    """
+    Generate an instance from its spec and seed.
+    :return: (m, n, l, s, D) with l, s and D as int32 arrays
+    """
+    # The spec is part of the seed, so each instance is reproducible on its own
+    rng = np.random.default_rng([seed, m, n, round(tightness * 1000), METRICS.index(metric)])
+    s = rng.integers(1, MAX_SIZE + 1, size=n).astype(np.int32)
+    l = capacities(rng, m, s, tightness)
+    D = distances(rng, n, metric)
+    return m, n, l, s, D
+
+
+def write_dat(file_path, m, n, l, s, D):
+    # Same layout as the instances/ files
+    with open(file_path, 'w') as file:
+        file.write(f'{m}\n{n}\n')
+        file.write(' '.join(str(value) for value in l) + '\n')
+        file.write(' '.join(str(value) for value in s) + '\n')
+        for row in D:
+            file.write(' '.join(str(value) for value in row) + '\n')
+
+
+def suite_specs(suite):
+    """
+    Return the specs of a suite, smallest instances first.
+    """
+    sweep = SUITES[suite]
+    specs = [{'m': m, 'n': n, 'tightness': tightness, 'metric': metric}
+             for m, n, tightness, metric in itertools.product(sweep['m'], sweep['n'], sweep['tightness'], sweep['metric'])
+             if m <= n]
+    return sorted(specs, key=lambda spec: (spec['n'], spec['m']))
+
+
+def generate_suite(suite, folder, seeds=(0,)):
+    """
+    Write the instances of the suite to folder, once for each seed.
+    :return: list of (instance name, spec, seed, file path)
+    """
+    os.makedirs(folder, exist_ok=True)
+    instances = []
+    for spec in suite_specs(suite):
+        for seed in seeds:
+            name = instance_name(spec, seed)
+            file_path = os.path.join(folder, f'{name}.dat')
+            write_dat(file_path, *generate_instance(seed=seed, **spec))
+            instances.append((name, spec, seed, file_path))
+    return instances
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the instances of a benchmark suite.')
+    parser.add_argument('--suite', default='scaling', choices=sorted(SUITES))
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--out', default='benchmark/instances')
+    args = parser.parse_args()
+
+    for name, _, _, file_path in generate_suite(args.suite, args.out, args.seeds):
+        print(f'{name}: {file_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark harness: runs approaches over the generated instances of a suite with a fixed time
+budget, writes a JSON report of every run (time, objective, memory and model size) and compares
+it against a baseline report to flag performance regressions.
+
+    python -m benchmark.harness run --suite scaling --approaches SAT SMT --timeout 60
+    python -m benchmark.harness run --suite smoke --baseline benchmark/baseline.json
+    python -m benchmark.harness compare benchmark/reports/scaling.json benchmark/baseline.json
+
+Results are not written to the result store: benchmark runs are kept apart from the results
+of the instances/ files.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from benchmark.generator import SUITES, generate_suite
+from common.engines import SOLVERS
+from common.profiling import enable_profiling
+from common.result_store import write_json_atomic
+from common.runner import solve_instance
+
+INSTANCES_FOLDER = 'benchmark/instances'
+REPORTS_FOLDER = 'benchmark/reports'
+BASELINE_PATH = 'benchmark/baseline.json'
+
+# Metrics copied from the result of a run into the report
+RUN_METRICS = ('build_time', 'solve_time', 'peak_rss_mb', 'variables', 'constraints')
+
+
+def run_one(approach, solver, name, file_path, timeout, cores=None):
+    """
+    Solve an instance on a fresh process and return its entry of the report.
+    """
+    start = time.time()
+    res = solve_instance(approach, solver, name, file_path, timeout=timeout, cores=cores, warm=False)
+    metrics = res.get('metrics', {})
+    run = {
+        'wall_time': round(time.time() - start, 3),
+        'time': res.get('time'),
+        'optimal': bool(res.get('optimal')),
+        'obj': res.get('obj') if isinstance(res.get('obj'), int) else None,
+    }
+    run.update({key: metrics.get(key) for key in RUN_METRICS})
+    return run
+
+
+def run_benchmark(suite, approaches, csp_solvers=('gecode',), timeout=60, seeds=(0,), cores=None,
+                  folder=INSTANCES_FOLDER):
+    """
+    Run every (approach, solver) on every instance of the suite.
+    :return: the report, with the runs keyed by 'instance/approach/solver'
+    """
+    instances = generate_suite(suite, folder, seeds)
+    report = {
+        'suite': suite,
+        'seeds': list(seeds),
+        'timeout': timeout,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'runs': {},
+    }
+    for approach in approaches:
+        solvers = csp_solvers if approach == 'CSP' else SOLVERS[approach][:1]
+        for solver in solvers:
+            for name, spec, seed, file_path in instances:
+                print(f'Benchmarking {name} with approach: {approach} and solver {solver}')
+                run = run_one(approach, solver, name, file_path, timeout, cores)
+                run.update(spec, seed=seed, instance=name, approach=approach, solver=solver)
+                report['runs'][f'{name}/{approach}/{solver}'] = run
+                print(f"  obj {run['obj']} optimal {run['optimal']} in {run['wall_time']} s")
+    return report
+
+
+def compare(report, baseline, time_tolerance=0.25, min_seconds=1.0, memory_tolerance=0.25, size_tolerance=0.1):
+    """
+    Compare a report with a baseline report of the same suite and budget.
+    A run regresses when it loses a solution or the optimality proof, finds a worse objective,
+    proves optimality more than time_tolerance (and min_seconds) slower, uses more than
+    memory_tolerance more memory or builds a model more than size_tolerance larger.
+    :return: list of the regressions found, as readable strings
+    """
+    def grew(value, base, tolerance, slack=0.0):
+        return value is not None and base is not None and value > base * (1 + tolerance) + slack
+
+    regressions = []
+    if report.get('timeout') != baseline.get('timeout'):
+        regressions.append(f"Time budget changed from {baseline.get('timeout')} to {report.get('timeout')} s")
+
+    for key, base in sorted(baseline['runs'].items()):
+        run = report['runs'].get(key)
+        if run is None:
+            continue
+        if base['obj'] is not None and run['obj'] is None:
+            regressions.append(f'{key}: no solution found (baseline {base["obj"]})')
+        elif base['obj'] is not None and run['obj'] > base['obj']:
+            regressions.append(f'{key}: objective {run["obj"]} worse than {base["obj"]}')
+        if base['optimal'] and not run['optimal']:
+            regressions.append(f'{key}: optimality no longer proven')
+        elif base['optimal'] and grew(run['wall_time'], base['wall_time'], time_tolerance, min_seconds):
+            regressions.append(f'{key}: {run["wall_time"]} s to optimality, {base["wall_time"]} s in the baseline')
+        if grew(run.get('peak_rss_mb'), base.get('peak_rss_mb'), memory_tolerance):
+            regressions.append(f'{key}: peak memory {run["peak_rss_mb"]} MB, {base["peak_rss_mb"]} MB in the baseline')
+        for size in ('variables', 'constraints'):
+            if grew(run.get(size), base.get(size), size_tolerance):
+                regressions.append(f'{key}: {run[size]} {size}, {base[size]} in the baseline')
+    return regressions
+
+
+def load_report(file_path):
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+def check_regressions(report, baseline_path):
+    # Print the regressions against the baseline, return the exit code of the command
+    baseline = load_report(baseline_path)
+    regressions = compare(report, baseline)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    print(f'{len(regressions)} regressions against {baseline_path}')
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the approaches on generated instances.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run a suite and write its report')
+    run_parser.add_argument('--suite', default='smoke', choices=sorted(SUITES))
+    run_parser.add_argument('--approaches', nargs='+', default=['MIP', 'SAT', 'SMT', 'CSP', 'HEUR', 'DECOMP', 'PORTFOLIO'], choices=list(SOLVERS))
+    run_parser.add_argument('--solvers', nargs='+', default=['gecode'], help='CSP solvers (gecode, chuffed, portfolio)')
+    run_parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    run_parser.add_argument('--timeout', type=int, default=60, help='time budget of every run in seconds')
+    run_parser.add_argument('--cores', type=int, help='cores given to every run (engine default if not set)')
+    run_parser.add_argument('--report', help=f'report file (default {REPORTS_FOLDER}/{{suite}}.json)')
+    run_parser.add_argument('--baseline', help='baseline report to compare with')
+    run_parser.add_argument('--profile', nargs='?', const='time', metavar='MODES',
+                            help='profile the model construction (time, cprofile, tracemalloc or all)')
+    run_parser.add_argument('--save-baseline', action='store_true', help=f'also write the report to {BASELINE_PATH}')
+
+    compare_parser = commands.add_parser('compare', help='compare a report with a baseline report')
+    compare_parser.add_argument('report')
+    compare_parser.add_argument('baseline', nargs='?', default=BASELINE_PATH)
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        return check_regressions(load_report(args.report), args.baseline)
+
+    if args.profile:
+        enable_profiling(args.profile)
+    report = run_benchmark(args.suite, args.approaches, args.solvers, args.timeout, args.seeds, args.cores)
+    report_path = args.report or os.path.join(REPORTS_FOLDER, f'{args.suite}.json')
+    write_json_atomic(report_path, report)
+    print(f'Report written to {report_path}')
+    if args.save_baseline:
+        write_json_atomic(BASELINE_PATH, report)
+    if args.baseline:
+        return check_regressions(report, args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
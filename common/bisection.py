@@ -0,0 +1,64 @@
+"""
+Bisection on the objective, shared by the SAT and SMT engines.
+
+Both engines look for a solution whose longest route is at most k, for k halving the interval
+between the largest value proven to have no solution and the objective of the best solution
+found. The interval starts from the bounds of common/bounds.py, is narrowed in a portfolio by the
+bounds of the other engines (common/bus.py) and only ever moves to values actually probed, so
+that once it is closed the best objective meets the proven bound, unless another engine found a
+better solution meanwhile.
+"""
+from common.bus import shared_bounds
+
+
+class Bisection:
+    """
+    Interval of the bisection: no solution has an objective up to `unreachable`, `upper` is the
+    objective of the best solution found, or the upper bound before the first one, and `best`
+    that objective (None until a solution is found).
+    """
+
+    def __init__(self, lower, upper):
+        # Every value below the lower bound is unreachable, so the largest value known to be
+        # unreachable is one less; the lower bound itself may or may not be reachable
+        self.unreachable = lower - 1
+        self.upper = upper
+        self.best = None
+        self.upper_probed = False
+
+    @property
+    def bound(self):
+        # Lower bound proven so far
+        return self.unreachable + 1
+
+    def next_guess(self):
+        """
+        Return the objective to probe next: the middle of the interval narrowed by the bounds on
+        the bus, or the upper bound itself once the interval is closed without a solution.
+        """
+        lower, self.upper = shared_bounds(self.bound, self.upper)
+        self.unreachable = lower - 1
+        if self.best is None and self.upper - self.unreachable <= 1:
+            self.upper_probed = True
+            return self.upper
+        return (self.unreachable + self.upper) // 2
+
+    def unsat(self, k):
+        # No solution of objective at most k
+        self.unreachable = max(self.unreachable, k)
+
+    def sat(self, obj):
+        # A solution of objective obj
+        self.best = obj if self.best is None else min(self.best, obj)
+        self.upper = min(self.upper, obj)
+
+    def closed(self):
+        """
+        Tell whether no value is left to probe: the best objective is then optimal if proven(),
+        there is no solution within the upper bound if no solution was found, and otherwise the
+        interval was closed by a better objective of another engine.
+        """
+        return self.upper - self.unreachable <= 1 and (self.best is not None or self.upper_probed)
+
+    def proven(self):
+        return self.best is not None and self.best <= self.bound
@@ -0,0 +1,283 @@
+import os
+import sys
+import math
+import ctypes
+from contextlib import contextmanager
+import numpy as np
+
+
+def route_limit(n, m):
+    """
+    Return the maximum number of items a courier can carry in the CSP, SAT and SMT encodings,
+    whose routes have ceil(1.5 * n / m) + 2 positions including the two visits to the depot.
+    """
+    return math.ceil(1.5 * n / m)
+
+
+def min_active_couriers(l, s):
+    """
+    Return the minimum number of couriers needed to carry all the items,
+    i.e. the smallest k such that the k largest capacities can hold the total size.
+    """
+    total_size = sum(s)
+    carried = 0
+    for k, capacity in enumerate(sorted(l, reverse=True), start=1):
+        carried += capacity
+        if carried >= total_size:
+            return k
+    return len(l)
+
+
+def incompatible_items(l, s):
+    """
+    Return the size of a set of items no two of which fit together in any courier, each of them
+    needing a courier of its own: the largest items, as long as the two smallest of them exceed
+    the largest capacity.
+    """
+    sizes = sorted(s, reverse=True)
+    largest = max(l)
+    count = min(1, len(sizes))
+    while count < len(sizes) and sizes[count - 1] + sizes[count] > largest:
+        count += 1
+    return count
+
+
+def active_couriers_bound(l, s):
+    """
+    Return a lower bound on the number of couriers carrying at least one item, from the total
+    size of the items and from the items that cannot share a courier.
+    """
+    return max(min_active_couriers(l, s), incompatible_items(l, s))
+
+
+def shortest_paths(D):
+    """
+    Return the matrix of the shortest distances between the nodes (Floyd-Warshall), equal to D
+    when D satisfies the triangle inequality. A route between two stops is never shorter.
+    """
+    paths = np.array(D, dtype=np.int64)
+    for node in range(len(paths)):
+        np.minimum(paths, paths[:, node][:, None] + paths[node][None, :], out=paths)
+    return paths
+
+
+def round_trip_bound(n, D):
+    """
+    Return the longest depot -> item -> depot trip, since the courier delivering
+    that item travels at least that far.
+    """
+    D = shortest_paths(D)
+    return int((D[n, :n] + D[:n, n]).max())
+
+
+def _min_arcs(D):
+    # Cheapest arc entering and leaving every node, self loops excluded
+    D = np.asarray(D, dtype=np.int64)
+    masked = D + np.diag(np.full(len(D), np.iinfo(np.int32).max, dtype=np.int64))
+    return masked.min(axis=0), masked.min(axis=1)
+
+
+def packing_bound(m, n, l, s, D):
+    """
+    Return a lower bound on the longest route from the total distance travelled.
+    Every item is entered and left exactly once and each active courier enters and leaves
+    the depot once, with at least active_couriers_bound(l, s) couriers active,
+    so the longest of the m routes is at least the cheapest total divided by m.
+    """
+    min_in, min_out = _min_arcs(D)
+    active = active_couriers_bound(l, s)
+    total = max(int(min_in[:n].sum()) + active * int(min_in[n]),
+                int(min_out[:n].sum()) + active * int(min_out[n]))
+    return math.ceil(total / m)
+
+
+def pair_bound(m, n, l, s, D):
+    """
+    Return a lower bound on the longest route from the items that share a courier.
+    Among any m + 1 items two are delivered by the same courier, whose route is at least the
+    shortest depot -> item -> item -> depot trip through both of them, over the shortest paths
+    (unbounded for two items that fit together in no courier). The bound is the smallest such trip among m + 1 items
+    chosen far apart, greedily from every item in turn.
+    Return 0 when there are no more items than couriers.
+    """
+    if n <= m:
+        return 0
+    D = shortest_paths(D)
+    s = np.asarray(s, dtype=np.int64)
+    unbounded = np.iinfo(np.int64).max // 4
+    items = D[:n, :n]
+    pair = np.minimum(D[n, :n][:, None] + items + D[:n, n][None, :],
+                      D[n, :n][None, :] + items.T + D[:n, n][:, None])
+    pair[s[:, None] + s[None, :] > max(l)] = unbounded
+    np.fill_diagonal(pair, unbounded)
+
+    # One greedy choice per starting item (rows): the item with the longest shortest trip to
+    # the items already chosen is added, m times
+    starts = np.arange(n)
+    closest = pair.copy()
+    closest[starts, starts] = -1
+    bound = np.full(n, unbounded)
+    for _ in range(m):
+        chosen = closest.argmax(axis=1)
+        bound = np.minimum(bound, closest[starts, chosen])
+        closest = np.minimum(closest, pair[chosen])
+        closest[starts, chosen] = -1
+    return int(bound.max())
+
+
+@contextmanager
+def _quiet_stdout():
+    # CBC prints the log of its LP solver on the C stdout whatever the verbosity of the model:
+    # the file descriptor itself goes to /dev/null while it solves, the C buffers flushed before it comes back
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        ctypes.CDLL(None).fflush(None)
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+def lp_bound(m, n, l, s, D, timeout=30):
+    """
+    Return the LP relaxation bound of the min-max assignment of the items to the couriers,
+    where each route is charged the cheapest arc entering (or leaving) its items and the depot.
+    Return None if python-mip is not available or the LP is not solved within timeout.
+    The stdout of the whole process is silenced while CBC solves.
+    """
+    try:
+        from mip import Model, xsum, minimize, OptimizationStatus
+    except ImportError:
+        return None
+
+    D = np.asarray(D)
+    min_in, min_out = _min_arcs(D)
+    paths = shortest_paths(D)
+    round_trip = paths[n, :n] + paths[:n, n]
+
+    model = Model(solver_name='CBC')
+    model.verbose = 0
+    x = [[model.add_var(lb=0, ub=1) for _ in range(n)] for _ in range(m)]
+    y = [model.add_var(lb=0, ub=1) for _ in range(m)]
+    z = model.add_var(lb=0)
+
+    for item in range(n):
+        model += xsum(x[courier][item] for courier in range(m)) == 1
+    for courier in range(m):
+        model += xsum(int(s[item]) * x[courier][item] for item in range(n)) <= int(l[courier])
+        for item in range(n):
+            model += y[courier] >= x[courier][item]
+            model += z >= int(round_trip[item]) * x[courier][item]
+        model += z >= xsum(int(min_in[item]) * x[courier][item] for item in range(n)) + int(min_in[n]) * y[courier]
+        model += z >= xsum(int(min_out[item]) * x[courier][item] for item in range(n)) + int(min_out[n]) * y[courier]
+
+    model.objective = minimize(z)
+    with _quiet_stdout():
+        status = model.optimize(max_seconds=timeout, relax=True)
+    if status != OptimizationStatus.OPTIMAL:
+        return None
+    # Distances are integers, so is the optimal objective (up to the LP tolerance)
+    return math.ceil(model.objective_value - 1e-6)
+
+
+def lower_bound(m, n, l, s, D, use_lp=False):
+    """
+    Return the best lower bound on the objective among the available ones.
+    """
+    bound = max(round_trip_bound(n, D), packing_bound(m, n, l, s, D), pair_bound(m, n, l, s, D))
+    if use_lp:
+        bound = max(bound, lp_bound(m, n, l, s, D) or 0)
+    return bound
+
+
+def route_length(route, D, n):
+    """
+    Return the length of a route given as the list of its items (0-based), depot excluded.
+    """
+    D = np.asarray(D)
+    path = np.array([n] + list(route) + [n])
+    return int(D[path[:-1], path[1:]].sum())
+
+
+def greedy_routes(m, n, l, s, D, max_items=None, packing=False):
+    """
+    Build a feasible solution with a cheapest insertion heuristic.
+    Items are inserted by decreasing size, each where the resulting longest route grows the least
+    or, with packing=True, in the courier left with the most free capacity (worst fit decreasing),
+    which spreads the items evenly and succeeds on instances whose capacities are tight.
+    Couriers left empty are filled first once the remaining items are just enough for them.
+    :return: list of routes of 0-based items, or None if the heuristic cannot fit all the items
+    """
+    D = np.asarray(D, dtype=np.int64)
+    s = np.asarray(s)
+    capacity = np.asarray(l, dtype=np.int64).copy()
+    if max_items is None:
+        max_items = n
+    if n < m:
+        return None
+
+    routes = [[] for _ in range(m)]
+    lengths = np.zeros(m, dtype=np.int64)
+    round_trip = D[n, :n] + D[:n, n]
+    order = sorted(range(n), key=lambda item: (-s[item], -round_trip[item]))
+
+    for position_in_order, item in enumerate(order):
+        empty = [courier for courier in range(m) if not routes[courier]]
+        if n - position_in_order <= len(empty):
+            candidates = empty
+        else:
+            candidates = range(m)
+
+        best = None
+        for courier in candidates:
+            if s[item] > capacity[courier] or len(routes[courier]) >= max_items:
+                continue
+            path = np.array([n] + routes[courier] + [n])
+            # Extra distance for inserting item between each pair of consecutive stops
+            delta = D[path[:-1], item] + D[item, path[1:]] - D[path[:-1], path[1:]]
+            position = int(delta.argmin())
+            new_length = lengths[courier] + delta[position]
+            if packing:
+                key = (s[item] - capacity[courier], new_length)
+            else:
+                key = (max(new_length, lengths.max()), new_length)
+            if best is None or key < best[0]:
+                best = (key, courier, position, new_length)
+        if best is None:
+            return None
+        _, courier, position, new_length = best
+        routes[courier].insert(position, int(item))
+        capacity[courier] -= s[item]
+        lengths[courier] = new_length
+
+    return routes
+
+
+def upper_bound(m, n, l, s, D, max_items=None):
+    """
+    Return the objective of the greedy solution, or None if no solution was found.
+    """
+    routes = greedy_routes(m, n, l, s, D, max_items=max_items)
+    if routes is None:
+        routes = greedy_routes(m, n, l, s, D, max_items=max_items, packing=True)
+    if routes is None:
+        return None
+    return max(route_length(route, D, n) for route in routes)
+
+
+def compute_bounds(m, n, l, s, D, max_items=None, use_lp=False):
+    """
+    Return the (lower, upper) bounds on the objective shared by all the engines.
+    The upper bound is achievable with at most max_items items per courier and every courier
+    carrying at least one item, so it is valid for every encoding; it is None when the
+    heuristic fails to find a solution.
+    """
+    lower = lower_bound(m, n, l, s, D, use_lp=use_lp)
+    upper = upper_bound(m, n, l, s, D, max_items=max_items)
+    # The upper bound is the objective of a solution: a lower bound above it is a bug of the bounds
+    assert upper is None or lower <= upper, f"Lower bound {lower} above the objective {upper} of a solution"
+    return lower, upper
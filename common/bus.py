@@ -0,0 +1,142 @@
+"""
+Incumbent bus: the best objective and lower bound of an instance, shared by the engines racing
+on it in a portfolio (PORTFOLIO/portfolio.py), whether they run in threads or in warm workers.
+
+The bus is a small file in shared memory (/dev/shm, mapped with numpy.memmap) holding one slot
+[objective, bound] per engine. Each slot is written by its engine only, so no lock is needed:
+the best objective is the smallest of the slots and the best bound the largest.
+
+An engine takes part by solving from a thread that joined the bus (join_bus): every event of its
+trajectory (common/trajectory.py) is published to its slot, with its bound only when that holds
+for the whole instance, the warm workers it solves on
+(common/workers.py) join the bus for the task, and shared_bounds() gives it the bounds found
+meanwhile by the others: MIP takes them as the bounds of its objective, SAT and SMT as the
+interval of their bisection and CSP as the bounds of z. Outside a portfolio nothing changes.
+"""
+import os
+import tempfile
+import threading
+import numpy as np
+
+# Entry of a slot nothing was written to yet (objectives and bounds are not negative)
+UNSET = -1
+# Folder of the bus files: memory-backed where available
+BUS_FOLDER = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Bus joined by the current thread, with its slot
+_joined = threading.local()
+
+
+class IncumbentBus:
+    """
+    Shared [objective, bound] slots, created with their number by the portfolio and attached
+    by the name of their file from the workers.
+    """
+
+    def __init__(self, slots=None, name=None):
+        self.owner = name is None
+        if self.owner:
+            descriptor, name = tempfile.mkstemp(prefix='cdmo_bus_', dir=BUS_FOLDER)
+            os.close(descriptor)
+            self.values = np.memmap(name, dtype=np.int64, mode='w+', shape=(slots, 2))
+            self.values[:] = UNSET
+        else:
+            self.values = np.memmap(name, dtype=np.int64, mode='r+').reshape(-1, 2)
+        self.name = name
+
+    def publish(self, slot, obj=None, bound=None):
+        # Only improvements are written, by the single writer of the slot
+        if obj is not None and (self.values[slot, 0] == UNSET or obj < self.values[slot, 0]):
+            self.values[slot, 0] = obj
+        if bound is not None and bound > self.values[slot, 1]:
+            self.values[slot, 1] = bound
+
+    def upper(self):
+        # Best objective of all the slots, None before the first solution
+        objectives = self.values[:, 0]
+        objectives = objectives[objectives != UNSET]
+        return int(objectives.min()) if len(objectives) else None
+
+    def lower(self):
+        bound = int(self.values[:, 1].max())
+        return bound if bound != UNSET else None
+
+    def proven(self):
+        # The best objective meets the best bound: it is optimal
+        upper, lower = self.upper(), self.lower()
+        return upper is not None and lower is not None and upper <= lower
+
+    def slot(self, index):
+        # (objective, bound) published by the engine of the slot, None where it published nothing
+        obj, bound = (int(value) for value in self.values[index])
+        return (obj if obj != UNSET else None), (bound if bound != UNSET else None)
+
+    def close(self):
+        del self.values
+        if self.owner:
+            os.unlink(self.name)
+
+
+def join_bus(bus, slot):
+    """
+    Take part in a portfolio from the current thread, publishing to the slot of the bus.
+    """
+    _joined.bus = (bus, slot)
+
+
+def leave_bus():
+    bus = getattr(_joined, 'bus', None)
+    _joined.bus = None
+    return bus
+
+
+def joined():
+    """
+    Return (bus name, slot) of the bus joined by the current thread, None if there is none.
+    """
+    bus = getattr(_joined, 'bus', None)
+    return (bus[0].name, bus[1]) if bus is not None else None
+
+
+def attach_bus(name, slot):
+    """
+    Join from a worker the bus of the thread that submitted its task, unless the bus is gone.
+    """
+    try:
+        join_bus(IncumbentBus(name=name), slot)
+    except FileNotFoundError:
+        # The portfolio ended before the worker started the task
+        return None
+
+
+def detach_bus():
+    # Leave the bus joined by attach_bus, closing the attachment
+    bus = leave_bus()
+    if bus is not None:
+        bus[0].close()
+
+
+def publish(obj, bound):
+    """
+    Publish an event to the bus joined by the current thread, if any.
+    """
+    bus = getattr(_joined, 'bus', None)
+    if bus is not None:
+        bus[0].publish(bus[1], obj, bound)
+
+
+def shared_bounds(lower, upper):
+    """
+    Return the (lower, upper) bounds on the objective narrowed by those on the bus joined by the
+    current thread: the objective of the best solution of any engine and the best bound
+    proven by any of them. Bounds None are unknown.
+    """
+    bus = getattr(_joined, 'bus', None)
+    if bus is None:
+        return lower, upper
+    shared_lower, shared_upper = bus[0].lower(), bus[0].upper()
+    if shared_lower is not None:
+        lower = shared_lower if lower is None else max(lower, shared_lower)
+    if shared_upper is not None:
+        upper = shared_upper if upper is None else min(upper, shared_upper)
+    return lower, upper
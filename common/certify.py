@@ -0,0 +1,150 @@
+"""
+Certified lower bounds, proving results optimal whichever engine found them.
+
+An engine proves its result optimal from its own search only (a bisection reaching its lower
+bound, a closed MIP gap, an exhausted MiniZinc search). A Certifier proves it from outside:
+it takes the best lower bound of common/bounds.py for the instance (longest depot round trip,
+packing bound over the couriers the item sizes need, pair bound). Handed to the engine as its
+monitor (see common/workers.py), it stops the engine as soon as an incumbent meets the bound,
+and certify() then marks the result optimal, timed when the incumbent was found.
+
+With CDMO_LP_BOUND set (--lp-bound of run_batch.py) the bound is also improved with the LP
+relaxation, solved in a child process while the engine runs. It is off by default: it takes a core
+for up to LP_TIMEOUT seconds and is usually far weaker than the others (57 against 167 on inst07).
+
+python3 -m common.certify certifies the results already stored.
+"""
+import os
+import threading
+import multiprocessing
+from common.bounds import lower_bound, lp_bound
+
+# The LP relaxation is solved for the instances with at most LP_MAX_ITEMS items, for at most
+# LP_TIMEOUT seconds: beyond that it takes several seconds of a core and is weaker than the others
+LP_MAX_ITEMS = 100
+LP_TIMEOUT = 30
+
+
+def lp_bound_enabled():
+    return bool(os.environ.get('CDMO_LP_BOUND'))
+
+
+def enable_lp_bound():
+    # Requests the LP bound in this process and in the job processes it starts
+    os.environ['CDMO_LP_BOUND'] = '1'
+
+
+def _lp_process(m, n, l, s, D, connection):
+    # Runs in a process of its own: lp_bound silences the stdout of the process while CBC solves,
+    # which would swallow the output of the run in the runner process
+    connection.send(lp_bound(m, n, l, s, D, timeout=LP_TIMEOUT))
+    connection.close()
+
+
+class Certifier:
+    """
+    Monitor of a run (as the JobMonitor of common/scheduler.py), stopping the engine once its
+    incumbent meets the certified lower bound. Every incumbent is passed on to the monitor it wraps.
+    """
+
+    def __init__(self, m, n, l, s, D, monitor=None, use_lp=None):
+        self.monitor = monitor
+        self.bound = lower_bound(m, n, l, s, D)
+        self.best = None
+        self.lock = threading.Lock()
+        self.lp = None
+        if use_lp is None:
+            use_lp = lp_bound_enabled()
+        if use_lp and n <= LP_MAX_ITEMS:
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            self.lp = multiprocessing.Process(target=_lp_process, args=(m, n, l, s, D, sender), daemon=True)
+            self.lp.start()
+            sender.close()
+            self.receiver = threading.Thread(target=self._receive_lp, args=(receiver,), daemon=True)
+            self.receiver.start()
+
+    def _receive_lp(self, receiver):
+        try:
+            bound = receiver.recv()
+        except EOFError:
+            # The run ended first and the LP was stopped
+            return
+        with self.lock:
+            if bound is not None and bound > self.bound:
+                self.bound = bound
+
+    def incumbent(self, res):
+        obj = res.get('obj')
+        if isinstance(obj, int) and (self.best is None or obj < self.best):
+            self.best = obj
+        if self.monitor is not None:
+            self.monitor.incumbent(res)
+
+    def should_stop(self):
+        # An incumbent meeting the bound cannot be improved: the rest of the run would be wasted
+        with self.lock:
+            if self.best is not None and self.best <= self.bound:
+                return True
+        return self.monitor is not None and self.monitor.should_stop()
+
+    def certify(self, res):
+        """
+        Add the certified lower bound to the result ('lower_bound') and mark the result optimal
+        if its objective meets it, its time being when the objective was first reached.
+        :return: the result
+        """
+        if self.lp is not None:
+            # The run is over: a bound found later would prove nothing
+            if self.lp.is_alive():
+                self.lp.terminate()
+            self.lp.join()
+            self.receiver.join()
+        with self.lock:
+            bound = self.bound
+        return certify_result(res, bound)
+
+
+def certify_result(res, bound):
+    """
+    Mark a result optimal if its objective meets the lower bound, see Certifier.certify.
+    """
+    obj = res.get('obj')
+    if not isinstance(obj, int):
+        return res
+    res['lower_bound'] = bound
+    if res.get('optimal') or obj > bound:
+        return res
+    res['optimal'] = True
+    trajectory = res.get('trajectory')
+    # First event of the run with the final objective, None if it was only reached after the last one
+    # (e.g. by the polishing or a re-optimization), the time of the result then standing
+    first = next((index for index, event in enumerate(trajectory or []) if event[1] is not None and event[1] <= obj),
+                 None)
+    if first is not None:
+        # From that event on, the bound meets the objective
+        res['time'] = int(trajectory[first][0])
+        for event in trajectory[first:]:
+            event[2] = obj
+    return res
+
+
+def main():
+    """
+    Certify the results already in the result store and refresh their result files.
+    """
+    # Imported here: the runner certifies every new result with this module
+    from common.instance import read_dat_file
+    from common.runner import get_store, instance_path, store_result
+
+    for instance_id, approach, solver, res in list(get_store().results()):
+        if not isinstance(res.get('obj'), int) or res.get('optimal'):
+            continue
+        m, n, l, s, D = read_dat_file(instance_path(instance_id))
+        certify_result(res, lower_bound(m, n, l, s, D, use_lp=n <= LP_MAX_ITEMS))
+        if res['optimal']:
+            print(f'{instance_id} {approach} {solver}: objective {res["obj"]} proven optimal')
+            store_result(approach, instance_id, solver, res)
+
+
+if __name__ == '__main__':
+    main()
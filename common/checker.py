@@ -0,0 +1,161 @@
+"""
+Checking of the results against their instance.
+
+Every solution must hold a route per courier, deliver every item exactly once, fit the capacity
+of each courier and have the longest route as its objective, which cannot be below the certified
+lower bound of common/bounds.py; the time of a result must be within the timeout. A result
+claimed optimal must be as good as every valid solution of the instance found by any approach,
+so that two results disagreeing on the optimum are both reported.
+
+The results of an instance are checked together in a single NumPy pass: the routes of all the
+solutions are laid one after the other with the depot around each, the distances gathered along
+them and summed per route with bincount, as the sizes of the items per courier and the number of
+times each item is delivered. Each instance is loaded once (common/instance.py keeps it cached)
+and the instances are checked in parallel in a process pool.
+
+The runners check every result before storing it (common/runner.py), so that a corrupted result
+never reaches the result store; solution_checker.py checks the stored results or a results folder.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from common.bounds import lower_bound
+from common.instance import load_instance
+
+TIMEOUT = 300
+
+
+def _solution_errors(res, m, n, header, timeout):
+    # Errors found before the solution is checked against the instance, and its routes if they can be
+    errors = []
+    time = res.get('time')
+    if not isinstance(time, (int, float)) or time < 0 or time > timeout:
+        errors.append(f"{header}: runtime unsound ({time} sec.)")
+    sol = res.get('sol')
+    if not sol or sol == 'N/A':
+        return errors, None
+    if not isinstance(sol, list) or len(sol) != m:
+        errors.append(f"{header}: solution {sol} has {len(sol) if isinstance(sol, list) else 0} routes for {m} couriers")
+        return errors, None
+    if not all(isinstance(item, (int, np.integer)) and 1 <= item <= n for route in sol for item in route):
+        errors.append(f"{header}: solution {sol} holds items out of 1..{n}")
+        return errors, None
+    if not isinstance(res.get('obj'), int):
+        errors.append(f"{header}: solution {sol} has no objective value ({res.get('obj')})")
+        return errors, None
+    return errors, sol
+
+
+def check_instance(m, n, l, s, D, results, bound=None, timeout=TIMEOUT):
+    """
+    Check the results of an instance.
+    :param results: [(header, res)], header naming the result in the messages
+    :param bound: lower bound on the objective, computed if None
+    :return: the list of errors and the list of warnings
+    """
+    l = np.asarray(l, dtype=np.int64)
+    s = np.asarray(s, dtype=np.int64)
+    D = np.asarray(D, dtype=np.int64)
+    if bound is None:
+        bound = lower_bound(m, n, l, s, D)
+    errors, warnings = [], []
+    if np.diag(D).any():
+        return ['Instance: distance from a node to itself not 0'], warnings
+
+    batch = []
+    for header, res in results:
+        result_errors, sol = _solution_errors(res, m, n, header, timeout)
+        errors += result_errors
+        if sol is not None:
+            batch.append((header, res, sol))
+    if not batch:
+        return errors, warnings
+
+    count = len(batch)
+    lengths = np.array([len(route) for _, _, sol in batch for route in sol], dtype=np.int64)
+    items = np.array([item for _, _, sol in batch for route in sol for item in route], dtype=np.int64) - 1
+    route_ids = np.repeat(np.arange(count * m), lengths)
+    # Deliveries of every item and load of every courier, for all the solutions at once
+    delivered = np.bincount((route_ids // m) * n + items, minlength=count * n).reshape(count, n)
+    loads = np.bincount(route_ids, weights=s[items], minlength=count * m).reshape(count, m)
+    # The routes one after the other, each between two depots: the arc from the depot ending a
+    # route to the one starting the next is D[n][n] = 0
+    nodes = np.full(len(items) + 2 * count * m, n, dtype=np.int64)
+    nodes[np.arange(len(items)) + 2 * route_ids + 1] = items
+    node_routes = np.repeat(np.arange(count * m), lengths + 2)
+    distances = np.bincount(node_routes[:-1], weights=D[nodes[:-1], nodes[1:]], minlength=count * m)
+    distances = np.rint(distances).astype(np.int64).reshape(count, m)
+
+    valid = {}
+    for index, (header, res, sol) in enumerate(batch):
+        result_errors = []
+        collected = int(delivered[index].sum())
+        if collected != n:
+            result_errors.append(f"{header}: solution {sol} collects {collected} instead of {n} items")
+        missing = np.flatnonzero(delivered[index] == 0) + 1
+        repeated = np.flatnonzero(delivered[index] > 1) + 1
+        if len(missing) or len(repeated):
+            result_errors.append(f"{header}: items {missing.tolist()} not delivered, items {repeated.tolist()} "
+                                 f"delivered more than once")
+        for courier in np.flatnonzero(loads[index] > l):
+            result_errors.append(f"{header}: path {sol[courier]} of courier {courier} has total size "
+                                 f"{int(loads[index, courier])}, exceeding its capacity {l[courier]}")
+        courier = int(distances[index].argmax())
+        max_dist = int(distances[index, courier])
+        if max_dist != res['obj']:
+            result_errors.append(f"{header}: objective value {res['obj']} inconsistent with max. distance "
+                                 f"{max_dist} of path {sol[courier]}, courier {courier}")
+        if res['obj'] < bound:
+            result_errors.append(f"{header}: objective value {res['obj']} below the certified lower bound {bound}")
+        if not result_errors:
+            valid[header] = max_dist
+        errors += result_errors
+
+    # The optimum is the best valid objective: a result claiming more is wrong
+    if valid:
+        best_header = min(valid, key=valid.get)
+        for header, res, _ in batch:
+            if res.get('optimal') and res['obj'] > valid[best_header]:
+                errors.append(f"{header}: claimed optimal value {res['obj']} inconsistent with the objective "
+                              f"{valid[best_header]} of {best_header}")
+        if any(res.get('optimal') and header in valid for header, res, _ in batch):
+            for header, res, _ in batch:
+                if not res.get('optimal'):
+                    warnings.append(f"{header}: not solved to optimality (optimal value {valid[best_header]})")
+    return errors, warnings
+
+
+def check_result(res, m, n, l, s, D, timeout=TIMEOUT, header='Result'):
+    """
+    Check a single result.
+    :return: the list of errors, empty if the result is sound
+    """
+    return check_instance(m, n, l, s, D, [(header, res)], timeout=timeout)[0]
+
+
+def _check_group(task):
+    # Runs in a process of the pool: the instance is loaded once for all its results
+    instance_path, results, timeout = task
+    if not os.path.exists(instance_path):
+        return [f'{header}: instance {instance_path} not found' for header, _ in results], []
+    m, n, l, s, D = load_instance(instance_path)
+    return check_instance(m, n, l, s, D, results, timeout=timeout)
+
+
+def check_all(groups, processes=None, timeout=TIMEOUT):
+    """
+    Check the results of several instances, the instances in parallel.
+    :param groups: {instance path: [(header, res)]}
+    :return: the list of errors and the list of warnings, instance by instance
+    """
+    tasks = [(instance_path, results, timeout) for instance_path, results in groups.items()]
+    if processes == 1 or len(tasks) <= 1:
+        outcomes = map(_check_group, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            outcomes = list(pool.map(_check_group, tasks))
+    errors, warnings = [], []
+    for instance_errors, instance_warnings in outcomes:
+        errors += instance_errors
+        warnings += instance_warnings
+    return errors, warnings
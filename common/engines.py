@@ -0,0 +1,172 @@
+"""
+Registry of the solving approaches.
+
+Each approach registers a loader that imports its engine (and the solver library behind it)
+only when the approach is used for the first time, so that running a single approach does not
+pay for the import of gurobipy, mip, z3 and minizinc all together.
+Every loader returns a function with the same signature:
+
+    solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+          encoding='full', initial=None)
+
+where cores is the number of cores the engine may use (None for its default), warm tells
+whether to solve on the warm workers of common/workers.py instead of a fresh process and monitor
+may stop a run on a warm worker before its timeout (see common/scheduler.py). encoding names the
+model to build, among the encodings of the approach listed in common/memory.py ('compact' is the
+cheaper SAT model picked under a memory limit, 'sparse' the SAT and MIP models on the arcs to the
+nearest successors of each item). initial is a solution to warm-start from, as a list of routes of
+1-based items (see common/reoptimize.py), used by the engines as far as their model allows.
+"""
+import os
+
+# Loaders of the approaches, and the engines already loaded
+_loaders = {}
+_engines = {}
+
+# Solvers available for each approach, the first one being the default
+SOLVERS = {
+    'MIP': ['Default'],
+    'SAT': ['Default'],
+    'SMT': ['Default'],
+    'CSP': ['gecode', 'chuffed', 'portfolio'],
+    'HEUR': ['Default'],
+    'DECOMP': ['Default'],
+    'PORTFOLIO': ['Default'],
+    'AUTO': ['Default'],
+}
+
+
+def register(approach):
+    """
+    Decorator registering the loader of an approach.
+    """
+    def decorator(loader):
+        _loaders[approach] = loader
+        return loader
+    return decorator
+
+
+def approaches():
+    return list(_loaders)
+
+
+def get_engine(approach):
+    """
+    Return the solve function of the approach, importing its engine on first use.
+    """
+    if approach not in _loaders:
+        raise ValueError(f'Unknown approach {approach}, expected one of {approaches()}')
+    if approach not in _engines:
+        _engines[approach] = _loaders[approach]()
+    return _engines[approach]
+
+
+@register('MIP')
+def _load_mip():
+    from MIP.mip_model import solve_MIP_with_timeout
+    from common.workers import get_pool
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        return solve_MIP_with_timeout(m, n, l.copy(), s.copy(), D, timeout=timeout,
+                                      threads=cores or -1,
+                                      pool=get_pool('MIP') if warm else None, name=instance_id,
+                                      monitor=monitor, encoding=encoding, initial=initial)
+    return solve
+
+
+@register('SAT')
+def _load_sat():
+    from SAT.SAT import solve_SAT_with_timeout
+    from common.workers import get_pool
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # The SAT solver of z3 takes no initial values: a warm start only reaches it as the upper
+        # bound of its bisection, through the incumbent bus (common/reoptimize.py)
+        return solve_SAT_with_timeout(m, n, l.copy(), s.copy(), D, timeout=timeout,
+                                      pool=get_pool('SAT') if warm else None, name=instance_id,
+                                      monitor=monitor, encoding=encoding)
+    return solve
+
+
+@register('SMT')
+def _load_smt():
+    from SMT.smt import solve_SMT_with_timeout
+    from common.workers import get_pool
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # The tactic solver of SMT ignores initial values: a warm start only reaches it as the upper
+        # bound of its bisection, through the incumbent bus (common/reoptimize.py)
+        return solve_SMT_with_timeout(m, n, l.copy(), s.copy(), D, timeout=timeout,
+                                      pool=get_pool('SMT') if warm else None, name=instance_id,
+                                      monitor=monitor)
+    return solve
+
+
+@register('CSP')
+def _load_csp():
+    from CSP.run_csp import solve_instance_csp, warm_journeys
+    from common.bounds import compute_bounds, route_limit
+
+    def solve(instance_id, m, n, l, s, D, solver='gecode', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # MiniZinc runs its solvers in processes of their own, there is no warm worker to use.
+        # The portfolio leaves one of its cores to Chuffed and gives the others to Gecode
+        processes = max(1, cores - 1) if solver == 'portfolio' and cores else None
+        # Instances without a .dzn file (e.g. generated ones) are given to MiniZinc as data
+        data = None if os.path.exists(f'CSP/instances/{instance_id}.dzn') else (m, n, l, s, D)
+        return solve_instance_csp(instance_id, solver=solver, timeout=timeout, processes=processes,
+                                  bounds=compute_bounds(m, n, l, s, D, max_items=route_limit(n, m)),
+                                  data=data, monitor=monitor, warm=warm_journeys(initial, m, n))
+    return solve
+
+
+@register('HEUR')
+def _load_heur():
+    from HEUR.heuristic import solve_HEUR_with_timeout
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # The heuristic stops by itself at its deadline, it runs in the calling process
+        return solve_HEUR_with_timeout(m, n, l, s, D, timeout=timeout, name=instance_id, monitor=monitor,
+                                       initial=initial)
+    return solve
+
+
+@register('DECOMP')
+def _load_decomp():
+    from DECOMP.decomposition import solve_DECOMP_with_timeout
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # The routes of the couriers are solved in parallel on `cores` threads
+        return solve_DECOMP_with_timeout(m, n, l, s, D, timeout=timeout, name=instance_id, cores=cores,
+                                         initial=initial)
+    return solve
+
+
+@register('PORTFOLIO')
+def _load_portfolio():
+    from PORTFOLIO.portfolio import solve_PORTFOLIO_with_timeout
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # Every engine of the portfolio runs on a core of its own
+        return solve_PORTFOLIO_with_timeout(m, n, l, s, D, timeout=timeout, name=instance_id, warm=warm,
+                                            monitor=monitor, initial=initial)
+    return solve
+
+
+@register('AUTO')
+def _load_auto():
+    from common.selection import solve_auto
+
+    def solve(instance_id, m, n, l, s, D, solver='Default', timeout=300, cores=None, warm=True, monitor=None,
+              encoding='full', initial=None):
+        # The engine and solver are selected from the stored results (common/selection.py),
+        # the encoding of its model under the memory limit as well
+        return solve_auto(instance_id, m, n, l, s, D, timeout=timeout, cores=cores, warm=warm, monitor=monitor,
+                          initial=initial)
+    return solve
@@ -0,0 +1,135 @@
+"""
+Loading of the .dat instances.
+
+An instance is parsed once into NumPy arrays and cached next to its source file:
+instXX.dat.npy holds the int32 distance matrix, loaded memory-mapped, and instXX.dat.npz holds
+m, n, the capacities, the sizes and the mtime, size and hash of the source, used to invalidate
+the cache when the .dat file changes.
+"""
+import os
+import hashlib
+import numpy as np
+
+# Instances already loaded by this process, keyed by path and validated by (mtime, size)
+_loaded = {}
+
+
+def parse_dat(file_path):
+    """
+    Parse a .dat file: m, n, the capacities l, the sizes s and the (n + 1) x (n + 1) distance matrix D.
+    :return: (m, n, l, s, D) with l, s and D as int32 arrays
+    """
+    with open(file_path, 'r') as file:
+        m = int(file.readline().strip())
+        n = int(file.readline().strip())
+        l = np.array(file.readline().split(), dtype=np.int32)
+        s = np.array(file.readline().split(), dtype=np.int32)
+        # The matrix is read in a single pass over the rest of the file
+        D = np.array(file.read().split(), dtype=np.int32).reshape(n + 1, n + 1)
+    return m, n, l, s, D
+
+
+def _file_hash(file_path):
+    with open(file_path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def courier_order(l):
+    """
+    Return the canonical order of the couriers, by capacity: couriers with equal capacities are
+    interchangeable, so two instances differing only in the order of the couriers share it.
+    """
+    return [int(courier) for courier in np.argsort(np.asarray(l), kind='stable')]
+
+
+def instance_key(file_path):
+    """
+    Return the hash of the content of the instance, with the couriers in canonical order,
+    and that order. Renamed or duplicated files share the hash, edited files do not.
+    :return: (hash, courier order)
+    """
+    m, n, l, s, D = load_instance(file_path)
+    order = courier_order(l)
+    digest = hashlib.sha1()
+    for part in (np.array([m, n]), l[order], s, D):
+        digest.update(np.ascontiguousarray(part, dtype='<i4').tobytes())
+    return digest.hexdigest(), order
+
+
+def instance_hash(file_path):
+    """
+    Return the hash identifying the instance in the result store.
+    """
+    return instance_key(file_path)[0]
+
+
+def cache_paths(file_path):
+    return f'{file_path}.npy', f'{file_path}.npz'
+
+
+def _read_cache(file_path, stat):
+    matrix_path, meta_path = cache_paths(file_path)
+    if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+        return None
+    with np.load(meta_path) as meta:
+        if (int(meta['mtime']), int(meta['size'])) != (stat.st_mtime_ns, stat.st_size):
+            # The source was touched: the cache is still good if its content did not change
+            if str(meta['hash']) != _file_hash(file_path):
+                return None
+            touched = True
+        else:
+            touched = False
+        m, n = int(meta['m']), int(meta['n'])
+        l, s = meta['l'], meta['s']
+    D = np.load(matrix_path, mmap_mode='r')
+    if D.shape != (n + 1, n + 1):
+        return None
+    if touched:
+        _write_cache(file_path, stat, m, n, l, s, np.array(D))
+    return m, n, l, s, D
+
+
+def _write_cache(file_path, stat, m, n, l, s, D):
+    # Written to temporary files first, so that a parallel reader never sees half a cache
+    matrix_path, meta_path = cache_paths(file_path)
+    try:
+        for path, write in ((matrix_path, lambda file: np.save(file, D)),
+                            (meta_path, lambda file: np.savez(file, m=m, n=n, l=l, s=s,
+                                                              mtime=stat.st_mtime_ns, size=stat.st_size,
+                                                              hash=_file_hash(file_path)))):
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                write(file)
+            os.replace(tmp_path, path)
+    except OSError:
+        # Read-only folder: the instance is simply parsed again next time
+        pass
+
+
+def load_instance(file_path):
+    """
+    Load an instance as NumPy arrays, from its cache when it is up to date.
+    The distance matrix is memory-mapped and read-only.
+    :return: (m, n, l, s, D) with l, s and D as int32 arrays
+    """
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    if key in _loaded and _loaded[key][0] == (stat.st_mtime_ns, stat.st_size):
+        return _loaded[key][1]
+
+    instance = _read_cache(file_path, stat)
+    if instance is None:
+        instance = parse_dat(file_path)
+        _write_cache(file_path, stat, *instance)
+    _loaded[key] = ((stat.st_mtime_ns, stat.st_size), instance)
+    return instance
+
+
+def read_dat_file(file_path):
+    """
+    Load an instance as Python lists, the format expected by the engines.
+    The lists are fresh copies, so engines can modify them.
+    :return: (m, n, l, s, D) with l and s lists of ints and D a list of lists of ints
+    """
+    m, n, l, s, D = load_instance(file_path)
+    return m, n, l.tolist(), s.tolist(), np.asarray(D).tolist()
@@ -0,0 +1,177 @@
+"""
+Memory limits of the jobs.
+
+A job may use at most CDMO_MEMORY_LIMIT_MB megabytes (--memory-limit of run_batch.py), enforced
+at three levels:
+
+- before building, estimate_model_mb predicts the memory of the model from the size of the
+  instance: a job predicted over the limit is built with the cheaper encoding of its engine if
+  it has one that fits (SAT: native cardinality constraints and weighted pseudo-boolean sums
+  instead of pairwise at-most-one and replicated literals, then the sparse arc graph; MIP: the
+  sparse arc graph), or skipped with the 'memory_limit' status recorded in its result;
+- while solving, the watchdog of the warm worker follows the resident memory of the process and
+  stops the solver once it goes over the limit, as on a timeout, keeping its best solution;
+- the address space of the solver process is capped with setrlimit(RLIMIT_AS), with room for the
+  libraries, so that a runaway allocation fails in the job instead of taking down the host and
+  the other jobs.
+"""
+import os
+import math
+import resource
+from common.preprocess import NEIGHBOURS, sparse_neighbours
+
+# Memory of a solver process before building any model (Python, NumPy and the solver library)
+BASE_MB = 60
+# Bytes taken by a term of a z3 expression, and by a nonzero of a python-mip constraint,
+# measured on the fixed instances
+Z3_TERM_BYTES = 200
+MIP_NONZERO_BYTES = 120
+# Address space reserved on top of the limit by thread stacks, malloc arenas and shared libraries
+ADDRESS_OVERHEAD_MB = 2048
+
+# Encodings of each approach, the cheapest last ('sparse' keeps the arcs to the nearest
+# successors only, see common/preprocess.py)
+ENCODINGS = {
+    'SAT': ('full', 'compact', 'sparse'),
+    'SMT': ('full',),
+    'MIP': ('full', 'sparse'),
+    'CSP': ('full',),
+    'HEUR': ('full',),
+    'DECOMP': ('full',),
+    'PORTFOLIO': ('full',),
+    'AUTO': ('full',),
+}
+
+
+def memory_limit_mb():
+    """
+    Return the memory limit of a job in MB, None if there is none.
+    """
+    value = os.environ.get('CDMO_MEMORY_LIMIT_MB')
+    return float(value) if value else None
+
+
+def set_memory_limit(limit_mb):
+    # Limit of this process and of the solver processes it starts, e.g. from a --memory-limit flag
+    os.environ['CDMO_MEMORY_LIMIT_MB'] = str(limit_mb)
+
+
+def rss_mb():
+    """
+    Return the current resident memory of this process in MB.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # No /proc: the peak is the best available approximation
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def apply_address_limit(limit_mb=None):
+    """
+    Cap the address space of this process (and of the processes it starts) to the memory limit
+    plus ADDRESS_OVERHEAD_MB. The cap is only ever lowered.
+    """
+    limit_mb = limit_mb or memory_limit_mb()
+    if not limit_mb:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    cap = int((limit_mb + ADDRESS_OVERHEAD_MB) * 2 ** 20)
+    if hard != resource.RLIM_INFINITY:
+        cap = min(cap, hard)
+    if soft == resource.RLIM_INFINITY or cap < soft:
+        resource.setrlimit(resource.RLIMIT_AS, (cap, hard))
+
+
+def _successors(n, encoding):
+    # Arcs leaving every node of the model: all the others, or the nearest ones of the sparse graph
+    if encoding == 'sparse':
+        return min(sparse_neighbours() or NEIGHBOURS, n) + 1
+    return n
+
+
+def _sat_terms(m, n, s, D, encoding):
+    T = math.ceil(1.5 * n / m) + 2
+    N = n + 1
+    arcs = _successors(n, encoding)
+    terms = m * N * (T + 1 + arcs)               # variables
+    terms += m * T * N                           # channeling of the weights
+    terms += 3 * m * (T - 1) * N * arcs          # transitions, And and Implies
+    terms += m * T * T + m * m * T * N           # routes and symmetry breaking
+    if encoding in ('compact', 'sparse'):
+        terms += m * T * (N + 1) + n * (m * T + 1)                   # cardinality constraints
+        terms += m * N + m * N * arcs                                # weighted capacity and objective
+    else:
+        terms += m * T * N * N + n * (m * T) ** 2                    # pairwise at most one
+        terms += m * int(sum(s)) + m * int(sum(map(sum, D)))         # replicated literals
+    return terms
+
+
+def _smt_terms(m, n):
+    T = math.ceil(1.5 * n / m) + 2
+    N = n + 1
+    terms = 3 * m * T * N                        # variables and their domains
+    terms += 5 * m * (T - 1) * N * N             # distance of every transition
+    terms += 2 * m * T * N + n * m * T           # assignment and capacity
+    terms += m * T * T + m * m * T * N           # routes and symmetry breaking
+    return terms
+
+
+def _mip_nonzeros(m, n, encoding):
+    N = n + 1
+    arcs = _successors(n, encoding) + 1
+    # Transition and flow constraints sum over the arcs of a node for every arc
+    return 2 * m * N * arcs ** 2 + 8 * m * N * arcs
+
+
+def estimate_model_mb(approach, m, n, l, s, D, encoding='full'):
+    """
+    Return the estimated peak memory in MB of building the model of the approach, None if unknown
+    (MiniZinc flattens its model in a process of its own).
+    """
+    if approach == 'SAT':
+        size = _sat_terms(m, n, s, D, encoding) * Z3_TERM_BYTES
+    elif approach == 'SMT':
+        size = _smt_terms(m, n) * Z3_TERM_BYTES
+    elif approach == 'MIP':
+        size = _mip_nonzeros(m, n, encoding) * MIP_NONZERO_BYTES
+    else:
+        return None
+    return round(BASE_MB + size / 2 ** 20, 1)
+
+
+def default_encoding(approach):
+    """
+    Return the encoding a job of the approach is built with when memory allows: the sparse one
+    when it is requested (CDMO_NEIGHBOURS) and the approach has it, the full one otherwise.
+    """
+    if sparse_neighbours() and 'sparse' in ENCODINGS.get(approach, ()):
+        return 'sparse'
+    return 'full'
+
+
+def choose_encoding(approach, m, n, l, s, D, limit_mb):
+    """
+    Return the first encoding of the approach, from its default one, whose estimated memory fits
+    the limit (None if none does) and its estimate.
+    """
+    estimate = None
+    encodings = ENCODINGS.get(approach, ('full',))
+    for encoding in encodings[encodings.index(default_encoding(approach)):]:
+        estimate = estimate_model_mb(approach, m, n, l, s, D, encoding)
+        if estimate is None or estimate <= limit_mb:
+            return encoding, estimate
+    return None, estimate
+
+
+def memory_limit_result(estimate_mb, limit_mb):
+    # Result of a job skipped because its model would not fit in memory
+    return {
+        'time': 0,
+        'optimal': False,
+        'obj': 'N/A',
+        'sol': [],
+        'status': 'memory_limit',
+        'memory': {'limit_mb': limit_mb, 'estimated_mb': estimate_mb, 'encoding': None},
+    }
@@ -0,0 +1,74 @@
+"""
+Resource metrics of a run, stored under the 'metrics' key of the result dict:
+
+    build_time     seconds spent building the model
+    solve_time     seconds spent in the solver
+    peak_rss_mb    peak resident memory of the process running the solver (for a warm worker,
+                   the peak over all the instances it has solved so far)
+    variables      number of variables of the model
+    constraints    number of constraints (assertions for z3, rows for MIP)
+    solver_stats   statistics reported by the solver itself
+"""
+import datetime
+import resource
+
+
+def new_metrics():
+    return {
+        'build_time': 0.0,
+        'solve_time': 0.0,
+        'peak_rss_mb': None,
+        'variables': None,
+        'constraints': None,
+        'solver_stats': {},
+    }
+
+
+def peak_rss_mb(children=False):
+    """
+    Return the peak resident set size in MB of this process, or of its terminated children
+    (e.g. the MiniZinc solvers) with children=True. ru_maxrss is in KB on Linux.
+    """
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def _json_value(value):
+    # Solver statistics may hold timedeltas (MiniZinc) or other non JSON values
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def record(metrics, solver_stats=None, children=False):
+    """
+    Return a copy of the metrics to store with a result, with the current peak memory
+    and the given solver statistics.
+    """
+    snapshot = dict(metrics)
+    snapshot['build_time'] = round(snapshot['build_time'], 3)
+    snapshot['solve_time'] = round(snapshot['solve_time'], 3)
+    snapshot['peak_rss_mb'] = peak_rss_mb(children)
+    if solver_stats is not None:
+        snapshot['solver_stats'] = {key: _json_value(value) for key, value in solver_stats.items()}
+    return snapshot
+
+
+def z3_statistics(solver):
+    stats = solver.statistics()
+    return {key: stats.get_key_value(key) for key in stats.keys()}
+
+
+def mip_statistics(model):
+    """
+    Return the gap, bound and node count of a python-mip model (node count with Gurobi only).
+    """
+    stats = {'gap': model.gap, 'objective_bound': model.objective_bound, 'num_solutions': model.num_solutions}
+    try:
+        stats['nodes'] = model.solver.get_dbl_attr('NodeCount')
+    except Exception:
+        # Not available with CBC
+        pass
+    return stats
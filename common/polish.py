@@ -0,0 +1,174 @@
+"""
+Route polishing: every new result is re-sequenced before it is stored (see common/runner.py).
+
+The engines often return a good assignment of the items to the couriers visited in a poor order,
+above all the incumbents of the runs stopped by the timeout. Keeping the item set of every
+courier, each route is replaced by the shortest one through the same items:
+
+- up to MAX_DP_ITEMS items, the optimal order found by the Held-Karp dynamic program over the
+  subsets of the items, vectorized with NumPy over all the subsets of a size;
+- for longer routes, the order left by 2-opt and Or-opt (moving segments of up to OR_OPT_LENGTH
+  items) once neither shortens it.
+
+The objective is recomputed from the polished routes, and the objective before polishing is
+kept under the 'polish' key of the result.
+"""
+from time import time
+import numpy as np
+from common.trajectory import add_event
+
+# Largest route ordered exactly: the dynamic program takes 2^k * k states
+MAX_DP_ITEMS = 15
+# Longest segment moved by Or-opt
+OR_OPT_LENGTH = 3
+
+# Cost of the states not reached, low enough not to overflow once an arc is added
+_UNREACHED = np.iinfo(np.int64).max // 4
+
+
+def route_path(route, n):
+    # Route as the array of its stops, with the depot n at both ends
+    return np.array([n] + list(route) + [n], dtype=np.int64)
+
+
+def path_length(path, D):
+    return int(D[path[:-1], path[1:]].sum())
+
+
+def held_karp(route, D, n):
+    """
+    Return the shortest order of the items of the route, from and back to the depot n.
+    """
+    k = len(route)
+    if k <= 1:
+        return list(route)
+    items = np.array(route, dtype=np.int64)
+    arcs = D[np.ix_(items, items)]
+    masks = np.arange(1 << k)
+    sizes = np.zeros(1 << k, dtype=np.int64)
+    for bit in range(k):
+        sizes += (masks >> bit) & 1
+
+    # cost[mask, j]: shortest path from the depot through the items of mask, ending in item j
+    cost = np.full((1 << k, k), _UNREACHED, dtype=np.int64)
+    parent = np.full((1 << k, k), -1, dtype=np.int64)
+    cost[1 << np.arange(k), np.arange(k)] = D[n, items]
+    for size in range(2, k + 1):
+        layer = masks[sizes == size]
+        for j in range(k):
+            ending = layer[(layer >> j) & 1 == 1]
+            # Every path through the other items of the mask, extended to j
+            extended = cost[ending ^ (1 << j)] + arcs[:, j][None, :]
+            best = extended.argmin(axis=1)
+            cost[ending, j] = extended[np.arange(len(ending)), best]
+            parent[ending, j] = best
+
+    mask = (1 << k) - 1
+    last = int((cost[mask] + D[items, n]).argmin())
+    order = []
+    while last >= 0:
+        order.append(int(items[last]))
+        mask, last = mask ^ (1 << last), int(parent[mask, last])
+    return order[::-1]
+
+
+def two_opt(route, D, n):
+    """
+    Return the route with the best segment reversal applied until none shortens it.
+    """
+    path = route_path(route, n)
+    while len(path) > 3:
+        # Prefix sums of the arcs of the path, forward and backward
+        forward = np.concatenate(([0], np.cumsum(D[path[:-1], path[1:]])))
+        backward = np.concatenate(([0], np.cumsum(D[path[1:], path[:-1]])))
+        # Reversing the stops i..j of the path
+        i = np.arange(1, len(path) - 2)[:, None]
+        j = np.arange(2, len(path) - 1)[None, :]
+        delta = (D[path[i - 1], path[j]] + D[path[i], path[j + 1]] + backward[j] - backward[i]
+                 - forward[j + 1] + forward[i - 1])
+        delta[j <= i] = 0
+        first, last = np.unravel_index(delta.argmin(), delta.shape)
+        if delta[first, last] >= 0:
+            break
+        first, last = first + 1, last + 2
+        path[first:last + 1] = path[first:last + 1][::-1]
+    return [int(item) for item in path[1:-1]]
+
+
+def or_opt(route, D, n):
+    """
+    Return the route with the best move of a segment of up to OR_OPT_LENGTH items to another
+    position applied until none shortens it.
+    """
+    path = route_path(route, n)
+    while True:
+        best = (0, None)
+        for length in range(1, min(OR_OPT_LENGTH, len(path) - 3) + 1):
+            # Moving the stops i..i+length-1 between the stops j-1 and j
+            i = np.arange(1, len(path) - length)[:, None]
+            j = np.arange(1, len(path))[None, :]
+            removed = D[path[i - 1], path[i]] + D[path[i + length - 1], path[i + length]] - D[path[i - 1], path[i + length]]
+            inserted = D[path[j - 1], path[i]] + D[path[i + length - 1], path[j]] - D[path[j - 1], path[j]]
+            delta = np.where((j < i) | (j > i + length), inserted - removed, 0)
+            first, position = np.unravel_index(delta.argmin(), delta.shape)
+            if delta[first, position] < best[0]:
+                best = (delta[first, position], (first + 1, position + 1, length))
+        if best[1] is None:
+            break
+        i, j, length = best[1]
+        segment = path[i:i + length]
+        rest = np.concatenate((path[:i], path[i + length:]))
+        j = j if j < i else j - length
+        path = np.concatenate((rest[:j], segment, rest[j:]))
+    return [int(item) for item in path[1:-1]]
+
+
+def polish_route(route, D, n):
+    """
+    Return the shortest order found for the items of the route, and its length.
+    """
+    if len(route) <= MAX_DP_ITEMS:
+        order = held_karp(route, D, n)
+    else:
+        order, length = list(route), None
+        # 2-opt and Or-opt in turn, until neither shortens the route
+        while True:
+            order = or_opt(two_opt(order, D, n), D, n)
+            new_length = path_length(route_path(order, n), D)
+            if length is not None and new_length >= length:
+                break
+            length = new_length
+    return order, path_length(route_path(order, n), D)
+
+
+def polish_result(res, n, D, elapsed=None):
+    """
+    Re-sequence the routes of a result in place, keeping the items of every courier,
+    and recompute its objective. Results without a solution are left as they are.
+    :param elapsed: seconds since the start of the run, to add the polished objective to the trajectory
+    :return: the result
+    """
+    if not isinstance(res.get('obj'), int) or not res.get('sol'):
+        return res
+    start = time()
+    D = np.asarray(D, dtype=np.int64)
+    routes, lengths, improved = [], [], 0
+    for route in res['sol']:
+        items = [item - 1 for item in route]
+        length = path_length(route_path(items, n), D)
+        order, new_length = polish_route(items, D, n)
+        if new_length < length:
+            items, length = order, new_length
+            improved += 1
+        routes.append([item + 1 for item in items])
+        lengths.append(length)
+
+    res['polish'] = {'obj': res['obj'], 'routes_improved': improved, 'seconds': round(time() - start, 3)}
+    obj = max(lengths)
+    if obj < res['obj'] and elapsed is not None and res.get('trajectory'):
+        # The bound of the run is unchanged, and was shared by the engine if it holds for the instance
+        add_event(res['trajectory'], elapsed + time() - start, obj, res['trajectory'][-1][2], shared=False)
+    res['sol'] = routes
+    res['obj'] = obj
+    return res
+
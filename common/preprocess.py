@@ -0,0 +1,170 @@
+"""
+Preprocessing shared by the model-based engines: the (courier, item) assignments and the arcs
+that no optimal solution uses are found before encoding, so that SAT, SMT and MIP create no
+variable and no constraint for them. The CSP model has no variable per arc: it removes the
+items a courier cannot carry from its domains itself (CSP/model.mzn).
+
+- domains: courier c can only carry the items with s[i] <= l[c];
+- infeasible pairs: items i and j with s[i] + s[j] > l[c] are never on the same route of
+  courier c, so there is no arc between them for that courier;
+- arc filtering: a route using the arc i -> j is at least as long as the shortest path from the
+  depot to i, the arc and the shortest path from j back to the depot, so with an upper bound on
+  the objective (the objective of a known solution) the arcs whose detour exceeds it are never
+  used by an optimal solution;
+- dominance: the capacity constraint of a courier able to carry all the items of its domain at
+  once is dominated and left out.
+
+Arcs dropped by the upper bound join two items that the courier may still carry (not one after
+the other), so the engines forbid them explicitly instead of only dropping their distance.
+
+For very large instances the 'sparse' encoding of SAT and MIP (CDMO_NEIGHBOURS, --neighbours of
+run_batch.py) also keeps only the arcs from each item to its k nearest items and the arcs from and
+to the depot, so that the model grows as n * k instead of n^2. The sparse model is a restriction
+of the problem: its solutions are solutions of the instance, but its optimum may not be, so its
+bounds are not published and its results are optimal only when they meet the lower bound of
+common/bounds.py. When the sparse graph has no solution, k is doubled and the model built again.
+The result records the sparse graph and the gap of its objective to the lower bound under 'sparse'.
+
+    python -m common.preprocess inst13      # size of the reduction of an instance
+    python -m common.preprocess inst13 10   # the same keeping the 10 nearest successors of each item
+"""
+import os
+import sys
+import numpy as np
+from common.bounds import shortest_paths
+from common.instance import read_dat_file
+
+# Nearest successors kept for each item by the sparse encoding, unless CDMO_NEIGHBOURS is set
+NEIGHBOURS = 10
+
+
+class Reduction:
+    """
+    Domains, arcs and capacity constraints left for each courier, with the depot as node n.
+    allowed[c][i] tells whether courier c may carry item i (always True for the depot),
+    arcs[c][i][j] whether it may travel from i to j, forbidden[c][i][j] whether the arc must be
+    forbidden explicitly and capacity[c] whether its capacity constraint is needed.
+    """
+
+    def __init__(self, allowed, arcs, forbidden, capacity):
+        self.allowed = allowed
+        self.arcs = arcs
+        self.forbidden = forbidden
+        self.capacity = capacity
+
+    def stats(self):
+        """
+        Return the size of the reduction: assignments and arcs kept out of all, explicitly forbidden
+        arcs and capacity constraints left out.
+        """
+        m, nodes = self.allowed.shape
+        return {
+            'assignments': int(self.allowed[:, :-1].sum()),
+            'assignments_total': m * (nodes - 1),
+            'arcs': int(self.arcs.sum()),
+            'arcs_total': m * nodes * (nodes - 1),
+            'forbidden_arcs': int(self.forbidden.sum()),
+            'capacities_dropped': int((~self.capacity).sum()),
+        }
+
+
+def sparse_neighbours():
+    """
+    Return the nearest successors kept for each item when the sparse arc graph is requested
+    (CDMO_NEIGHBOURS), None otherwise.
+    """
+    value = os.environ.get('CDMO_NEIGHBOURS')
+    return int(value) if value else None
+
+
+def set_neighbours(k):
+    # Requests the sparse arc graph in this process and in the solver processes it starts
+    os.environ['CDMO_NEIGHBOURS'] = str(k)
+
+
+def nearest_arcs(D, k):
+    """
+    Return the (n + 1) x (n + 1) mask of the arcs from every item to its k nearest items,
+    with all the arcs from and to the depot (node n).
+    """
+    D = np.asarray(D, dtype=np.int64)
+    n = len(D) - 1
+    mask = np.ones((n + 1, n + 1), dtype=bool)
+    if k < n - 1:
+        # Self loops and the depot never compete for a place among the neighbours
+        items = D[:n, :n] + np.diag(np.full(n, np.iinfo(np.int32).max, dtype=np.int64))
+        nearest = np.argpartition(items, k, axis=1)[:, :k]
+        mask[:n, :n] = False
+        mask[np.arange(n)[:, None], nearest] = True
+    mask[np.arange(n + 1), np.arange(n + 1)] = False
+    return mask
+
+
+def widen(k, n):
+    # Neighbours of the next sparse graph once the current one has no solution, n meaning all of them
+    return min(2 * k, n)
+
+
+def sparse_report(k, reduction, obj, lower):
+    """
+    Return the 'sparse' entry of a result: the neighbours and arcs of the sparse graph and the
+    relative gap between the objective and the lower bound, an upper bound on what the arcs left
+    out may cost.
+    """
+    stats = reduction.stats()
+    gap = None
+    if isinstance(obj, int) and obj > 0 and lower is not None:
+        gap = round(max(0, obj - lower) / obj, 4)
+    return {'neighbours': k, 'arcs': stats['arcs'], 'arcs_total': stats['arcs_total'], 'gap': gap}
+
+
+def reduce_instance(m, n, l, s, D, upper=None, neighbours=None):
+    """
+    Compute the reduction of an instance, upper being an upper bound on the objective (None if unknown).
+    With neighbours = k, only the arcs of the sparse graph of nearest_arcs are kept.
+    :return: Reduction, with numpy boolean arrays
+    """
+    l = np.asarray(l, dtype=np.int64)
+    sizes = np.append(np.asarray(s, dtype=np.int64)[:n], 0)
+    D = np.asarray(D, dtype=np.int64)
+
+    allowed = sizes[None, :] <= l[:, None]
+    # Pairs of nodes that fit together in each courier, the depot fitting with every allowed item
+    pairs = allowed[:, :, None] & allowed[:, None, :]
+    pairs &= (sizes[:, None] + sizes[None, :])[None, :, :] <= l[:, None, None]
+    pairs &= ~np.eye(n + 1, dtype=bool)[None, :, :]
+
+    arcs = pairs.copy()
+    if upper is not None:
+        paths = shortest_paths(D)
+        detour = paths[n, :, None] + D + paths[None, :, n]
+        # Arcs from and to the depot are a round trip through the item, on the shortest paths
+        detour[n, :] = D[n, :] + paths[:, n]
+        detour[:, n] = paths[n, :] + D[:, n]
+        arcs &= (detour <= upper)[None, :, :]
+    if neighbours is not None:
+        arcs &= nearest_arcs(D, neighbours)[None, :, :]
+
+    # A total over the capacity is the only way to put two allowed items on the same courier
+    # without an arc between them, so only the arcs dropped by the bound (or the sparse graph) need forbidding
+    forbidden = pairs & ~arcs
+    capacity = (allowed[:, :-1] * sizes[None, :-1]).sum(axis=1) > l
+    return Reduction(allowed, arcs, forbidden, capacity)
+
+
+def main(args):
+    from common.bounds import compute_bounds, route_limit
+
+    instance_id = args[1] if len(args) > 1 else 'inst01'
+    neighbours = int(args[2]) if len(args) > 2 else None
+    m, n, l, s, D = read_dat_file(f'instances/{instance_id}.dat')
+    _, upper = compute_bounds(m, n, l, s, D, max_items=route_limit(n, m))
+    stats = reduce_instance(m, n, l, s, D, upper, neighbours).stats()
+    print(f'{instance_id}: upper bound {upper}' + (f', {neighbours} nearest successors' if neighbours else ''))
+    print(f"  assignments kept: {stats['assignments']} of {stats['assignments_total']}")
+    print(f"  arcs kept: {stats['arcs']} of {stats['arcs_total']} ({stats['forbidden_arcs']} forbidden)")
+    print(f"  capacity constraints dropped: {stats['capacities_dropped']} of {m}")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,187 @@
+"""
+Opt-in profiling of the model construction of the engines.
+
+Profiling is off unless the CDMO_PROFILE environment variable is set (the --profile flag of
+run_batch.py and benchmark/harness.py sets it, and the solver processes inherit it) to a
+comma-separated list of:
+
+    time         wall time of every phase (implied by the others)
+    cprofile     a cProfile of every phase
+    tracemalloc  the memory allocated by the Python code of every phase
+
+e.g. CDMO_PROFILE=time,cprofile python3 run_all.py
+
+An engine splits its run into named phases (variables, capacity, transitions, symmetry,
+objective, solve, ...) with Profile.phase. Every time a result is recorded the per-phase breakdown
+is stored under metrics['profile'], and written to CDMO_PROFILE_DIR (profiles/ by default) as
+{engine}_{instance}.json, with the cProfile of the run as {engine}_{instance}.prof
+(python3 -m pstats profiles/SAT_inst07.prof to browse it).
+"""
+import os
+import pstats
+import cProfile
+import tracemalloc
+from time import perf_counter
+from common.result_store import write_json_atomic
+
+MODES = ('time', 'cprofile', 'tracemalloc')
+PROFILE_DIR = 'profiles'
+
+# Functions listed for each phase in the breakdown file, by own time
+TOP_FUNCTIONS = 10
+
+# Profile of the run in progress in this process, stopped if the run was interrupted
+_active = None
+
+
+def profile_modes():
+    """
+    Return the profiling modes enabled by CDMO_PROFILE, an empty set when profiling is off.
+    """
+    value = os.environ.get('CDMO_PROFILE', '').strip().lower()
+    if value in ('', '0', 'off', 'false'):
+        return set()
+    modes = {mode.strip() for mode in value.split(',') if mode.strip()}
+    if 'all' in modes:
+        return set(MODES)
+    # '1' or 'on' just switches timing on
+    modes = {mode for mode in modes if mode in MODES}
+    return modes | {'time'}
+
+
+def enable_profiling(modes):
+    """
+    Turn profiling on for this process and the solver processes it starts, e.g. from a --profile flag.
+    """
+    os.environ['CDMO_PROFILE'] = modes
+
+
+def _top_functions(profiler):
+    # Functions with the largest own time, as 'file:line(function)' and seconds
+    stats = pstats.Stats(profiler).stats
+    top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+    return [[pstats.func_std_string(function), round(own_time, 4)] for function, (_, _, own_time, _, _) in top]
+
+
+class Profile:
+    """
+    Per-phase profile of a run of an engine on an instance, doing nothing when profiling is off.
+    """
+
+    def __init__(self, engine, name=None):
+        global _active
+        if _active is not None:
+            # The previous run of this process was interrupted in the middle of a phase
+            _active.stop()
+        self.engine = engine
+        self.name = name if name is not None else str(os.getpid())
+        self.modes = profile_modes()
+        self.phases = {}
+        self.profilers = {}
+        self.current = None
+        self.started = 0.0
+        self.traced = 0
+        self.tracing = 'tracemalloc' in self.modes and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+        _active = self if self.modes else None
+
+    @property
+    def enabled(self):
+        return bool(self.modes)
+
+    def phase(self, name):
+        """
+        End the current phase and start the given one (None to start none).
+        A phase entered several times, e.g. once per iteration, adds up.
+        """
+        if not self.modes:
+            return
+        now = perf_counter()
+        if self.current is not None:
+            stats = self.phases.setdefault(self.current, {'time': 0.0, 'calls': 0})
+            stats['time'] += now - self.started
+            stats['calls'] += 1
+            if self.current in self.profilers:
+                self.profilers[self.current].disable()
+            if 'tracemalloc' in self.modes:
+                current, peak = tracemalloc.get_traced_memory()
+                stats['allocated_mb'] = stats.get('allocated_mb', 0.0) + (current - self.traced) / 2 ** 20
+                stats['peak_mb'] = max(stats.get('peak_mb', 0.0), (peak - self.traced) / 2 ** 20)
+
+        self.current = name
+        if name is None:
+            return
+        if 'tracemalloc' in self.modes:
+            tracemalloc.reset_peak()
+            self.traced = tracemalloc.get_traced_memory()[0]
+        if 'cprofile' in self.modes:
+            self.profilers.setdefault(name, cProfile.Profile()).enable()
+        self.started = perf_counter()
+
+    def breakdown(self):
+        return {name: {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+                for name, stats in self.phases.items()}
+
+    def report(self):
+        """
+        End the current phase and write the breakdown (and the cProfile) of the run so far.
+        :return: the per-phase breakdown, {} when profiling is off
+        """
+        if not self.modes:
+            return {}
+        self.phase(None)
+        breakdown = self.breakdown()
+        path = os.path.join(os.environ.get('CDMO_PROFILE_DIR', PROFILE_DIR), f'{self.engine}_{self.name}')
+        phases = {name: dict(stats) for name, stats in breakdown.items()}
+        if self.profilers:
+            merged = None
+            for name, profiler in self.profilers.items():
+                phases[name]['top'] = _top_functions(profiler)
+                merged = pstats.Stats(profiler) if merged is None else merged.add(profiler)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            merged.dump_stats(f'{path}.prof')
+        write_json_atomic(f'{path}.json', {'engine': self.engine, 'instance': self.name,
+                                           'modes': sorted(self.modes), 'phases': phases})
+        return breakdown
+
+    def attach(self, metrics):
+        # Add the breakdown of the run so far to the metrics of the result about to be recorded
+        if self.modes:
+            metrics['profile'] = self.report()
+
+    def stop(self):
+        # Leave no profiler running in the process, e.g. once the run was interrupted
+        global _active
+        if self.current in self.profilers:
+            self.profilers[self.current].disable()
+        self.current = None
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        if _active is self:
+            _active = None
+
+
+def report_interrupted():
+    """
+    Write and stop the profile of a run interrupted before it recorded a result, e.g. stopped by
+    the timeout while building its model.
+    :return: its per-phase breakdown, {} if there is none
+    """
+    if _active is None:
+        return {}
+    profile = _active
+    breakdown = profile.report()
+    profile.stop()
+    return breakdown
+
+
+def print_breakdown(engine, name, breakdown):
+    # One line per phase, the slowest first
+    total = sum(stats['time'] for stats in breakdown.values()) or 1.0
+    print(f'Profile of {engine} on {name}:')
+    for phase, stats in sorted(breakdown.items(), key=lambda item: item[1]['time'], reverse=True):
+        memory = f", {stats['allocated_mb']:.1f} MB allocated" if 'allocated_mb' in stats else ''
+        print(f"  {phase:<14} {stats['time']:9.3f} s {100 * stats['time'] / total:5.1f}% "
+              f"({stats['calls']} calls{memory})")
@@ -0,0 +1,239 @@
+"""
+Re-optimization of an instance that changed a little since it was solved: a few items added or
+removed, a courier more or less, a changed capacity. Instead of solving the changed instance from
+scratch, the previous solution is repaired into a solution of the changed instance and the engine
+is warm-started from it with a short budget:
+
+- apply_delta builds the changed instance from the delta (see below);
+- repair keeps the routes of the previous solution, removes the items and couriers that are gone,
+  takes out of the routes over a reduced capacity the items whose removal saves the most distance,
+  inserts the unassigned and the new items by regret insertion (HEUR/heuristic.py), gives an item
+  to every courier left without one (the models require it) and re-sequences the routes
+  (common/polish.py);
+- reoptimize solves the changed instance, the repaired solution being the start of the engine
+  (MIP start, warm_start annotation of CSP, initial solution of HEUR and DECOMP) and its objective
+  the upper bound of all of them, through an incumbent bus (common/bus.py): SAT and SMT, whose z3
+  solvers take no initial values, bisect below it. The result is the best of the engine and the
+  repaired solution.
+
+A delta is a dict (a JSON file on the command line), every key being optional:
+
+    remove_items      1-based numbers of the items removed
+    add_items         [{'size': s, 'row': [...], 'column': [...]}] the items added, 'row' holding the
+                      distances from the item to the nodes of the changed instance and 'column' those
+                      from the nodes to it (the entries of the other added items are read from their row)
+    remove_couriers   1-based numbers of the couriers removed
+    add_couriers      capacities of the couriers added
+    capacities        {courier: capacity}, the 1-based couriers whose capacity changed
+
+The changed instance keeps the items and couriers left in their order, followed by the added ones,
+the depot being the last node.
+
+    python -m common.reoptimize inst07 delta.json
+    python -m common.reoptimize inst07 delta.json --approach MIP --timeout 30 --output instances/inst07b.dat
+"""
+import os
+import time
+import argparse
+import json
+import numpy as np
+from benchmark.generator import write_dat
+from common.bounds import lower_bound
+from common.bus import IncumbentBus, join_bus, leave_bus
+from common.engines import SOLVERS
+from common.instance import read_dat_file
+from common.polish import path_length, polish_route, route_path
+from common.runner import check_approach_and_solver, get_store, instance_path, solve_instance_data, store_result
+from HEUR.heuristic import construct, regret_insertion
+
+# Seconds given to the engine to improve the repaired solution
+REOPT_TIMEOUT = 30
+
+
+def apply_delta(m, n, l, s, D, delta):
+    """
+    Apply a delta to an instance.
+    :return: the changed instance (m, n, l, s, D) as lists, and for every item and courier of the
+             instance its 0-based index in the changed one (None if it was removed)
+    """
+    removed_items = {item - 1 for item in delta.get('remove_items', [])}
+    removed_couriers = {courier - 1 for courier in delta.get('remove_couriers', [])}
+    capacities = {int(courier) - 1: capacity for courier, capacity in delta.get('capacities', {}).items()}
+    added = delta.get('add_items', [])
+
+    kept = [item for item in range(n) if item not in removed_items]
+    items = [None] * n
+    for index, item in enumerate(kept):
+        items[item] = index
+    couriers = [None] * m
+    new_l = []
+    for courier in range(m):
+        if courier not in removed_couriers:
+            couriers[courier] = len(new_l)
+            new_l.append(int(capacities.get(courier, l[courier])))
+    new_l += [int(capacity) for capacity in delta.get('add_couriers', [])]
+
+    new_n = len(kept) + len(added)
+    new_s = [int(s[item]) for item in kept] + [int(item['size']) for item in added]
+    # Nodes of the instance kept, in their order in the changed instance
+    nodes = kept + [n]
+    new_D = np.zeros((new_n + 1, new_n + 1), dtype=np.int64)
+    old_D = np.asarray(D, dtype=np.int64)
+    rows = [index for index in range(len(kept))] + [new_n]
+    new_D[np.ix_(rows, rows)] = old_D[np.ix_(nodes, nodes)]
+    for index, item in enumerate(added, start=len(kept)):
+        if len(item['row']) != new_n + 1 or len(item['column']) != new_n + 1:
+            raise ValueError(f'The distances of an added item need {new_n + 1} entries')
+        new_D[rows, index] = np.asarray(item['column'], dtype=np.int64)[rows]
+    for index, item in enumerate(added, start=len(kept)):
+        new_D[index, :] = item['row']
+        new_D[index, index] = 0
+    return (len(new_l), new_n, new_l, new_s, new_D.tolist()), items, couriers
+
+
+def _over_capacity(route, capacity, s, D, n):
+    # Items taken out of a route over the capacity, those whose removal saves the most distance first
+    removed = []
+    while route and sum(s[item] for item in route) > capacity:
+        path = route_path(route, n)
+        gains = D[path[:-2], path[1:-1]] + D[path[1:-1], path[2:]] - D[path[:-2], path[2:]]
+        removed.append(route.pop(int(gains.argmax())))
+    return removed
+
+
+def _fill_empty(routes, l, s, D, n):
+    # A courier without items takes, from another route of several items, the item it leaves the
+    # longest route shortest with
+    for courier, route in enumerate(routes):
+        if route:
+            continue
+        best = None
+        for other, items in enumerate(routes):
+            if len(items) < 2:
+                continue
+            for position, item in enumerate(items):
+                if s[item] > l[courier]:
+                    continue
+                rest = items[:position] + items[position + 1:]
+                key = max(path_length(route_path(rest, n), D), path_length(route_path([item], n), D))
+                if best is None or key < best[0]:
+                    best = (key, other, position)
+        if best is not None:
+            _, other, position = best
+            route.append(routes[other].pop(position))
+    return routes
+
+
+def repair(sol, m, n, l, s, D, delta):
+    """
+    Turn a solution of an instance into a solution of the instance changed by the delta.
+    :param sol: the routes of 1-based items of the solution
+    :return: the changed instance (m, n, l, s, D), the repaired routes of 1-based items and their
+             objective, the routes being None if no capacity-feasible solution was found
+    """
+    instance, items, couriers = apply_delta(m, n, l, s, D, delta)
+    new_m, new_n, new_l, new_s, new_D = instance
+    l_array, s_array = np.asarray(new_l, dtype=np.int64), np.asarray(new_s, dtype=np.int64)
+    D_array = np.asarray(new_D, dtype=np.int64)
+
+    routes = [[] for _ in range(new_m)]
+    unassigned = []
+    for courier, route in enumerate(sol):
+        kept = [items[item - 1] for item in route if items[item - 1] is not None]
+        if couriers[courier] is None:
+            unassigned += kept
+        else:
+            routes[couriers[courier]] = kept
+    for courier, route in enumerate(routes):
+        unassigned += _over_capacity(route, new_l[courier], new_s, D_array, new_n)
+    assigned = {item for route in routes for item in route}
+    unassigned += [item for item in range(new_n) if item not in assigned and item not in unassigned]
+
+    routes = regret_insertion(routes, sorted(unassigned), l_array, s_array, D_array, new_n)
+    if routes is None:
+        # The previous routes leave no room for the items: the heuristic construction starts over
+        routes = construct(new_m, new_n, l_array, s_array, D_array)
+    if routes is None:
+        return instance, None, None
+    routes = _fill_empty(routes, new_l, new_s, D_array, new_n)
+    routes = [polish_route(route, D_array, new_n)[0] if route else route for route in routes]
+    obj = max(path_length(route_path(route, new_n), D_array) for route in routes)
+    return instance, [[item + 1 for item in route] for route in routes], obj
+
+
+def reoptimize(approach, solver, sol, m, n, l, s, D, delta, timeout=REOPT_TIMEOUT, name=None, cores=None, warm=True):
+    """
+    Solve the instance changed by the delta, warm-started from the repaired solution.
+    :param sol: the routes of 1-based items of a solution of the instance
+    :return: the changed instance and the result dict ('time', 'optimal', 'obj', 'sol') of the
+             run, with 'reoptimize' holding the objective of the repaired solution
+    """
+    start = time.time()
+    instance, initial, obj = repair(sol, m, n, l, s, D, delta)
+    # The repaired objective is the upper bound of the engine, the lower bound its first bound
+    bus = IncumbentBus(1)
+    bus.publish(0, obj=obj, bound=lower_bound(*instance))
+    join_bus(bus, 0)
+    try:
+        res = solve_instance_data(approach, solver, name, instance, timeout=timeout, cores=cores, warm=warm,
+                                  initial=initial)
+    finally:
+        leave_bus()
+    # Bounds proven by the engine and the certifier
+    lower = max(bound for bound in (bus.lower(), res.get('lower_bound')) if bound is not None)
+    bus.close()
+
+    if initial is not None and not (isinstance(res.get('obj'), int) and res['obj'] <= obj):
+        # The engine found nothing better within the upper bound: the repaired solution stands
+        optimal = obj <= lower
+        res.update({'time': int(time.time() - start) if optimal else timeout, 'optimal': optimal, 'obj': obj,
+                    'sol': initial})
+    res['reoptimize'] = {'repaired_obj': obj}
+    return instance, res
+
+
+def previous_solution(instance_id):
+    """
+    Return the solution of least objective among the stored results of the instance, None if there is none.
+    """
+    best = None
+    store = get_store()
+    for approach in SOLVERS:
+        for res in store.instance_results(approach, instance_id).values():
+            if isinstance(res.get('obj'), int) and res.get('sol') and (best is None or res['obj'] < best['obj']):
+                best = res
+    return best['sol'] if best is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-optimize an instance changed by a delta from its stored solution.')
+    parser.add_argument('instance', help='instance id of the previous instance, e.g. inst07')
+    parser.add_argument('delta', help='JSON file of the delta')
+    parser.add_argument('--approach', default='AUTO')
+    parser.add_argument('--solver', default='Default')
+    parser.add_argument('--timeout', type=int, default=REOPT_TIMEOUT)
+    parser.add_argument('--output', help='write the changed instance to this .dat file and store its result')
+    args = parser.parse_args()
+
+    solver = check_approach_and_solver(args.approach, args.solver)
+    with open(args.delta, 'r') as file:
+        delta = json.load(file)
+    sol = previous_solution(args.instance)
+    if sol is None:
+        raise SystemExit(f'No stored solution of {args.instance} to start from')
+    m, n, l, s, D = read_dat_file(instance_path(args.instance))
+    name = args.output and args.output.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    instance, res = reoptimize(args.approach, solver, sol, m, n, l, s, D, delta, timeout=args.timeout,
+                               name=name or f'{args.instance}_delta')
+    print(f"Repaired objective: {res['reoptimize']['repaired_obj']}, objective: {res['obj']}, "
+          f"optimal: {res['optimal']}")
+    print(res['sol'])
+    if args.output:
+        write_dat(args.output, *instance)
+        # A changed instance written among the instances gets its result stored
+        if os.path.abspath(args.output) == os.path.abspath(instance_path(name)):
+            store_result(args.approach, name, solver, res)
+
+
+if __name__ == '__main__':
+    main()
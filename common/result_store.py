@@ -0,0 +1,275 @@
+"""
+SQLite store of the results of all the approaches.
+
+Results are keyed by (instance hash, approach, solver, config), where the instance hash is the
+hash of the content of the instance with the couriers sorted by capacity (common/instance.py) and
+config is the JSON of the options the result was obtained with (empty for the default ones).
+Solutions are stored with the couriers in that canonical order, and the instances table maps every
+instance file to its hash and courier order, so that a result is reused by any file with the same
+content and dropped when a file is edited. The database runs in WAL mode and every write is a
+transaction, so parallel workers can store their results at the same time;
+the res/{approach}/{instance_id}_result.json files are exported from it.
+
+    python -m common.result_store import   # load the existing res/ folder into the store
+    python -m common.result_store export   # rewrite the res/ folder from the store
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+
+DB_PATH = 'results.db'
+RESULTS_FOLDER = 'res'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    instance_hash TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    approach TEXT NOT NULL,
+    solver TEXT NOT NULL,
+    config TEXT NOT NULL,
+    time INTEGER,
+    optimal INTEGER,
+    obj INTEGER,
+    result TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (instance_hash, approach, solver, config)
+);
+CREATE INDEX IF NOT EXISTS results_by_solver ON results (approach, solver, config, instance_hash);
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    instance_hash TEXT NOT NULL,
+    courier_order TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS instances_by_hash ON instances (instance_hash);
+"""
+
+
+def config_key(config):
+    # Canonical text of the options, so that equal configs always give the same key
+    return json.dumps(config, sort_keys=True) if config else ''
+
+
+def permute_couriers(res, order, to_canonical=True):
+    """
+    Return a copy of the result with the routes of 'sol' (and of the portfolio results) moved from
+    the courier order of the instance to the canonical order, or back with to_canonical=False.
+    Courier k of the canonical order is courier order[k] of the instance.
+    """
+    def permute(sol):
+        if not isinstance(sol, list) or len(sol) != len(order):
+            return sol
+        if to_canonical:
+            return [sol[courier] for courier in order]
+        permuted = [None] * len(order)
+        for k, courier in enumerate(order):
+            permuted[courier] = sol[k]
+        return permuted
+
+    res = dict(res)
+    if 'sol' in res:
+        res['sol'] = permute(res['sol'])
+    if isinstance(res.get('portfolio'), dict):
+        res['portfolio'] = {solver: permute_couriers(solver_res, order, to_canonical)
+                            for solver, solver_res in res['portfolio'].items()}
+    return res
+
+
+def write_json_atomic(filename, data):
+    """
+    Write data as JSON to a temporary file and rename it over filename,
+    so that readers see either the old or the new file, never half of it.
+    """
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'w') as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_filename, filename)
+
+
+class ResultStore:
+    """
+    Connection to the result store. Each process opens its own.
+    """
+
+    def __init__(self, path=DB_PATH, timeout=60):
+        self.path = path
+        # Autocommit mode: transactions are opened explicitly by the writes
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, query, params):
+        # BEGIN IMMEDIATE takes the write lock at once, so concurrent writers wait (up to timeout)
+        # instead of failing when they upgrade from a read
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.connection.execute(query, params)
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+
+    def register_instance(self, instance_id, instance_hash, courier_order):
+        """
+        Record the current content of an instance file. Results of its previous content are
+        no longer attached to it, so an edited file is solved again.
+        """
+        row = self.connection.execute('SELECT instance_hash, courier_order FROM instances WHERE instance_id = ?',
+                                      (instance_id,)).fetchone()
+        if row != (instance_hash, json.dumps(courier_order)):
+            self._write('INSERT OR REPLACE INTO instances VALUES (?, ?, ?)',
+                        (instance_id, instance_hash, json.dumps(courier_order)))
+
+    def put(self, instance_id, instance_hash, approach, solver, res, config=None, courier_order=None):
+        """
+        Store the result of a run, replacing the previous one with the same key.
+        The solution is stored in the canonical courier order, courier_order being the one of the instance.
+        """
+        if courier_order is not None:
+            res = permute_couriers(res, courier_order)
+        obj = res.get('obj')
+        row = (instance_hash, instance_id, approach, solver, config_key(config),
+               res.get('time'), int(bool(res.get('optimal'))), obj if isinstance(obj, int) else None,
+               json.dumps(res), time.time())
+        self._write('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+
+    def get(self, instance_hash, approach, solver, config=None, courier_order=None):
+        """
+        Return the stored result, with the solution in the given courier order (canonical if None).
+        """
+        row = self.connection.execute(
+            'SELECT result FROM results WHERE instance_hash = ? AND approach = ? AND solver = ? AND config = ?',
+            (instance_hash, approach, solver, config_key(config))).fetchone()
+        if row is None:
+            return None
+        res = json.loads(row[0])
+        if courier_order is not None:
+            res = permute_couriers(res, courier_order, to_canonical=False)
+        return res
+
+    def is_solved(self, instance_hash, approach, solver, config=None):
+        return self.get(instance_hash, approach, solver, config) is not None
+
+    def unsolved(self, instance_hashes, approach, solver, config=None, optimal=False):
+        """
+        Return the instance hashes without a result for the approach, solver and config
+        (without an optimal one if optimal=True), in the given order.
+        """
+        query = 'SELECT instance_hash FROM results WHERE approach = ? AND solver = ? AND config = ?'
+        if optimal:
+            query += ' AND optimal = 1'
+        done = {row[0] for row in self.connection.execute(query, (approach, solver, config_key(config)))}
+        return [instance_hash for instance_hash in instance_hashes if instance_hash not in done]
+
+    def _instance_rows(self, approach, config, instance_id=None):
+        # Results attached to the current content of each instance file, with its courier order
+        query = """SELECT instances.instance_id, results.approach, results.solver, results.result,
+                          instances.courier_order
+                   FROM instances JOIN results ON results.instance_hash = instances.instance_hash
+                   WHERE results.config = ?"""
+        params = [config_key(config)]
+        if approach is not None:
+            query += ' AND results.approach = ?'
+            params.append(approach)
+        if instance_id is not None:
+            query += ' AND instances.instance_id = ?'
+            params.append(instance_id)
+        query += ' ORDER BY results.approach, instances.instance_id, results.updated'
+        for instance_id, approach_name, solver, result, courier_order in self.connection.execute(query, params):
+            res = permute_couriers(json.loads(result), json.loads(courier_order), to_canonical=False)
+            yield instance_id, approach_name, solver, res
+
+    def results(self, approach=None, config=None):
+        """
+        Iterate over the results of the instance files as (instance_id, approach, solver, res),
+        sorted by approach and instance, with the solutions in the courier order of each file.
+        """
+        return self._instance_rows(approach, config)
+
+    def instance_results(self, approach, instance_id, config=None):
+        """
+        Return {solver: res} for an instance, the content of its result file.
+        """
+        return {solver: res for _, _, solver, res in self._instance_rows(approach, config, instance_id)}
+
+    def is_empty(self):
+        # No instance file known yet: a new store, or one written before instances were registered
+        return self.connection.execute('SELECT 1 FROM instances LIMIT 1').fetchone() is None
+
+    def export_instance(self, approach, instance_id, folder=RESULTS_FOLDER):
+        # The result file of an instance is rewritten as a whole from the store
+        write_json_atomic(os.path.join(folder, approach, f'{instance_id}_result.json'),
+                          self.instance_results(approach, instance_id))
+
+    def export_json(self, folder=RESULTS_FOLDER):
+        """
+        Write the results with the default config in the res/{approach}/{instance_id}_result.json layout.
+        """
+        rows = self.connection.execute(
+            """SELECT DISTINCT results.approach, instances.instance_id
+               FROM instances JOIN results ON results.instance_hash = instances.instance_hash
+               WHERE results.config = ?""", (config_key(None),)).fetchall()
+        for approach, instance_id in rows:
+            self.export_instance(approach, instance_id, folder)
+
+    def import_json(self, folder=RESULTS_FOLDER, instances_folder='instances'):
+        """
+        Load the result files of the res/{approach}/{instance_id}_result.json layout into the store.
+        """
+        from common.instance import instance_key
+
+        for approach in sorted(os.listdir(folder)):
+            approach_folder = os.path.join(folder, approach)
+            if not os.path.isdir(approach_folder):
+                continue
+            for filename in sorted(os.listdir(approach_folder)):
+                if not filename.endswith('_result.json'):
+                    continue
+                instance_id = filename[:-len('_result.json')]
+                instance_path = os.path.join(instances_folder, f'{instance_id}.dat')
+                if not os.path.exists(instance_path):
+                    print(f'Skipping {filename}: instance {instance_path} not found')
+                    continue
+                with open(os.path.join(approach_folder, filename), 'r') as file:
+                    results = json.load(file)
+                instance_hash, courier_order = instance_key(instance_path)
+                self.register_instance(instance_id, instance_hash, courier_order)
+                for solver, res in results.items():
+                    self.put(instance_id, instance_hash, approach, solver, res, courier_order=courier_order)
+
+
+def open_store(path=DB_PATH, folder=RESULTS_FOLDER):
+    """
+    Open the result store, loading the existing result files the first time it is used.
+    """
+    store = ResultStore(path)
+    if store.is_empty() and os.path.isdir(folder):
+        store.import_json(folder)
+    return store
+
+
+def main(args):
+    command = args[1] if len(args) > 1 else None
+    with ResultStore() as store:
+        if command == 'import':
+            store.import_json()
+        elif command == 'export':
+            store.export_json()
+        else:
+            print(__doc__)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,212 @@
+import os
+import time
+from common.engines import get_engine
+from common.certify import Certifier
+from common.checker import TIMEOUT, check_result
+import common.instance
+from common.instance import load_instance, read_dat_file
+from common.memory import choose_encoding, default_encoding, memory_limit_mb, memory_limit_result
+from common.polish import polish_result
+from common.preprocess import NEIGHBOURS, sparse_neighbours
+from common.profiling import print_breakdown
+from common.telemetry import emit, job_status, serve_from_env
+from common.result_store import open_store
+
+INSTANCES_FOLDER = 'instances'
+
+
+def instance_files():
+    """
+    Return the names of the instance files, sorted so that instance number i is at index i - 1.
+    """
+    return sorted(f for f in os.listdir(INSTANCES_FOLDER) if f.endswith('.dat'))
+
+
+def instance_path(instance_id):
+    return os.path.join(INSTANCES_FOLDER, f'{instance_id}.dat')
+
+
+_store = None
+
+
+def get_store():
+    # Each process opens its own connection to the result store, on first use
+    global _store
+    if _store is None:
+        _store = open_store()
+    return _store
+
+
+def run_config(timeout=300, encoding='full'):
+    """
+    Return the options a result depends on, stored with it in the result store: the timeout, and
+    the encoding of the model with the neighbours kept by the sparse one. A job whose model fits
+    no memory limit (encoding None) is kept apart as well. Default options are left out, so that
+    their results keep the res/ layout.
+    """
+    config = {}
+    if timeout != 300:
+        config['timeout'] = timeout
+    if encoding != 'full':
+        config['encoding'] = encoding
+        if encoding == 'sparse':
+            config['neighbours'] = sparse_neighbours() or NEIGHBOURS
+    return config or None
+
+
+def model_encoding(approach, m, n, l, s, D):
+    """
+    Return the encoding a job of the approach builds its model with (None if it is not built at
+    all) and, under a memory limit (CDMO_MEMORY_LIMIT_MB), the memory record of its result.
+    """
+    limit = memory_limit_mb()
+    if not limit:
+        return default_encoding(approach), None
+    # The first encoding predicted to fit
+    encoding, estimate = choose_encoding(approach, m, n, l, s, D, limit)
+    return encoding, {'limit_mb': limit, 'estimated_mb': estimate, 'encoding': encoding}
+
+
+def job_config(approach, instance_id, timeout=300):
+    # Config of the result of a job, with the encoding it will build its model with
+    encoding, _ = model_encoding(approach, *read_dat_file(instance_path(instance_id)))
+    return run_config(timeout, encoding)
+
+
+def instance_key(instance_id):
+    # Hash of the current content of the instance file and its courier order, registered in the store
+    instance_hash, courier_order = common.instance.instance_key(instance_path(instance_id))
+    get_store().register_instance(instance_id, instance_hash, courier_order)
+    return instance_hash, courier_order
+
+
+def is_solved(approach, solver, instance_id, config=None):
+    # True also when the result was obtained on another file with the same content
+    instance_hash, _ = instance_key(instance_id)
+    return get_store().is_solved(instance_hash, approach, solver, config)
+
+
+def store_result(approach, instance_id, solver, res, config=None):
+    # Store the result in a transaction, then refresh res/{approach}/{instance_id}_result.json from the store
+    # A result failing the checks of common/checker.py is reported and never stored
+    timeout = (config.get('timeout') or config.get('budget') or TIMEOUT) if config else TIMEOUT
+    errors = check_result(res, *load_instance(instance_path(instance_id)), timeout=timeout,
+                          header=f'{approach} solver {solver}, instance {instance_id}')
+    if errors:
+        for error in errors:
+            print(f'Result not stored: {error}')
+        return
+    instance_hash, courier_order = instance_key(instance_id)
+    store = get_store()
+    store.put(instance_id, instance_hash, approach, solver, res, config, courier_order)
+    if config is None:
+        store.export_instance(approach, instance_id)
+
+
+def solve_instance(approach, solver, instance_id, instance_path, timeout=300, cores=None, warm=True, monitor=None):
+    """
+    Solve an instance file with the approach and solver, importing the engine on first use.
+    :return: the result dict of the engine ('time', 'optimal', 'obj', 'sol')
+    """
+    return solve_instance_data(approach, solver, instance_id, read_dat_file(instance_path), timeout=timeout,
+                               cores=cores, warm=warm, monitor=monitor)
+
+
+def solve_instance_data(approach, solver, instance_id, instance, timeout=300, cores=None, warm=True, monitor=None,
+                        initial=None):
+    """
+    Solve an instance given as (m, n, l, s, D) lists, as solve_instance.
+    :param initial: a solution (routes of 1-based items) to warm-start the engine from
+    :return: the result dict of the engine ('time', 'optimal', 'obj', 'sol')
+    """
+    m, n, l, s, D = instance
+    solve = get_engine(approach)
+    labels = {'approach': approach, 'solver': solver, 'instance': instance_id}
+    emit('start', **labels, cores=cores, timeout=timeout)
+    start = time.time()
+    # Stops the engine once its incumbent meets the certified lower bound (common/certify.py)
+    certifier = Certifier(m, n, l, s, D, monitor=monitor)
+    # Under a memory limit the model is built with the first encoding predicted to fit, and not
+    # built at all if none does
+    encoding, memory = model_encoding(approach, m, n, l, s, D)
+    if encoding is None:
+        print(f'Skipping instance: {instance_id} with approach: {approach}, its model needs about '
+              f'{memory["estimated_mb"]} MB ({memory["limit_mb"]} MB allowed)')
+        res = memory_limit_result(memory['estimated_mb'], memory['limit_mb'])
+    else:
+        res = solve(instance_id, m, n, l, s, D, solver=solver, timeout=timeout, cores=cores, warm=warm,
+                    monitor=certifier, encoding=encoding, initial=initial)
+        if memory is not None:
+            # The worker adds the resident memory it stopped the job at, if it did
+            res['memory'] = dict(memory, **res.get('memory', {}))
+    # Every route is re-sequenced, keeping the items of each courier (common/polish.py)
+    polish_result(res, n, D, elapsed=time.time() - start)
+    # A result meeting the lower bound is optimal, whichever engine found it
+    certifier.certify(res)
+    wall_time = time.time() - start
+    emit(job_status(res, wall_time, timeout), **labels, obj=res.get('obj'), optimal=bool(res.get('optimal')),
+         time=res.get('time'), wall_time=round(wall_time, 3), status=res.get('status'))
+    if res.get('metrics', {}).get('profile'):
+        # Profiling is on (CDMO_PROFILE): the engine has written its profile to profiles/
+        print_breakdown(approach, instance_id, res['metrics']['profile'])
+    return res
+
+
+def run_instance(approach, solver, filename):
+    """
+    Solve the instance file unless it has already been solved with the approach and solver,
+    and store the result in the result store and in res/{approach}/{instance_id}_result.json.
+    """
+    instance_id = os.path.splitext(filename)[0]
+    # Results of a sparse or fallback model are kept apart from the full-model ones in res/
+    config = job_config(approach, instance_id)
+
+    if is_solved(approach, solver, instance_id, config):
+        print(f'Skipping instance: {instance_id} with approach: {approach} and solver {solver} as it has already been solved.')
+        # The result may come from another file with the same content: give this file its result too
+        if config is None:
+            get_store().export_instance(approach, instance_id)
+        return
+
+    print(f'Processing instance: {instance_id} with approach: {approach} and solver {solver}')
+    res = solve_instance(approach, solver, instance_id, instance_path(instance_id))
+    print(f'Result for {instance_id}: {res}')
+    store_result(approach, instance_id, solver, res, config)
+
+
+def run_instances(approach, solver, indices=None):
+    """
+    Run the instances with the given numbers (1-based, all of them if None).
+    """
+    filenames = instance_files()
+    if indices is None:
+        indices = range(1, len(filenames) + 1)
+    serve_from_env()
+    for done, index in enumerate(indices):
+        emit('queue', pending=len(indices) - done)
+        if index <= 0 or index > len(filenames):
+            print(f"Index {index} out of range, skipping.")
+            continue
+        run_instance(approach, solver, filenames[index - 1])
+
+
+def ask_approach_and_solver():
+    # Interactive prompt shared by the runner scripts
+    print("Running the script from the command line.")
+    print("Please provide the approach and the solver to use.")
+    approach = input("Enter the approach (MIP, SAT, SMT, CSP, HEUR, DECOMP, PORTFOLIO, AUTO) \n or press Enter to select it automatically: ").upper() or 'AUTO'
+    solver = input("Enter the solver (gecode, chuffed, portfolio) only for CSP \n or press Enter for default: ").lower() or 'Default'
+    return approach, solver
+
+
+def check_approach_and_solver(approach, solver):
+    """
+    Return the solver to use with the approach: 'Default' outside CSP, gecode if none is given for CSP.
+    """
+    if approach != 'CSP': solver='Default'
+    else:
+        if solver=='Default': solver='gecode'
+
+    if approach not in ("MIP", "SAT", "SMT", "CSP", "HEUR", "DECOMP", "PORTFOLIO", "AUTO"): raise Exception("Incorrect approach")
+    if solver not in ("gecode", "chuffed", "portfolio", "Default"): raise Exception("Incorrect solver")
+    return solver
@@ -0,0 +1,165 @@
+"""
+Adaptive scheduler of a batch under a global budget of wall-clock seconds and cores.
+
+Instead of a fixed timeout per job, each job runs on a warm worker (common/workers.py) for a
+time slice, its fair share of what is left of the budget:
+
+    slice = (remaining seconds x cores) / (jobs pending + running), between min_slice and max_slice
+
+When its slice is over a job is extended by a new slice if its objective improved during the
+last one, or if no job is waiting for its core; otherwise it is pre-empted: its solver is
+interrupted and its best solution kept. Jobs proven optimal give their core back at once, so the
+time they did not use goes to the other jobs through larger slices and extensions. Every job is
+stopped at the end of the budget.
+
+MiniZinc cannot be interrupted from outside, so CSP jobs simply run for their first slice.
+"""
+import math
+import time
+import threading
+from queue import Queue, Empty
+from common.engines import get_engine
+from common.runner import solve_instance
+from common.telemetry import emit
+from common.workers import ENGINE_TARGETS, get_pool
+
+
+class JobMonitor:
+    """
+    Follows a running job: its slices and the last time its objective improved.
+    Handed to the worker pool, which reports every incumbent and asks whether to stop.
+    """
+
+    def __init__(self, scheduler, job, slice_seconds):
+        self.scheduler = scheduler
+        self.job = job
+        self.start = time.time()
+        self.slice = slice_seconds
+        self.granted_until = self.start + slice_seconds
+        self.slices = 1
+        self.best = None
+        self.last_improvement = None
+        self.stopped = None
+
+    def incumbent(self, res):
+        obj = res.get('obj')
+        if isinstance(obj, int) and (self.best is None or obj < self.best):
+            self.best = obj
+            self.last_improvement = time.time()
+
+    def improved_in_last_slice(self):
+        return self.last_improvement is not None and self.last_improvement >= self.granted_until - self.slice
+
+    def extend(self, slice_seconds):
+        self.slice = slice_seconds
+        self.granted_until = time.time() + slice_seconds
+        self.slices += 1
+
+    def should_stop(self):
+        return self.scheduler.review(self)
+
+
+class BudgetScheduler:
+    """
+    Runs jobs ({'approach', 'solver', 'instance_id', 'instance_path', 'size'}, as made by run_batch.py)
+    on `cores` cores for at most `budget` seconds of wall-clock in total.
+    """
+
+    def __init__(self, budget, cores, min_slice=10, max_slice=300):
+        self.budget = budget
+        self.cores = cores
+        self.min_slice = min_slice
+        self.max_slice = max_slice
+        self.deadline = None
+        self.pending = []
+        self.running = {}
+        # Taken by the pool threads reviewing their jobs and by the main loop
+        self.lock = threading.RLock()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.time())
+
+    def fair_slice(self):
+        # Share of the remaining core-seconds of every job still to run or running
+        with self.lock:
+            jobs = max(1, len(self.pending) + len(self.running))
+            share = self.remaining() * self.cores / jobs
+            return min(self.remaining(), max(self.min_slice, min(self.max_slice, share)))
+
+    def review(self, monitor):
+        """
+        Decide whether a running job goes on: False to let it run, True to pre-empt it.
+        """
+        with self.lock:
+            now = time.time()
+            if now >= self.deadline:
+                monitor.stopped = 'deadline'
+                return True
+            if now < monitor.granted_until:
+                return False
+            if monitor.improved_in_last_slice() or not self.pending:
+                monitor.extend(self.fair_slice())
+                return False
+            monitor.stopped = 'stagnated'
+            return True
+
+    def _run_job(self, job, monitor, results):
+        # Runs in a thread of its own, blocked on the worker of the job
+        interruptible = job['approach'] in ENGINE_TARGETS
+        # Interruptible jobs are stopped by review(), the timeout is only the end of the budget
+        timeout = self.remaining() if interruptible else monitor.slice
+        try:
+            res = solve_instance(job['approach'], job['solver'], job['instance_id'], job['instance_path'],
+                                 timeout=max(1, math.ceil(timeout)), cores=1, warm=True,
+                                 monitor=monitor if interruptible else None)
+        except Exception as e:
+            print(f"Error on instance: {job['instance_id']} with approach: {job['approach']}: {e!r}")
+            res = None
+        results.put((job, monitor, res))
+
+    def run(self, jobs, on_result):
+        """
+        Run the jobs, the smallest instances first so that the trivial ones give their time back early.
+        on_result(job, res) is called from the calling thread for every job that ran.
+        """
+        self.deadline = time.time() + self.budget
+        self.pending = sorted(jobs, key=lambda job: job['size'])
+        # Engines are imported and their pools sized before the job threads use them
+        for approach in {job['approach'] for job in jobs}:
+            get_engine(approach)
+            if approach in ENGINE_TARGETS:
+                get_pool(approach, self.cores)
+
+        results = Queue()
+        while self.pending or self.running:
+            with self.lock:
+                while self.pending and len(self.running) < self.cores and self.remaining() > 0:
+                    job = self.pending.pop(0)
+                    monitor = JobMonitor(self, job, self.fair_slice())
+                    self.running[id(job)] = monitor
+                    print(f"Processing instance: {job['instance_id']} with approach: {job['approach']} "
+                          f"and solver {job['solver']} ({monitor.slice:.0f} s slice)")
+                    threading.Thread(target=self._run_job, args=(job, monitor, results), daemon=True).start()
+                if self.pending and self.remaining() <= 0:
+                    for job in self.pending:
+                        print(f"Budget over, skipping instance: {job['instance_id']} with approach: {job['approach']}")
+                    self.pending = []
+                emit('queue', pending=len(self.pending), running=len(self.running))
+
+            try:
+                job, monitor, res = results.get(timeout=1.0)
+            except Empty:
+                continue
+            with self.lock:
+                del self.running[id(job)]
+            if res is None:
+                continue
+            elapsed = time.time() - monitor.start
+            # The time actually spent, instead of the fixed timeout of the engines
+            res['time'] = int(elapsed)
+            res['scheduler'] = {
+                'seconds': round(elapsed, 3),
+                'slices': monitor.slices,
+                'stopped': 'optimal' if res.get('optimal') else monitor.stopped or 'finished',
+            }
+            on_result(job, res)
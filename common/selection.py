@@ -0,0 +1,247 @@
+"""
+Automatic selection of the engine of an instance (AUTO approach).
+
+An instance is described by cheap features computed from its data (instance_features): its size,
+the slack of the capacities, the groups of couriers with identical capacities and statistics of
+the distance matrix, among which its asymmetry and how far it is from the triangle inequality.
+The selector is a k-nearest-neighbours model over the results of the result store: the expected
+cost of every (approach, solver) on an instance is the average cost of its results on the K stored
+instances with the closest features, weighted by their closeness. The cost of a result is its
+penalized time to solution (PAR-2): the time of a proven optimum, twice the timeout plus the
+primal gap to the best known objective otherwise, so that among the engines proving no optimum
+the ones finding better solutions come first.
+
+AUTO solves the instance with the engine of least expected cost; engines that are not installed,
+whose model does not fit in the memory limit or that fail are skipped for the next one.
+PORTFOLIO runs all the engines at once and is left out of the candidates.
+
+    python -m common.selection           # leave-one-out evaluation on the stored results
+    python -m common.selection inst07    # features of an instance and the ranking of the engines
+"""
+import os
+import sys
+import time
+import numpy as np
+from common.bounds import shortest_paths
+from common.engines import SOLVERS, get_engine
+from common.instance import load_instance
+from common.memory import choose_encoding, default_encoding, memory_limit_mb
+from common.runner import get_store, instance_path
+from common.trajectory import primal_gap
+
+# Neighbours the expected cost of an engine is averaged over
+K = 3
+# Cost of a result without a proven optimum, in timeouts (PAR-2)
+PENALTY = 2
+# Timeout of the stored results with the default config
+TIMEOUT = 300
+# Approaches never selected: AUTO itself and the portfolio of all the engines
+EXCLUDED = ('AUTO', 'PORTFOLIO')
+# Engine used when the result store holds no result yet
+DEFAULT_CHOICE = ('HEUR', 'Default')
+
+
+def instance_features(m, n, l, s, D):
+    """
+    Return the features of an instance, computed in O(n^3) NumPy operations at most.
+    :return: dict of named features
+    """
+    l = np.asarray(l, dtype=np.int64)
+    s = np.asarray(s, dtype=np.int64)
+    D = np.asarray(D, dtype=np.int64)
+    off_diagonal = ~np.eye(n + 1, dtype=bool)
+    distances = D[off_diagonal]
+    mean = max(float(distances.mean()), 1.0)
+    # Pairs of nodes with a detour shorter than their direct distance
+    violations = (D > shortest_paths(D))[off_diagonal]
+    return {
+        'm': m,
+        'n': n,
+        'items_per_courier': n / m,
+        'capacity_slack': float(l.sum() / max(s.sum(), 1)),
+        'capacity_groups': len(np.unique(l)),
+        'size_cv': float(s.std() / max(s.mean(), 1)),
+        'distance_mean': mean,
+        'distance_cv': float(distances.std() / mean),
+        'asymmetry': float(np.abs(D - D.T)[off_diagonal].mean() / mean),
+        'triangle_violations': float(violations.mean()),
+    }
+
+
+def feature_vector(features):
+    # The features as the model compares them: sizes on a log scale, groups relative to the couriers
+    return np.array([
+        np.log(features['m']),
+        np.log(features['n']),
+        np.log(features['items_per_courier']),
+        np.log(features['capacity_slack']),
+        features['capacity_groups'] / features['m'],
+        features['size_cv'],
+        np.log(features['distance_mean']),
+        features['distance_cv'],
+        features['asymmetry'],
+        features['triangle_violations'],
+    ])
+
+
+def run_cost(res, best, timeout=TIMEOUT):
+    """
+    Return the penalized time to solution of a result, best being the best known objective.
+    """
+    if res.get('optimal'):
+        return float(res.get('time', 0))
+    obj = res.get('obj')
+    return timeout * (PENALTY + primal_gap(obj if isinstance(obj, int) else None, best))
+
+
+def candidates():
+    # Every (approach, solver) the selector may pick
+    return [(approach, solver) for approach, solvers in SOLVERS.items() if approach not in EXCLUDED
+            for solver in solvers]
+
+
+class Selector:
+    """
+    k-nearest-neighbours model of the cost of the engines, trained on {instance_id: (features, costs)}
+    where costs maps (approach, solver) to the cost of its result on the instance.
+    """
+
+    def __init__(self, history, k=K):
+        self.k = k
+        self.instances = list(history)
+        self.costs = [history[instance_id][1] for instance_id in self.instances]
+        vectors = np.array([feature_vector(history[instance_id][0]) for instance_id in self.instances])
+        # Every feature is standardized on the training instances, constant ones weigh nothing
+        self.mean = vectors.mean(axis=0) if len(vectors) else 0
+        scale = vectors.std(axis=0) if len(vectors) else 1
+        self.scale = np.where(scale > 0, scale, np.inf) if len(vectors) else 1
+        self.vectors = (vectors - self.mean) / self.scale if len(vectors) else vectors
+
+    def rank(self, features, exclude=()):
+        """
+        Return the [(approach, solver, expected cost)] of the engines with a result on the
+        neighbours of the instance, the cheapest first. Instances in exclude are left out.
+        """
+        if not self.instances:
+            return [(*DEFAULT_CHOICE, float(TIMEOUT * PENALTY))]
+        distances = np.linalg.norm(self.vectors - (feature_vector(features) - self.mean) / self.scale, axis=1)
+        neighbours = [index for index in np.argsort(distances, kind='stable')
+                      if self.instances[index] not in exclude][:self.k]
+        expected = {}
+        for candidate in candidates():
+            total, weights = 0.0, 0.0
+            for index in neighbours:
+                if candidate in self.costs[index]:
+                    # An identical instance decides alone
+                    weight = 1 / max(distances[index], 1e-6)
+                    total += weight * self.costs[index][candidate]
+                    weights += weight
+            if weights:
+                expected[candidate] = total / weights
+        return sorted(((*candidate, cost) for candidate, cost in expected.items()), key=lambda entry: entry[2])
+
+
+def load_history(store=None):
+    """
+    Return {instance_id: (features, costs)} for the instance files with results with the default config.
+    """
+    store = store or get_store()
+    results = {}
+    for instance_id, approach, solver, res in store.results():
+        if approach not in EXCLUDED and os.path.exists(instance_path(instance_id)):
+            results.setdefault(instance_id, {})[(approach, solver)] = res
+    history = {}
+    for instance_id, runs in results.items():
+        objectives = [res['obj'] for res in runs.values() if isinstance(res.get('obj'), int)]
+        best = min(objectives) if objectives else None
+        costs = {candidate: run_cost(res, best) for candidate, res in runs.items()}
+        history[instance_id] = (instance_features(*load_instance(instance_path(instance_id))), costs)
+    return history
+
+
+_selector = None
+
+
+def get_selector():
+    # Trained on the result store once per process, on first use
+    global _selector
+    if _selector is None:
+        _selector = Selector(load_history())
+    return _selector
+
+
+def solve_auto(instance_id, m, n, l, s, D, timeout=300, cores=None, warm=True, monitor=None, initial=None):
+    """
+    Solve the instance with the engine of least expected cost that can run it.
+    :return: the result dict of that engine, with 'auto' holding the approach and solver selected
+             and their expected cost
+    """
+    start = time.time()
+    limit = memory_limit_mb()
+    for approach, solver, expected in get_selector().rank(instance_features(m, n, l, s, D)):
+        remaining = max(1, int(timeout - (time.time() - start)))
+        encoding = default_encoding(approach)
+        if limit:
+            # The model of the engine is built with the first of its encodings predicted to fit
+            encoding, _ = choose_encoding(approach, m, n, l, s, D, limit)
+            if encoding is None:
+                continue
+        try:
+            solve = get_engine(approach)
+            res = solve(instance_id, m, n, l, s, D, solver=solver, timeout=remaining, cores=cores, warm=warm,
+                        monitor=monitor, encoding=encoding, initial=initial)
+        except ImportError:
+            continue
+        except Exception as e:
+            print(f'AUTO: {approach} ({solver}) failed on {instance_id}: {e!r}')
+            continue
+        res['auto'] = {'approach': approach, 'solver': solver, 'expected_time': round(float(expected), 1)}
+        return res
+    return {'time': timeout, 'optimal': False, 'obj': 'N/A', 'sol': [], 'auto': None}
+
+
+def evaluate(history, k=K):
+    """
+    Leave-one-out evaluation: every stored instance is given the engine selected from the others.
+    :return: {instance_id: (selected, best)} and the total cost of the selected engines, of the
+             single best engine over all the instances and of the best engine of every instance
+    """
+    selector = Selector(history, k)
+    choices = {}
+    selected_cost, best_cost = 0.0, 0.0
+    for instance_id, (features, costs) in history.items():
+        ranking = [(approach, solver) for approach, solver, _ in selector.rank(features, exclude={instance_id})
+                   if (approach, solver) in costs]
+        selected = ranking[0] if ranking else min(costs, key=costs.get)
+        best = min(costs, key=costs.get)
+        choices[instance_id] = (selected, best)
+        selected_cost += costs[selected]
+        best_cost += costs[best]
+    # The single best engine is the one of least total cost over the instances it ran on all of
+    totals = {candidate: sum(costs[candidate] for _, costs in history.values())
+              for candidate in candidates() if all(candidate in costs for _, costs in history.values())}
+    single_best = min(totals.values()) if totals else None
+    return choices, selected_cost, single_best, best_cost
+
+
+def main(args):
+    history = load_history()
+    if len(args) > 1:
+        instance_id = args[1]
+        features = instance_features(*load_instance(instance_path(instance_id)))
+        for name, value in features.items():
+            print(f'{name:>20}: {value:.3f}' if isinstance(value, float) else f'{name:>20}: {value}')
+        for approach, solver, expected in Selector(history).rank(features, exclude={instance_id}):
+            print(f'{approach:>10} {solver:<10} expected {expected:.1f} s')
+        return
+    choices, selected_cost, single_best, best_cost = evaluate(history)
+    for instance_id, (selected, best) in sorted(choices.items()):
+        print(f'{instance_id}: selected {"/".join(selected)}, best {"/".join(best)}')
+    print(f'Total cost of the selected engines: {selected_cost:.0f} s (PAR-{PENALTY})')
+    if single_best is not None:
+        print(f'Total cost of the single best engine: {single_best:.0f} s')
+    print(f'Total cost of the best engine of every instance: {best_cost:.0f} s')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,272 @@
+"""
+Live telemetry of the runs: a JSON-lines event log and a local metrics endpoint in the
+Prometheus text format.
+
+Events are appended to the file named by the CDMO_TELEMETRY environment variable (off when
+unset), one JSON object per line with its time, kind and labels:
+
+    queue      jobs still pending and running
+    start      a job starts (approach, solver, instance)
+    incumbent  a better objective or bound is found during a job (obj, bound, elapsed seconds)
+    finish     a job ends with a proven result (optimal, or no solution exists)
+    timeout    a job ends because its time is over, or it was killed or stopped by its memory
+               limit (status 'memory_limit')
+
+Every process appends to the same file, the solver processes included, so the log is the
+only source of the metrics: the endpoint reads the new events of the log on every scrape.
+It is served on the port named by CDMO_METRICS_PORT by the runners (or --telemetry and
+--metrics-port for run_batch.py), or on its own, e.g. from another terminal:
+
+    python -m common.telemetry telemetry.jsonl --port 9464    # then scrape localhost:9464/metrics
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LOG = 'telemetry.jsonl'
+
+# Labels added to the events of each thread, e.g. the approach and instance an engine is solving:
+# the engines of a portfolio and the jobs of a scheduled batch run in threads of one process
+_context = threading.local()
+# Descriptor of the event log, opened once per process
+_log = None
+
+_server = None
+
+
+def log_path():
+    return os.environ.get('CDMO_TELEMETRY') or None
+
+
+def enable_telemetry(path=DEFAULT_LOG, port=None):
+    """
+    Turn telemetry on for this process and the solver processes it starts, e.g. from CLI flags.
+    """
+    os.environ['CDMO_TELEMETRY'] = path
+    if port:
+        os.environ['CDMO_METRICS_PORT'] = str(port)
+
+
+def set_context(**labels):
+    """
+    Set the labels added to every event of the current thread (None removes a label).
+    """
+    context = _labels()
+    for key, value in labels.items():
+        if value is None:
+            context.pop(key, None)
+        else:
+            context[key] = value
+
+
+def _labels():
+    # Labels of the current thread, created empty on first use
+    if not hasattr(_context, 'labels'):
+        _context.labels = {}
+    return _context.labels
+
+
+def emit(event, **fields):
+    """
+    Append an event to the log, if telemetry is on.
+    """
+    global _log
+    path = log_path()
+    if path is None:
+        return
+    if _log is None or _log[0] != (path, os.getpid()):
+        # O_APPEND makes each single write of a line land whole at the end of the file,
+        # whatever the other processes writing to it
+        _log = ((path, os.getpid()), os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644))
+    record = {'ts': round(time.time(), 3), 'event': event, 'pid': os.getpid()}
+    record.update(_labels())
+    record.update(fields)
+    os.write(_log[1], (json.dumps(record) + '\n').encode())
+
+
+def job_status(res, wall_time, timeout):
+    # A job ending before its timeout has proven its result, otherwise the time is what stopped it
+    # (the 'time' of the result is 0 for the runs stopped without a solution, so the wall time is used)
+    # A job stopped by its memory limit did not prove anything either
+    if res.get('status') == 'memory_limit':
+        return 'timeout'
+    return 'finish' if res.get('optimal') or wall_time < timeout else 'timeout'
+
+
+class TelemetryState:
+    """
+    Metrics aggregated from the events of the log.
+    """
+
+    def __init__(self):
+        self.started = {}
+        self.ended = {}
+        self.seconds = {}
+        self.incumbents = {}
+        self.running = {}
+        self.best = {}
+        self.pending = 0
+        self.last_event = 0.0
+
+    def apply(self, event):
+        kind = event.get('event')
+        job = (event.get('approach', ''), event.get('solver', ''))
+        run = job + (event.get('instance', ''),)
+        self.last_event = max(self.last_event, event.get('ts', 0.0))
+        if kind == 'queue':
+            self.pending = event.get('pending', 0)
+        elif kind == 'start':
+            self.started[job] = self.started.get(job, 0) + 1
+            self.running[run] = event['ts']
+        elif kind == 'incumbent':
+            # Engines do not know the solver they run with: the incumbent goes to the running job
+            run = next((key for key in self.running if key[0] == run[0] and key[2] == run[2]), run)
+            self.incumbents[run[0]] = self.incumbents.get(run[0], 0) + 1
+            obj, bound = self.best.get(run, (None, None))
+            if event.get('obj') is not None:
+                obj = event['obj']
+            if event.get('bound') is not None:
+                bound = event['bound']
+            self.best[run] = (obj, bound)
+        elif kind in ('finish', 'timeout'):
+            self.ended[job + (kind,)] = self.ended.get(job + (kind,), 0) + 1
+            self.seconds[job] = self.seconds.get(job, 0.0) + event.get('wall_time', 0.0)
+            self.running.pop(run, None)
+            if isinstance(event.get('obj'), int):
+                self.best[run] = (event['obj'], self.best.get(run, (None, None))[1])
+
+    def exposition(self):
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f'{name}{{{text}}} {value}' if text else f'{name} {value}')
+
+        metric('cdmo_queue_pending_jobs', 'gauge', 'Jobs waiting to start.', [({}, self.pending)])
+        metric('cdmo_running_jobs', 'gauge', 'Jobs currently running.', [({}, len(self.running))])
+        metric('cdmo_job_running', 'gauge', 'Start time of each running job.',
+               [(dict(approach=a, solver=s, instance=i), start) for (a, s, i), start in sorted(self.running.items())])
+        metric('cdmo_jobs_started_total', 'counter', 'Jobs started.',
+               [(dict(approach=a, solver=s), count) for (a, s), count in sorted(self.started.items())])
+        metric('cdmo_jobs_ended_total', 'counter', 'Jobs ended, by status (finish or timeout).',
+               [(dict(approach=a, solver=s, status=status), count) for (a, s, status), count in sorted(self.ended.items())])
+        metric('cdmo_job_seconds_total', 'counter', 'Wall seconds spent in the ended jobs.',
+               [(dict(approach=a, solver=s), round(seconds, 3)) for (a, s), seconds in sorted(self.seconds.items())])
+        metric('cdmo_incumbents_total', 'counter', 'Improving solutions or bounds found.',
+               [(dict(approach=a), count) for a, count in sorted(self.incumbents.items())])
+        metric('cdmo_best_objective', 'gauge', 'Best objective found on each instance.',
+               [(dict(approach=a, solver=s, instance=i), obj) for (a, s, i), (obj, _) in sorted(self.best.items())
+                if obj is not None])
+        metric('cdmo_best_bound', 'gauge', 'Best lower bound proven on each instance.',
+               [(dict(approach=a, solver=s, instance=i), bound) for (a, s, i), (_, bound) in sorted(self.best.items())
+                if bound is not None])
+        metric('cdmo_last_event_timestamp_seconds', 'gauge', 'Time of the last event.', [({}, self.last_event)])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class LogFollower:
+    """
+    Reads the events appended to the log since the last read into a TelemetryState.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.state = TelemetryState()
+        self.lock = threading.Lock()
+
+    def update(self):
+        with self.lock:
+            if not os.path.exists(self.path):
+                return self.state
+            if os.path.getsize(self.path) < self.offset:
+                # The log was truncated or replaced: start over
+                self.offset = 0
+                self.state = TelemetryState()
+            with open(self.path, 'rb') as file:
+                file.seek(self.offset)
+                data = file.read()
+            # A line still being written is read on the next update
+            end = data.rfind(b'\n') + 1
+            self.offset += end
+            for line in data[:end].splitlines():
+                try:
+                    self.state.apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+            return self.state
+
+
+def serve(path, port, host='127.0.0.1'):
+    """
+    Serve the metrics of the log on http://host:port/metrics from a background thread.
+    """
+    follower = LogFollower(path)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = follower.update().exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes are not worth a line on the console
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_from_env():
+    """
+    Start the metrics endpoint of the runners if CDMO_METRICS_PORT is set, once per process.
+    """
+    global _server
+    port = os.environ.get('CDMO_METRICS_PORT')
+    if _server is None and port:
+        path = log_path() or DEFAULT_LOG
+        os.environ['CDMO_TELEMETRY'] = path
+        _server = serve(path, int(port))
+        print(f'Metrics of {path} served on http://127.0.0.1:{port}/metrics')
+    return _server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the metrics of a telemetry log.')
+    parser.add_argument('log', nargs='?', default=DEFAULT_LOG)
+    parser.add_argument('--port', type=int, default=9464)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args(argv)
+
+    server = serve(args.log, args.port, args.host)
+    print(f'Metrics of {args.log} served on http://{args.host}:{args.port}/metrics')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
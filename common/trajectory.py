@@ -0,0 +1,85 @@
+"""
+Anytime trajectory of a run, stored under the 'trajectory' key of the result dict as a list of
+[elapsed seconds, best objective, best bound] events, one each time the objective or the bound
+improves. Elapsed seconds are counted from the start of the engine (model building included),
+the objective is None until the first solution and the bound None when the engine proves none.
+Every event is also published as an 'incumbent' event of the telemetry (common/telemetry.py)
+and, in a portfolio, to the incumbent bus (common/bus.py), whose bounds must hold for the whole
+problem: the bound of an engine whose model limits the routes (CSP, SAT and SMT allow at most
+ceil(1.5 n / m) items per courier) only holds for that model and stays in its trajectory.
+"""
+from common.bus import publish
+from common.telemetry import emit
+
+
+def add_event(trajectory, elapsed, obj, bound, shared=True):
+    """
+    Append an event to the trajectory, unless the objective and the bound did not change.
+    :param shared: False if the bound only holds for the model of the engine, which then publishes
+                   its objective alone to the bus
+    """
+    if trajectory and trajectory[-1][1:] == [obj, bound]:
+        return
+    trajectory.append([round(elapsed, 3), obj, bound])
+    emit('incumbent', obj=obj, bound=bound, elapsed=round(elapsed, 3))
+    publish(obj, bound if shared else None)
+
+
+def objective_at(trajectory, elapsed):
+    """
+    Return the best objective known after the given seconds, None if there was none yet.
+    """
+    obj = None
+    for event_time, event_obj, _ in trajectory:
+        if event_time > elapsed:
+            break
+        if event_obj is not None:
+            obj = event_obj
+    return obj
+
+
+def primal_gap(obj, reference):
+    # 1 without a solution, otherwise the relative distance from the reference objective
+    if obj is None:
+        return 1.0
+    if obj == reference:
+        return 0.0
+    return min(1.0, abs(obj - reference) / max(abs(obj), abs(reference)))
+
+
+def primal_integral(trajectory, horizon, reference):
+    """
+    Return the primal integral of the run over [0, horizon] seconds: the area under the primal gap,
+    with reference the best objective known for the instance (e.g. the best among all the engines).
+    It is small for engines finding good solutions early, horizon for engines finding none.
+    """
+    integral = 0.0
+    last_time, last_gap = 0.0, 1.0
+    for event_time, obj, _ in trajectory:
+        event_time = min(event_time, horizon)
+        integral += (event_time - last_time) * last_gap
+        last_time = event_time
+        if obj is not None:
+            last_gap = primal_gap(obj, reference)
+    integral += (horizon - last_time) * last_gap
+    return integral
+
+
+def step_points(trajectory, horizon):
+    """
+    Return the (times, objectives) of the objective-vs-time step curve, up to horizon seconds.
+    """
+    times, objectives = [], []
+    for event_time, obj, _ in trajectory:
+        if obj is None or event_time > horizon:
+            continue
+        if objectives:
+            # Horizontal step until the new objective
+            times.append(event_time)
+            objectives.append(objectives[-1])
+        times.append(event_time)
+        objectives.append(obj)
+    if objectives:
+        times.append(horizon)
+        objectives.append(objectives[-1])
+    return times, objectives
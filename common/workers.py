@@ -0,0 +1,345 @@
+import time
+import atexit
+import _thread
+import itertools
+import importlib
+import threading
+import multiprocessing
+from queue import Empty
+from common.bus import attach_bus, detach_bus, joined
+from common.memory import apply_address_limit, memory_limit_mb, rss_mb
+from common.metrics import new_metrics, record
+from common.profiling import report_interrupted
+
+# Seconds given to an engine to return its incumbent once interrupted, before the worker is killed
+GRACE = 10
+# Seconds between two checks of the resident memory of the worker against the memory limit
+MEMORY_POLL = 0.5
+
+# Entry point of each engine inside a worker: (module, function, position of the incumbent channel)
+# The channel is passed where the engine expects its result list (SAT, SMT) or queue (MIP).
+ENGINE_TARGETS = {
+    'MIP': ('MIP.mip_model', 'mip_model', 'queue'),
+    'SAT': ('SAT.SAT', 'solve_instance_sat', 0),
+    'SMT': ('SMT.smt', 'optimize_courier_routes', 0),
+}
+
+# How to stop the solver currently running in this process, registered by the engine itself
+_interrupt_callback = None
+# Task currently solved by this worker process
+_current_task = None
+
+
+def set_interrupt(callback):
+    """
+    Register the function that stops the solver running in this process, e.g. the interrupt
+    of the z3 context or the termination of the Gurobi model. Pass None once the solver is done.
+    """
+    global _interrupt_callback
+    _interrupt_callback = callback
+
+
+def interrupt():
+    if _interrupt_callback is not None:
+        _interrupt_callback()
+
+
+class _Channel:
+    # Forwards every incumbent of the engine to the parent process as soon as it is found
+    def __init__(self, results, task_id):
+        self.results = results
+        self.task_id = task_id
+        self.sent = False
+
+    def append(self, res):
+        self.results.put(('incumbent', self.task_id, res))
+        self.sent = True
+
+    put = append
+
+
+def _watchdog(timeout, done, expired, memory_exceeded):
+    # Interrupts the solver once the time is over. An interrupt that arrives while the engine
+    # is still building its model in Python is lost, so after a second the main thread itself
+    # is interrupted as well (KeyboardInterrupt), every second until the engine returns.
+    # Going over the memory limit of the job ends it the same way
+    deadline = time.time() + timeout
+    limit = memory_limit_mb()
+    while True:
+        wait = max(0.0, deadline - time.time())
+        if done.wait(min(wait, MEMORY_POLL) if limit else wait):
+            return
+        if limit and not expired.is_set() and not memory_exceeded and rss_mb() > limit:
+            memory_exceeded.append(round(rss_mb(), 1))
+            deadline = time.time()
+        if time.time() < deadline:
+            continue
+        if expired.is_set():
+            _thread.interrupt_main()
+        expired.set()
+        interrupt()
+        deadline = time.time() + 1
+
+
+def _listen(control):
+    # Interrupts requested by the parent process, served while the main thread is solving
+    while True:
+        task_id = control.get()
+        if task_id == _current_task:
+            interrupt()
+
+
+def _worker_loop(engine, tasks, results, control):
+    global _current_task
+    module, function, channel_position = ENGINE_TARGETS[engine]
+    # The engine (and its solver library) is imported once for the whole life of the worker
+    target = getattr(importlib.import_module(module), function)
+    threading.Thread(target=_listen, args=(control,), daemon=True).start()
+    # A runaway model fails in this worker instead of exhausting the memory of the host
+    apply_address_limit()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, args, kwargs, timeout, bus = task
+        _current_task = task_id
+        if bus is not None:
+            # Submitted from a portfolio: the engine publishes to and reads from its incumbent bus
+            attach_bus(*bus)
+
+        channel = _Channel(results, task_id)
+        if isinstance(channel_position, int):
+            args = list(args)
+            args.insert(channel_position, channel)
+        else:
+            kwargs[channel_position] = channel
+
+        # The hard timeout is enforced from inside the worker by interrupting the solver
+        done = threading.Event()
+        expired = threading.Event()
+        # Resident memory of the worker when it went over the memory limit of the job, if it did
+        memory_exceeded = []
+        watchdog = threading.Thread(target=_watchdog, args=(timeout, done, expired, memory_exceeded), daemon=True)
+        start = time.time()
+        watchdog.start()
+        try:
+            try:
+                target(*args, **kwargs)
+            finally:
+                done.set()
+                watchdog.join()
+            message = ('done', task_id, None)
+        except KeyboardInterrupt:
+            message = ('done', task_id, None)
+        except MemoryError:
+            # The address space limit was hit: the model does not fit in memory
+            memory_exceeded.append(round(rss_mb(), 1))
+            message = ('done', task_id, None)
+        except Exception as e:
+            # Solvers may also stop by raising once interrupted (e.g. z3 'canceled'), that is a timeout
+            if expired.is_set():
+                message = ('done', task_id, None)
+            else:
+                message = ('error', task_id, repr(e))
+        _current_task = None
+        set_interrupt(None)
+        detach_bus()
+        _absorb_interrupt(watchdog)
+        if memory_exceeded:
+            results.put(('memory_limit', task_id, memory_exceeded[0]))
+        if message[0] == 'done' and not channel.sent:
+            # Stopped before the engine reached its search: the whole time went into building the model
+            metrics = new_metrics()
+            metrics['build_time'] = time.time() - start
+            profile = report_interrupted()
+            if profile:
+                metrics['profile'] = profile
+            results.put(('incumbent', task_id, {'time': 0, 'optimal': False, 'obj': 'N/A', 'sol': [],
+                                                'metrics': record(metrics)}))
+        results.put(message)
+
+
+def _absorb_interrupt(watchdog):
+    # A KeyboardInterrupt requested by the watchdog just before it stopped is delivered here,
+    # instead of in the middle of the next task
+    while True:
+        try:
+            watchdog.join()
+            time.sleep(0.01)
+            return
+        except KeyboardInterrupt:
+            pass
+
+
+class Worker:
+    """
+    A long-lived process running the tasks of a single engine, one at a time.
+    """
+    _task_ids = itertools.count()
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.task_id = None
+        self._spawn()
+
+    def _spawn(self):
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.control = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_worker_loop,
+                                               args=(self.engine, self.tasks, self.results, self.control),
+                                               daemon=True)
+        self.process.start()
+
+    @property
+    def busy(self):
+        return self.task_id is not None
+
+    def submit(self, args, kwargs, timeout, bus=None):
+        self.task_id = next(self._task_ids)
+        self.tasks.put((self.task_id, args, kwargs, timeout, bus))
+        return self.task_id
+
+    def poll(self, wait=0.0):
+        """
+        Return the messages of the current task received within wait seconds,
+        as (kind, payload) pairs where kind is 'incumbent', 'memory_limit', 'done' or 'error'.
+        """
+        messages = []
+        try:
+            while True:
+                kind, task_id, payload = self.results.get(timeout=wait)
+                wait = 0.0
+                # Messages of a task given up before its end are dropped
+                if task_id == self.task_id:
+                    messages.append((kind, payload))
+                    if kind in ('done', 'error'):
+                        self.task_id = None
+        except Empty:
+            pass
+        if self.busy and not self.process.is_alive():
+            messages.append(('error', f'worker exited with code {self.process.exitcode}'))
+            self.task_id = None
+            self._spawn()
+        return messages
+
+    def interrupt(self):
+        self.control.put(self.task_id)
+
+    def kill(self):
+        # Last resort for a solver ignoring its interrupt: the worker is replaced by a fresh one
+        self.process.kill()
+        self.process.join()
+        self.task_id = None
+        self._spawn()
+
+    def close(self):
+        if self.process.is_alive():
+            self.tasks.put(None)
+            self.process.join(GRACE)
+            if self.process.is_alive():
+                self.process.kill()
+
+
+class WorkerPool:
+    """
+    A pool of warm workers of one engine, so that the engine is imported and initialised once
+    instead of once per instance.
+    """
+
+    def __init__(self, engine, size=1):
+        self.engine = engine
+        self.workers = [Worker(engine) for _ in range(size)]
+        # Several threads may solve on the pool at the same time, each on a worker of its own
+        self.lock = threading.Lock()
+
+    def resize(self, size):
+        with self.lock:
+            while len(self.workers) < size:
+                self.workers.append(Worker(self.engine))
+
+    def idle_worker(self):
+        for worker in self.workers:
+            if not worker.busy:
+                return worker
+        return None
+
+    def solve(self, args, kwargs=None, timeout=300, monitor=None):
+        """
+        Solve a task on an idle worker and return the last incumbent found (None if there is none).
+        The worker interrupts its solver after timeout seconds; if the solver still does not
+        return within GRACE seconds it is interrupted again and finally killed and respawned.
+        An optional monitor (see common/scheduler.py) is given every incumbent with
+        monitor.incumbent(res) and may stop the solver earlier by returning True from monitor.should_stop().
+        """
+        with self.lock:
+            worker = self.idle_worker()
+            if worker is None:
+                # More threads solve at the same time than the pool was sized for, e.g. portfolios
+                worker = Worker(self.engine)
+                self.workers.append(worker)
+            # The incumbent bus joined by the calling thread, if any, is joined by the worker too
+            worker.submit(args, dict(kwargs or {}), timeout, joined())
+
+        res = None
+        start = time.time()
+        interrupted = False
+        stopped = False
+        memory = None
+        while worker.busy:
+            for kind, payload in worker.poll(wait=0.5):
+                if kind == 'incumbent':
+                    res = payload
+                    if monitor is not None:
+                        monitor.incumbent(payload)
+                elif kind == 'memory_limit':
+                    memory = payload
+                elif kind == 'error':
+                    print(f'{self.engine} worker: {payload}')
+            elapsed = time.time() - start
+            if worker.busy and monitor is not None and not stopped and monitor.should_stop():
+                # Pre-empted: the solver is interrupted as on a timeout and returns its last incumbent
+                worker.interrupt()
+                stopped = True
+                start = time.time() - timeout
+            elif worker.busy and elapsed > timeout + GRACE and not interrupted:
+                worker.interrupt()
+                interrupted = True
+            elif worker.busy and elapsed > timeout + 2 * GRACE:
+                print(f'{self.engine} worker not responding, restarting it')
+                worker.kill()
+        if memory is not None:
+            # Stopped by the memory limit of the job: the best solution found so far is kept
+            res = dict(res or {'time': 0, 'optimal': False, 'obj': 'N/A', 'sol': []})
+            res['status'] = 'memory_limit'
+            res['memory'] = {'limit_mb': memory_limit_mb(), 'rss_mb': memory}
+        return res
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+_pools = {}
+
+
+def get_pool(engine, size=1):
+    """
+    Return the pool of warm workers of the engine, with at least size workers,
+    started on first use and closed at exit.
+    """
+    if engine not in _pools:
+        _pools[engine] = WorkerPool(engine, size)
+    elif len(_pools[engine].workers) < size:
+        _pools[engine].resize(size)
+    return _pools[engine]
+
+
+def close_pools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+
+atexit.register(close_pools)
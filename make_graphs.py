@@ -1,12 +1,21 @@
 import os
-import json
-import pathlib as pl
 import numpy as np
 import matplotlib.pyplot as plt
+from common.result_store import open_store
+from common.trajectory import primal_integral, objective_at, step_points
 
 # Define the directory where 'res' folder is located
 base_dir = 'res' 
 
+
+def load_results():
+    # Results read from the result store, as {approach: {instance_id: {solver: res}}}
+    data = {}
+    with open_store(folder=base_dir) as store:
+        for instance_id, approach, solver, res in store.results():
+            data.setdefault(approach, {}).setdefault(instance_id, {})[solver] = res
+    return data
+
 def make_plot(data):
     # Prepare the data for plotting
     models = list(data.keys())
@@ -38,35 +47,25 @@ def plot_all():
     # Initialize dictionaries to store results
     model_data = {}
 
-    # Traverse through each model folder
-    for model_folder in os.listdir(base_dir):
-        model_path = os.path.join(base_dir, model_folder)
-
-        if os.path.isdir(model_path):
-            model_data[model_folder] = {}
-
-            # Initialize lists for time and obj values for each solver
-            for filename in os.listdir(model_path):
-                if filename.endswith('.json'):
-                    json_file = os.path.join(model_path, filename)
-
-                    # Read and parse JSON file
-                    with open(json_file, 'r') as f:
-                        data = json.load(f)
+    # Traverse through the results of each model
+    for model_folder, instances in load_results().items():
+        model_data[model_folder] = {}
 
-                        for key, value in data.items():
-                            solver_name = key
-                            time_value = value.get('time')
-                            obj_value = value.get('obj')
+        # Initialize lists for time and obj values for each solver
+        for instance_id, data in instances.items():
+            for key, value in data.items():
+                solver_name = key
+                time_value = value.get('time')
+                obj_value = value.get('obj')
 
-                            if solver_name not in model_data[model_folder]:
-                                model_data[model_folder][solver_name] = {'time': [], 'obj': []}
+                if solver_name not in model_data[model_folder]:
+                    model_data[model_folder][solver_name] = {'time': [], 'obj': []}
 
-                            if time_value is not None:
-                                model_data[model_folder][solver_name]['time'].append(time_value)
+                if time_value is not None:
+                    model_data[model_folder][solver_name]['time'].append(time_value)
 
-                            if obj_value is not None:
-                                model_data[model_folder][solver_name]['obj'].append(obj_value)
+                if obj_value is not None:
+                    model_data[model_folder][solver_name]['obj'].append(obj_value)
 
     # Print or use the collected data as needed
     for model, solver_data in model_data.items():
@@ -80,15 +79,12 @@ def plot_all():
 
 def plot_one(model):
 
-    data_dir = pl.Path(base_dir) / model
-
     # Get the data
-    data = {}
-
-    # load all json file
-    for file in data_dir.glob('*.json'):
-        with open(file) as f:
-            data[file.stem] = json.load(f)
+    data = load_results().get(model, {})
+    if not data:
+        # No results of the approach under res/ yet
+        print(f"No results for {model}, skipping its graph")
+        return
 
     instance_number = len(data)
 
@@ -142,12 +138,97 @@ def plot_one(model):
 
     # plt.show()
 
+def best_objectives(results):
+    # Best objective found on each instance by any approach, the reference of the primal gaps
+    best = {}
+    for instances in results.values():
+        for instance_id, data in instances.items():
+            for value in data.values():
+                if isinstance(value.get('obj'), int):
+                    best[instance_id] = min(best.get(instance_id, value['obj']), value['obj'])
+    return best
+
+
+def plot_trajectories(instance_id, horizon=300):
+    # Objective found over time by each approach and solver on an instance
+    results = load_results()
+    plt.figure(figsize=(20, 10))
+    plotted = False
+    for model, instances in results.items():
+        for solver, value in instances.get(instance_id, {}).items():
+            times, objectives = step_points(value.get('trajectory', []), horizon)
+            if times:
+                plt.step(times, objectives, where='post', label=f'{model} - {solver}', linewidth=3)
+                plotted = True
+    if not plotted:
+        plt.close()
+        return
+
+    fontsize = 20
+    plt.grid()
+    plt.xscale('symlog', linthresh=1)
+    plt.title(f"Objective over time on {instance_id}", weight="bold", fontsize=fontsize)
+    plt.xlabel("Time (in sec)", weight="bold", fontsize=fontsize)
+    plt.ylabel("Objective", weight="bold", fontsize=fontsize)
+    plt.legend(fontsize=fontsize)
+    os.makedirs('graphs', exist_ok=True)
+    plt.savefig(f"graphs/{instance_id}_trajectory.png", dpi=500)
+    plt.close()
+
+
+def plot_primal_integrals(horizon=300, early=10):
+    # Mean primal integral of each approach and solver over the instances with a trajectory:
+    # the lower, the sooner the approach finds good solutions
+    results = load_results()
+    best = best_objectives(results)
+    integrals = {}
+    early_solved = {}
+    for model, instances in results.items():
+        for instance_id, data in instances.items():
+            if instance_id not in best:
+                continue
+            for solver, value in data.items():
+                if 'trajectory' not in value:
+                    continue
+                label = f'{model} - {solver}'
+                integrals.setdefault(label, []).append(primal_integral(value['trajectory'], horizon, best[instance_id]))
+                # Instances where the best known objective was already reached after `early` seconds
+                early_solved[label] = early_solved.get(label, 0) + (objective_at(value['trajectory'], early) == best[instance_id])
+    if not integrals:
+        return
+
+    labels = sorted(integrals)
+    means = [np.mean(integrals[label]) for label in labels]
+    for label, mean in zip(labels, means):
+        print(f"{label}: mean primal integral {mean:.1f} over {len(integrals[label])} instances, "
+              f"best objective within {early} s on {early_solved[label]}")
+
+    fontsize = 20
+    plt.figure(figsize=(20, 10))
+    plt.grid(axis='y')
+    plt.bar(labels, means)
+    plt.title(f"Mean primal integral over {horizon} s", weight="bold", fontsize=fontsize)
+    plt.ylabel("Primal integral", weight="bold", fontsize=fontsize)
+    plt.xticks(fontsize=fontsize, rotation=30)
+    plt.yticks(fontsize=fontsize)
+    plt.tight_layout()
+    os.makedirs('graphs', exist_ok=True)
+    plt.savefig("graphs/primal_integral.png", dpi=500)
+    plt.close()
+
+
 def main():
     plot_all()
     plot_one('CSP')
     plot_one('SAT')
     plot_one('SMT')
     plot_one('MIP')
+    plot_one('HEUR')
+    plot_one('DECOMP')
+    plot_one('PORTFOLIO')
+    plot_primal_integrals()
+    for instance_id in sorted(best_objectives(load_results())):
+        plot_trajectories(instance_id)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,284 @@
+import os
+import time
+import argparse
+import multiprocessing
+from queue import Empty
+from common.certify import enable_lp_bound
+from common.memory import apply_address_limit, memory_limit_mb, memory_limit_result, set_memory_limit
+from common.preprocess import set_neighbours
+from common.profiling import enable_profiling
+from common.scheduler import BudgetScheduler
+from common.telemetry import emit, enable_telemetry, serve_from_env
+from common.result_store import config_key
+from common.runner import instance_files, instance_key, get_store, job_config, solve_instance, store_result, INSTANCES_FOLDER
+from PORTFOLIO.portfolio import PORTFOLIO_ENGINES
+
+APPROACHES = ['MIP', 'SAT', 'SMT', 'CSP', 'HEUR', 'DECOMP', 'PORTFOLIO']
+CSP_SOLVERS = ['gecode', 'chuffed']
+
+
+def parse_indices(values):
+    # Accepts instance numbers and ranges, e.g. 1 3 5-8
+    indices = []
+    for value in values:
+        if '-' in value:
+            first, last = value.split('-')
+            indices += list(range(int(first), int(last) + 1))
+        else:
+            indices.append(int(value))
+    return indices
+
+
+def read_size(instance_path):
+    # Only the first two lines are needed to prioritize the jobs
+    with open(instance_path, 'r') as file:
+        m = int(file.readline().strip())
+        n = int(file.readline().strip())
+    return m, n
+
+
+def job_cores(approach, solver, args, m):
+    # Cores reserved by a job: MIP runs with as many threads as its reservation
+    if approach == 'MIP':
+        return args.mip_cores
+    if approach == 'CSP' and solver == 'portfolio':
+        return args.portfolio_cores
+    if approach == 'DECOMP':
+        # A thread per courier at most
+        return min(args.decomp_cores, m)
+    if approach == 'PORTFOLIO':
+        # A core for each engine of the portfolio
+        return len(PORTFOLIO_ENGINES)
+    return 1
+
+
+def batch_config(args, approach, instance_id):
+    # Options the result of a job depends on: the timeout, or the budget and cores of a scheduled
+    # batch, and the encoding of its model
+    if args.budget:
+        return dict(job_config(approach, instance_id) or {}, budget=args.budget, cores=args.cores)
+    return job_config(approach, instance_id, args.timeout)
+
+
+def make_jobs(args):
+    """
+    Expand the (approach, solver, instance) matrix into the list of jobs still to solve with the
+    options of the batch, the largest instances first so that the longest jobs do not end up at the tail of the batch.
+    """
+    filenames = instance_files()
+    if args.instances:
+        filenames = [filenames[index - 1] for index in parse_indices(args.instances) if 0 < index <= len(filenames)]
+
+    instances = []
+    for filename in filenames:
+        instance_id = os.path.splitext(filename)[0]
+        instance_path = os.path.join(INSTANCES_FOLDER, filename)
+        instances.append((instance_id, instance_path, instance_key(instance_id)[0], read_size(instance_path)))
+
+    jobs = []
+    store = get_store()
+    for approach in args.approaches:
+        solvers = args.solvers if approach == 'CSP' else ['Default']
+        configs = {instance[0]: batch_config(args, approach, instance[0]) for instance in instances}
+        groups = {}
+        for instance in instances:
+            groups.setdefault(config_key(configs[instance[0]]), []).append(instance)
+        for solver in solvers:
+            # One indexed query per (approach, solver, config) tells which instances are still to solve
+            unsolved = set()
+            for group in groups.values():
+                unsolved.update(store.unsolved([instance[2] for instance in group], approach, solver,
+                                               configs[group[0][0]]))
+            for instance_id, instance_path, hash_value, (m, n) in instances:
+                if hash_value not in unsolved:
+                    print(f'Skipping instance: {instance_id} with approach: {approach} and solver {solver} as it has already been solved.')
+                    continue
+                jobs.append({
+                    'approach': approach,
+                    'solver': solver,
+                    'instance_id': instance_id,
+                    'instance_path': instance_path,
+                    'size': (n, m),
+                    'cores': min(job_cores(approach, solver, args, m), args.cores),
+                    'config': configs[instance_id],
+                })
+
+    jobs.sort(key=lambda job: job['size'], reverse=True)
+    return jobs
+
+
+def run_job(job, timeout, queue):
+    # Each job runs in a process of its own, which imports only the engine of its approach. The
+    # MIP, SAT and SMT engines solve on a warm worker of the job process (common/workers.py),
+    # whose watchdog stops a job going over the memory limit and keeps its best solution
+    apply_address_limit()
+    try:
+        res = solve_instance(job['approach'], job['solver'], job['instance_id'], job['instance_path'],
+                             timeout=timeout, cores=job['cores'], warm=True)
+    except MemoryError:
+        # An engine running in the job process itself went over its address space limit
+        res = memory_limit_result(None, memory_limit_mb())
+    queue.put((job['instance_id'], job['approach'], job['solver'], res))
+
+
+def failed_result(timeout, status, exitcode=None):
+    # Result of a job that ended without putting a result on the queue: crashed ('error') or
+    # killed well past its timeout ('timeout'), counted as a timeout without a solution
+    res = {'time': timeout, 'optimal': False, 'obj': 'N/A', 'sol': [], 'status': status}
+    if exitcode is not None:
+        res['exitcode'] = exitcode
+    return res
+
+
+def run_batch(jobs, cores, timeout=300, poll=1.0):
+    """
+    Run the jobs on a pool of `cores` cores, each job reserving job['cores'] of them.
+    Jobs are started in order; smaller jobs may overtake a job waiting for cores (backfilling)
+    until that job has waited for a whole timeout, so that large reservations are not starved.
+    """
+    queue = multiprocessing.Queue()
+    pending = list(jobs)
+    running = {}
+    free = cores
+    blocked_since = None
+    # Jobs whose result was stored, and the jobs killed past their timeout
+    stored = set()
+    killed = set()
+    configs = {(job['instance_id'], job['approach'], job['solver']): job['config'] for job in jobs}
+
+    def store(instance_id, approach, solver, res):
+        # Only the parent process writes the result files, so parallel jobs never race on them
+        stored.add((instance_id, approach, solver))
+        store_result(approach, instance_id, solver, res, configs[instance_id, approach, solver])
+
+    queued = None
+    while pending or running:
+        if queued != (len(pending), len(running)):
+            queued = (len(pending), len(running))
+            emit('queue', pending=len(pending), running=len(running), free_cores=free)
+
+        # Start the jobs that fit in the free cores, in order
+        for job in list(pending):
+            first = job is pending[0]
+            if job['cores'] <= free:
+                process = multiprocessing.Process(target=run_job, args=(job, timeout, queue))
+                process.start()
+                running[process] = (job, time.time())
+                free -= job['cores']
+                pending.remove(job)
+                if first:
+                    blocked_since = None
+                print(f"Processing instance: {job['instance_id']} with approach: {job['approach']} and solver {job['solver']} ({job['cores']} cores)")
+            elif first:
+                # The first job waits for cores: stop overtaking it once it has waited a whole timeout
+                blocked_since = blocked_since or time.time()
+                if time.time() - blocked_since >= timeout:
+                    break
+
+        # Store the results of the finished jobs
+        try:
+            instance_id, approach, solver, res = queue.get(timeout=poll)
+            print(f'Result for {instance_id} with approach: {approach} and solver {solver}: {res}')
+            store(instance_id, approach, solver, res)
+        except Empty:
+            pass
+
+        # Free the cores of the finished jobs, killing the ones stuck well past the timeout
+        ended = []
+        for process, (job, start) in list(running.items()):
+            if process.is_alive() and time.time() - start > timeout + 60:
+                print(f"Killing instance: {job['instance_id']} with approach: {job['approach']} and solver {job['solver']}")
+                process.terminate()
+                killed.add(process)
+                emit('timeout', approach=job['approach'], solver=job['solver'], instance=job['instance_id'],
+                     killed=True, wall_time=round(time.time() - start, 3))
+            if not process.is_alive():
+                process.join()
+                free += job['cores']
+                del running[process]
+                ended.append((process, job))
+
+        if ended:
+            # A job puts its result on the queue before it ends: the results still queued are
+            # stored first, and the jobs left without one get a failed result
+            try:
+                while True:
+                    store(*queue.get(timeout=0.1))
+            except Empty:
+                pass
+            for process, job in ended:
+                if (job['instance_id'], job['approach'], job['solver']) in stored:
+                    continue
+                status = 'timeout' if process in killed else 'error'
+                print(f"No result for {job['instance_id']} with approach: {job['approach']} and solver {job['solver']} "
+                      f"({status}, exit code {process.exitcode})")
+                if status == 'error':
+                    # The job crashed: it ends as a timeout without a solution
+                    emit('timeout', approach=job['approach'], solver=job['solver'], instance=job['instance_id'],
+                         error=True, exitcode=process.exitcode)
+                store(job['instance_id'], job['approach'], job['solver'],
+                      failed_result(timeout, status, process.exitcode))
+                killed.discard(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve the (approach, solver, instance) matrix in parallel.')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='cores available to the batch')
+    parser.add_argument('--approaches', nargs='+', default=APPROACHES, choices=APPROACHES + ['AUTO'])
+    parser.add_argument('--solvers', nargs='+', default=CSP_SOLVERS, help='CSP solvers (gecode, chuffed, portfolio)')
+    parser.add_argument('--instances', nargs='+', help='instance numbers or ranges, e.g. 1 3 5-8 (all by default)')
+    parser.add_argument('--mip-cores', type=int, default=os.cpu_count(), help='cores reserved by a MIP job')
+    parser.add_argument('--portfolio-cores', type=int, default=4, help='cores reserved by a CSP portfolio job')
+    parser.add_argument('--decomp-cores', type=int, default=os.cpu_count(), help='cores reserved by a DECOMP job')
+    parser.add_argument('--timeout', type=int, default=300)
+    parser.add_argument('--budget', type=int, metavar='SECONDS',
+                        help='schedule the whole batch in SECONDS of wall-clock instead of a fixed timeout per job '
+                             '(one core per job), see common/scheduler.py')
+    parser.add_argument('--min-slice', type=int, default=10, help='shortest time slice of a scheduled job')
+    parser.add_argument('--max-slice', type=int, default=300, help='longest time slice of a scheduled job')
+    parser.add_argument('--profile', nargs='?', const='time', metavar='MODES',
+                        help='profile the model construction (time, cprofile, tracemalloc or all), see common/profiling.py')
+    parser.add_argument('--telemetry', nargs='?', const='telemetry.jsonl', metavar='LOG',
+                        help='append the job events to a JSON-lines log, see common/telemetry.py')
+    parser.add_argument('--metrics-port', type=int, help='serve the metrics of the log on localhost:PORT/metrics')
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help='memory allowed to every job, see common/memory.py')
+    parser.add_argument('--neighbours', type=int, metavar='K',
+                        help='build the SAT and MIP models on the arcs to the K nearest successors of each item, '
+                             'see common/preprocess.py')
+    parser.add_argument('--lp-bound', action='store_true',
+                        help='also certify the results with the LP relaxation bound, see common/certify.py')
+    args = parser.parse_args()
+    if args.memory_limit:
+        set_memory_limit(args.memory_limit)
+    if args.neighbours:
+        set_neighbours(args.neighbours)
+    if args.lp_bound:
+        enable_lp_bound()
+    if args.profile:
+        enable_profiling(args.profile)
+    if args.telemetry or args.metrics_port:
+        enable_telemetry(args.telemetry or 'telemetry.jsonl', args.metrics_port)
+        serve_from_env()
+
+    if args.budget:
+        # Results of a scheduled batch depend on its budget, they are kept apart from the fixed-timeout ones
+        jobs = make_jobs(args)
+        print(f'{len(jobs)} jobs to schedule on {args.cores} cores in {args.budget} s')
+        scheduler = BudgetScheduler(args.budget, args.cores, min_slice=args.min_slice, max_slice=args.max_slice)
+
+        def on_result(job, res):
+            print(f"Result for {job['instance_id']} with approach: {job['approach']} and solver {job['solver']}: "
+                  f"obj {res['obj']} optimal {res['optimal']} {res['scheduler']}")
+            store_result(job['approach'], job['instance_id'], job['solver'], res, job['config'])
+
+        scheduler.run(jobs, on_result)
+        return
+
+    jobs = make_jobs(args)
+    print(f'{len(jobs)} jobs to run on {args.cores} cores')
+    run_batch(jobs, args.cores, timeout=args.timeout)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,7 @@ import os
 import re
 import sys
 import json
-
-TIMEOUT = 300
-# OPT[i] = Optimal value for instance i. 
-OPT = [None, 14, 226, 12, 220, 206]
+from common.checker import TIMEOUT, check_all
 
 def read_json_file(file_path):
   try:
@@ -19,93 +16,66 @@ def read_json_file(file_path):
     print(f"Error: Unable to parse JSON from file '{file_path}'.")
     return None
 
-def main(args):
+def results_from_folder(results_folder):
   '''
-  check_solution.py <input folder> <results folder>
+  Yield (approach, results file name, results) for each .json file of the results folder.
   '''
-  #FIXME: Input folder contains the input files (in the format instXY.dat). 
-  #       The results folder contains the .json file of each approach. 
-  #       No other file should appear in these folders.
-  errors = []
-  warnings = []  
-  results_folder = args[2]
-  for subfolder in os.listdir(results_folder):
-    if subfolder.startswith('.'):
-      # Skip hidden folders.
+  for subfolder in sorted(os.listdir(results_folder)):
+    if subfolder.startswith('.') or not os.path.isdir(os.path.join(results_folder, subfolder)):
+      # Skip hidden folders and files.
       continue
-    folder = results_folder + subfolder
+    folder = os.path.join(results_folder, subfolder)
     print(f'\nChecking results in {folder} folder')
     for results_file in sorted(os.listdir(folder)):
       if results_file.startswith('.'):
         # Skip hidden folders.
         continue
-      results = read_json_file(folder + '/' + results_file)
-      print(f'\tChecking results for instance {results_file}')
-      inst_number = re.search('\d+', results_file).group()
-      if len(inst_number) == 1:
-        inst_number = '0' + inst_number
-      inst_path = args[1] + '/inst' + inst_number + '.dat'
-      print(f'\tLoading input instance {inst_path}')
-      with open(inst_path) as inst_file:
-        i = 0        
-        for line in inst_file:
-          if i == 0:
-            n_couriers = int(line)
-          elif i == 1:
-            n_items = int(line)
-            dist_matrix = [None] * (n_items + 1)
-          elif i == 2:
-            capacity = [int(x) for x in line.split()]
-            assert len(capacity) == n_couriers
-          elif i == 3:
-            sizes = [int(x) for x in line.split()]
-            assert len(sizes) == n_items
-          else:
-            row = [int(x) for x in line.split()]
-            assert len(row) == n_items + 1
-            dist_matrix[i-4] = [int(x) for x in row]
-          i += 1
-      for i in range(len(dist_matrix)):
-        assert dist_matrix[i][i] == 0
-      for solver, result in results.items():
-        print(f'\t\tChecking solver {solver}')
-        header = f'Solver {solver}, instance {inst_number}'
-        if result['time'] < 0 or result['time'] > TIMEOUT:
-          errors += [f"{header}: runtime unsound ({result['time']} sec.)"]
-        if 'sol' not in result or not result['sol'] or result['sol'] == 'N/A':
-          continue
-        max_dist = 0
-        n_collected = sum(len(p) for p in result['sol'])
-        if n_collected != n_items:
-          errors += [f"{header}: solution {result['sol']} collects {n_collected} instead of {n_items} items"]
-        courier_id = 0
-        for path in result['sol']:
-          dist = 0
-          path_size = 0
-          # Adjusting with origin point.
-          path = [n_items+1] + path + [n_items+1]          
-          for i in range(1, len(path)):
-            curr_item = path[i] - 1
-            prev_item = path[i-1] - 1            
-            dist += dist_matrix[prev_item][curr_item]
-            if i < len(path) - 1:
-              path_size += sizes[curr_item]
-          if path_size > capacity[courier_id]:
-            errors += [f"{header}: path {path} of courier {courier_id} has total size {path_size}, exceeding its capacity {capacity[courier_id]}"]
-          if dist > max_dist:
-            max_dist = dist
-            max_path = path
-            max_cour = courier_id
-          courier_id += 1
-        if max_dist != result['obj']:
-          errors += [f"{header}: objective value {result['obj']} inconsistent with max. distance {max_dist} of path {max_path}, courier {max_cour})"]
-        i = int(inst_number)
-        if i < 6:
-          if result['optimal']:
-            if result['obj'] != OPT[i]:
-              errors += [f"{header}: claimed optimal value {result['obj']} inconsistent with actual optimal value {OPT[i]})"]
-          else:
-            warnings += [f"{header}: instance {inst_number} not solved to optimality"]
+      yield subfolder, results_file, read_json_file(folder + '/' + results_file)
+
+def results_from_store(db_path):
+  '''
+  Yield (approach, results file name, results) for each instance of each approach in the result store.
+  '''
+  from common.result_store import ResultStore
+  with ResultStore(db_path) as store:
+    grouped = {}
+    for instance_id, approach, solver, res in store.results():
+      grouped.setdefault((approach, instance_id), {})[solver] = res
+  for (approach, instance_id), results in grouped.items():
+    yield approach, f'{instance_id}_result.json', results
+
+def instance_file(instances_folder, results_file):
+  '''
+  Path of the instance of a results file: {instance_id}_result.json holds the results of
+  {instance_id}.dat, the first number of the name giving instXY.dat otherwise.
+  '''
+  if results_file.endswith('_result.json'):
+    inst_path = os.path.join(instances_folder, results_file[:-len('_result.json')] + '.dat')
+    if os.path.exists(inst_path):
+      return inst_path
+  inst_number = re.search(r'\d+', results_file).group()
+  return os.path.join(instances_folder, f'inst{int(inst_number):02d}.dat')
+
+def main(args):
+  '''
+  check_solution.py <input folder> <results folder | result store .db file>
+  '''
+  # The results are grouped by instance, and the instances checked in parallel (common/checker.py)
+  results_source = args[2]
+  if os.path.isfile(results_source) and results_source.endswith('.db'):
+    all_results = results_from_store(results_source)
+  else:
+    all_results = results_from_folder(results_source)
+  groups = {}
+  for approach, results_file, results in all_results:
+    if results is None:
+      continue
+    inst_path = instance_file(args[1], results_file)
+    inst_name = os.path.splitext(os.path.basename(inst_path))[0]
+    for solver, result in results.items():
+      groups.setdefault(inst_path, []).append((f'{approach} solver {solver}, instance {inst_name}', result))
+  print(f'Checking {sum(len(results) for results in groups.values())} results of {len(groups)} instances')
+  errors, warnings = check_all(groups, timeout=TIMEOUT)
   print('\nCheck terminated.')
   if warnings:
     print('Warnings:')
@@ -120,4 +90,4 @@ def main(args):
   
   
 if __name__ == "__main__":
-    main(sys.argv)
\ No newline at end of file
+    main(sys.argv)
@@ -0,0 +1,41 @@
+"""
+Brute-force solutions of tiny instances, the reference of the tests.
+"""
+import itertools
+import numpy as np
+
+
+def shortest_route(items, D, n):
+    # Length of the shortest route through the items, from and back to the depot n
+    best = 0 if not items else None
+    for order in itertools.permutations(items):
+        path = [n, *order, n]
+        length = sum(D[a][b] for a, b in zip(path, path[1:]))
+        best = length if best is None else min(best, length)
+    return best
+
+
+def brute_force(m, n, l, s, D):
+    """
+    Return the optimal objective of a tiny instance over every assignment of the items to the
+    couriers (couriers may stay at the depot), None if no assignment fits the capacities.
+    """
+    best = None
+    for assignment in itertools.product(range(m), repeat=n):
+        routes = [[item for item in range(n) if assignment[item] == courier] for courier in range(m)]
+        if any(sum(s[item] for item in route) > l[courier] for courier, route in enumerate(routes)):
+            continue
+        obj = max(shortest_route(route, D, n) for route in routes)
+        best = obj if best is None else min(best, obj)
+    return best
+
+
+def random_instance(rng):
+    # Tiny instance with asymmetric distances, some of them longer than a detour
+    m = int(rng.integers(2, 4))
+    n = int(rng.integers(m + 1, 7))
+    s = rng.integers(1, 10, size=n)
+    l = rng.integers(int(s.max()), int(s.sum()) + 1, size=m)
+    D = rng.integers(1, 30, size=(n + 1, n + 1))
+    np.fill_diagonal(D, 0)
+    return m, n, l.tolist(), s.tolist(), D.tolist()
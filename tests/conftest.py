@@ -0,0 +1,43 @@
+"""
+Shared fixtures of the tests: the small instances of instances/ with their known optima, and
+random tiny instances solved by brute force, with asymmetric distances breaking the triangle
+inequality.
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common.instance import read_dat_file  # noqa: E402
+from brute_force import brute_force, random_instance  # noqa: E402
+
+# Optima of the first instances, proven by the MIP and CSP results of res/
+OPTIMA = {'inst01': 14, 'inst02': 226, 'inst03': 12, 'inst04': 220, 'inst05': 206,
+          'inst06': 322, 'inst07': 167, 'inst08': 186, 'inst09': 436, 'inst10': 244}
+
+
+def instance_path(instance_id):
+    return os.path.join(ROOT, 'instances', f'{instance_id}.dat')
+
+
+@pytest.fixture(scope='session')
+def small_instances():
+    # {instance_id: ((m, n, l, s, D), optimum)}
+    return {instance_id: (read_dat_file(instance_path(instance_id)), optimum)
+            for instance_id, optimum in OPTIMA.items()}
+
+
+@pytest.fixture(scope='session')
+def random_instances():
+    # [((m, n, l, s, D), optimum)] of the random instances that have a solution
+    rng = np.random.default_rng(2024)
+    instances = []
+    while len(instances) < 40:
+        instance = random_instance(rng)
+        optimum = brute_force(*instance)
+        if optimum is not None:
+            instances.append((instance, optimum))
+    return instances
@@ -0,0 +1,49 @@
+import pytest
+from common.bisection import Bisection
+
+
+def bisect(lower, upper, optimum, overshoot=0):
+    """
+    Run the bisection against an oracle of the given optimum (None if there is no solution), whose
+    solutions within k are overshoot above the optimum when possible, as a solver may return any.
+    :return: the bisection once closed, and the values probed
+    """
+    bisection = Bisection(lower, upper)
+    probed = []
+    while not bisection.closed():
+        k = bisection.next_guess()
+        assert k not in probed
+        probed.append(k)
+        if optimum is None or k < optimum:
+            bisection.unsat(k)
+        else:
+            bisection.sat(min(k, optimum + overshoot))
+        assert len(probed) <= 64
+    return bisection, probed
+
+
+@pytest.mark.parametrize('optimum', [10, 11, 17, 33, 40])
+@pytest.mark.parametrize('overshoot', [0, 3])
+def test_closes_on_the_optimum(optimum, overshoot):
+    bisection, _ = bisect(10, 40, optimum, overshoot)
+    assert bisection.proven()
+    assert bisection.best == optimum == bisection.bound
+
+
+def test_upper_bound_is_probed_once_without_a_solution():
+    bisection, probed = bisect(10, 40, None)
+    assert bisection.best is None and not bisection.proven()
+    assert bisection.upper_probed and probed[-1] == 40
+
+
+def test_lower_bound_met_by_the_first_solution():
+    bisection = Bisection(10, 40)
+    bisection.sat(10)
+    assert bisection.closed() and bisection.proven()
+
+
+def test_unsat_never_moves_the_bound_back():
+    bisection = Bisection(10, 40)
+    bisection.unsat(20)
+    bisection.unsat(15)
+    assert bisection.bound == 21
@@ -0,0 +1,38 @@
+from common.bounds import (compute_bounds, greedy_routes, lower_bound, packing_bound, pair_bound,
+                           route_length, route_limit, round_trip_bound, upper_bound)
+
+
+def test_bounds_enclose_the_known_optima(small_instances):
+    for instance_id, (instance, optimum) in small_instances.items():
+        m, n, l, s, D = instance
+        lower, upper = compute_bounds(m, n, l, s, D, max_items=route_limit(n, m))
+        assert lower <= optimum <= upper, instance_id
+
+
+def test_lower_bounds_hold_without_the_triangle_inequality(random_instances):
+    for (m, n, l, s, D), optimum in random_instances:
+        assert round_trip_bound(n, D) <= optimum
+        assert packing_bound(m, n, l, s, D) <= optimum
+        assert pair_bound(m, n, l, s, D) <= optimum
+        assert lower_bound(m, n, l, s, D) <= optimum
+
+
+def test_greedy_routes_are_feasible(small_instances):
+    for instance_id, ((m, n, l, s, D), _) in small_instances.items():
+        limit = route_limit(n, m)
+        routes = greedy_routes(m, n, l, s, D, max_items=limit)
+        if routes is None:
+            routes = greedy_routes(m, n, l, s, D, max_items=limit, packing=True)
+        assert routes is not None, instance_id
+        assert sorted(item for route in routes for item in route) == list(range(n))
+        for courier, route in enumerate(routes):
+            assert sum(s[item] for item in route) <= l[courier]
+            assert 1 <= len(route) <= limit
+        assert upper_bound(m, n, l, s, D, max_items=limit) == max(route_length(route, D, n) for route in routes)
+
+
+def test_upper_bound_is_an_objective(random_instances):
+    for instance, optimum in random_instances:
+        upper = upper_bound(*instance)
+        assert upper is None or upper >= optimum
+
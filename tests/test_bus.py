@@ -0,0 +1,28 @@
+from common.bus import IncumbentBus, join_bus, leave_bus, shared_bounds
+from common.trajectory import add_event
+
+
+def test_only_shared_bounds_reach_the_bus():
+    bus = IncumbentBus(2)
+    try:
+        join_bus(bus, 0)
+        trajectory = []
+        # A bound proven on the routes of a restricted model only
+        add_event(trajectory, 0.1, 20, 18, shared=False)
+        assert trajectory == [[0.1, 20, 18]]
+        assert (bus.upper(), bus.lower()) == (20, None)
+        assert not bus.proven()
+        add_event(trajectory, 0.2, 19, 12)
+        assert (bus.upper(), bus.lower()) == (19, 12)
+        assert shared_bounds(10, 25) == (12, 19)
+        join_bus(bus, 1)
+        add_event([], 0.3, 19, 19, shared=False)
+        assert not bus.proven()
+    finally:
+        leave_bus()
+        bus.close()
+
+
+def test_outside_a_portfolio_nothing_is_shared():
+    add_event([], 0.1, 20, 18)
+    assert shared_bounds(10, 25) == (10, 25)
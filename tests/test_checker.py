@@ -0,0 +1,67 @@
+from common.checker import check_instance, check_result
+
+
+def objective(sol, n, D):
+    # Longest route of a solution of 1-based items
+    paths = [[n] + [item - 1 for item in route] + [n] for route in sol]
+    return max(sum(D[a][b] for a, b in zip(path, path[1:])) for path in paths)
+
+
+def result(sol=((1, 3, 4), (2, 5, 6)), obj=14, **changes):
+    # A result of inst01 (2 couriers of capacities 15 and 10, 6 items), optimal by default
+    res = {'time': 3, 'optimal': True, 'obj': obj, 'sol': [list(route) for route in sol]}
+    res.update(changes)
+    return res
+
+
+def test_optimal_solution_passes(small_instances):
+    instance, _ = small_instances['inst01']
+    assert check_result(result(), *instance) == []
+
+
+def test_objective_must_be_the_longest_route(small_instances):
+    instance, _ = small_instances['inst01']
+    errors = check_result(result(obj=20, optimal=False), *instance)
+    assert any('inconsistent with max. distance' in error for error in errors)
+
+
+def test_items_delivered_once(small_instances):
+    instance, _ = small_instances['inst01']
+    errors = check_result(result(sol=[[1, 3, 4, 2], [2, 5, 6]]), *instance)
+    assert any('delivered more than once' in error for error in errors)
+    errors = check_result(result(sol=[[1, 3], [2, 5, 6]]), *instance)
+    assert any('not delivered' in error for error in errors)
+
+
+def test_capacities(small_instances):
+    (m, n, l, s, D), _ = small_instances['inst01']
+    sol = [[], [1, 2, 3, 4, 5, 6]]
+    errors = check_result(result(sol=sol, obj=objective(sol, n, D), optimal=False), m, n, l, s, D)
+    assert any('exceeding its capacity' in error for error in errors)
+
+
+def test_time_within_the_timeout(small_instances):
+    instance, _ = small_instances['inst01']
+    assert check_result(result(time=301), *instance)
+    assert check_result(result(time=40), *instance, timeout=30)
+    assert check_result(result(time=30), *instance, timeout=30) == []
+
+
+def test_objective_below_the_bound(small_instances):
+    instance, _ = small_instances['inst01']
+    errors, _ = check_instance(*instance, [('A', result())], bound=15)
+    assert any('below the certified lower bound' in error for error in errors)
+
+
+def test_claimed_optima_must_agree(small_instances):
+    (m, n, l, s, D), _ = small_instances['inst01']
+    worse = [[3, 4, 1], [2, 5, 6]]
+    obj = objective(worse, n, D)
+    assert obj > 14
+    results = [('A', result()), ('B', result(sol=worse, obj=obj))]
+    errors, _ = check_instance(m, n, l, s, D, results)
+    assert any(error.startswith('B: claimed optimal value') for error in errors)
+    results[1][1]['optimal'] = False
+    errors, warnings = check_instance(m, n, l, s, D, results)
+    assert errors == []
+    assert any(warning.startswith('B: not solved to optimality') for warning in warnings)
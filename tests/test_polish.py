@@ -0,0 +1,47 @@
+import numpy as np
+from brute_force import shortest_route
+from common.polish import MAX_DP_ITEMS, held_karp, path_length, polish_result, polish_route, route_path
+
+
+def random_matrix(rng, size):
+    # Asymmetric distances, breaking the triangle inequality
+    D = rng.integers(1, 100, size=(size, size))
+    np.fill_diagonal(D, 0)
+    return D
+
+
+def test_held_karp_finds_the_shortest_route():
+    rng = np.random.default_rng(7)
+    for k in range(0, 8):
+        D = random_matrix(rng, 9)
+        route = [int(item) for item in rng.permutation(8)[:k]]
+        order = held_karp(route, D, 8)
+        assert sorted(order) == sorted(route)
+        assert path_length(route_path(order, 8), D) == shortest_route(route, D.tolist(), 8)
+
+
+def test_polish_route_never_lengthens_a_route():
+    rng = np.random.default_rng(11)
+    for k in (MAX_DP_ITEMS, MAX_DP_ITEMS + 5, 30):
+        D = random_matrix(rng, k + 1)
+        route = [int(item) for item in rng.permutation(k)]
+        order, length = polish_route(route, D, k)
+        assert sorted(order) == sorted(route)
+        assert length == path_length(route_path(order, k), D) <= path_length(route_path(route, k), D)
+
+
+def test_polish_result_keeps_the_items_of_every_courier(small_instances):
+    (m, n, l, s, D), _ = small_instances['inst07']
+    D = np.asarray(D)
+    # A poor order of every route of a feasible assignment
+    sol = [list(range(courier + 1, n + 1, m))[::-1] for courier in range(m)]
+    obj = max(path_length(route_path([item - 1 for item in route], n), D) for route in sol)
+    res = polish_result({'time': 300, 'optimal': False, 'obj': obj, 'sol': [list(route) for route in sol]}, n, D)
+    assert [sorted(route) for route in res['sol']] == [sorted(route) for route in sol]
+    assert res['obj'] == max(path_length(route_path([item - 1 for item in route], n), D) for route in res['sol'])
+    assert res['obj'] <= obj and res['polish']['obj'] == obj
+
+
+def test_polish_result_leaves_results_without_a_solution():
+    res = {'time': 300, 'optimal': False, 'obj': 'N/A', 'sol': []}
+    assert polish_result(dict(res), 3, np.zeros((4, 4), dtype=int)) == res
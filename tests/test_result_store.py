@@ -0,0 +1,76 @@
+import os
+import shutil
+import pytest
+from common.instance import instance_key
+from common.preprocess import NEIGHBOURS
+from common.result_store import ResultStore, config_key
+from common.runner import run_config
+
+INSTANCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instances', 'inst01.dat')
+RESULT = {'time': 3, 'optimal': True, 'obj': 14, 'sol': [[1, 3, 4], [2, 5, 6]]}
+
+
+def write_instance(folder, name, swap_couriers=False, edit=False):
+    # A copy of inst01 (capacities 15 and 10), its couriers swapped or an item size changed
+    lines = open(INSTANCE).read().splitlines()
+    if swap_couriers:
+        lines[2] = ' '.join(reversed(lines[2].split()))
+    if edit:
+        lines[3] = '4' + lines[3][1:]
+    path = folder / f'{name}.dat'
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultStore(str(tmp_path / 'results.db')) as store:
+        yield store
+
+
+def test_copies_share_the_key_and_edits_do_not(tmp_path):
+    original = write_instance(tmp_path, 'a')
+    shutil.copy(original, tmp_path / 'b.dat')
+    assert instance_key(original) == instance_key(str(tmp_path / 'b.dat'))
+    assert instance_key(original)[0] != instance_key(write_instance(tmp_path, 'c', edit=True))[0]
+
+
+def test_courier_permuted_instances_share_their_results(tmp_path, store):
+    original = write_instance(tmp_path, 'a')
+    swapped = write_instance(tmp_path, 'b', swap_couriers=True)
+    (hash_a, order_a), (hash_b, order_b) = instance_key(original), instance_key(swapped)
+    assert hash_a == hash_b and order_a != order_b
+    store.put('a', hash_a, 'SAT', 'Default', RESULT, courier_order=order_a)
+    # Each route stays with the courier of the same capacity
+    assert store.get(hash_b, 'SAT', 'Default', courier_order=order_b)['sol'] == RESULT['sol'][::-1]
+    assert store.get(hash_a, 'SAT', 'Default', courier_order=order_a) == RESULT
+
+
+def test_results_are_keyed_by_config(store):
+    sparse = {'encoding': 'sparse', 'neighbours': 5}
+    store.put('a', 'hash', 'SAT', 'Default', RESULT)
+    assert store.is_solved('hash', 'SAT', 'Default')
+    assert not store.is_solved('hash', 'SAT', 'Default', sparse)
+    assert not store.is_solved('hash', 'SMT', 'Default')
+    store.put('a', 'hash', 'SAT', 'Default', dict(RESULT, obj=15, optimal=False), dict(reversed(sparse.items())))
+    assert store.get('hash', 'SAT', 'Default', sparse)['obj'] == 15
+    assert store.get('hash', 'SAT', 'Default')['obj'] == 14
+    assert store.unsolved(['hash', 'other'], 'SAT', 'Default', sparse) == ['other']
+    assert store.unsolved(['hash'], 'SAT', 'Default', sparse, optimal=True) == ['hash']
+
+
+def test_config_key_is_canonical():
+    assert config_key(None) == config_key({}) == ''
+    assert config_key({'timeout': 60, 'encoding': 'compact'}) == config_key({'encoding': 'compact', 'timeout': 60})
+
+
+def test_run_config_leaves_the_defaults_out(monkeypatch):
+    monkeypatch.delenv('CDMO_NEIGHBOURS', raising=False)
+    assert run_config() is None
+    assert run_config(60) == {'timeout': 60}
+    assert run_config(encoding='compact') == {'encoding': 'compact'}
+    assert run_config(encoding='sparse') == {'encoding': 'sparse', 'neighbours': NEIGHBOURS}
+    # No model fits the memory limit
+    assert run_config(encoding=None) == {'encoding': None}
+    monkeypatch.setenv('CDMO_NEIGHBOURS', '5')
+    assert run_config(encoding='sparse') == {'encoding': 'sparse', 'neighbours': 5}